@@ -3,6 +3,9 @@ import logging
 import urllib
 
 from .base import BaseClient, return_none_on
+from .dashboards import load_dashboard_graph
+from .plan import apply_plan, make_plan
+from .provisioning import provision
 
 log = logging.getLogger(__name__)
 
@@ -76,6 +79,14 @@ class AdminAPI(BaseClient):
         return self._get(
             '/module/{0}'.format(module_id))
 
+    def load_dashboard_graph(self, dashboard_id, workers=8):
+        """
+        Fetch a dashboard with all of its modules and their data sets,
+        concurrently and without repeating shared lookups. See
+        ``dashboards.load_dashboard_graph`` for the shape of the result.
+        """
+        return load_dashboard_graph(self, dashboard_id, workers=workers)
+
     def get_dashboards(self, params=None):
         return self._get('/dashboard', params=params)
 
@@ -122,5 +133,28 @@ class AdminAPI(BaseClient):
     def add_module_type(self, data):
         return self._post('/module-type', json.dumps(data))
 
+    def provision(self, definitions, workers=8):
+        """
+        Create a batch of data groups, data sets, transforms, dashboards
+        and modules, running independent creations concurrently. See
+        ``provisioning.provision`` for the definition format and report.
+        """
+        return provision(self, definitions, workers=workers)
+
+    def plan(self, desired, prune=False, workers=8):
+        """
+        Work out the writes needed to bring data sets, module types and
+        dashboards in line with ``desired``. Print ``plan.format()`` for a
+        readable summary. See ``plan.make_plan``.
+        """
+        return make_plan(self, desired, prune=prune, workers=workers)
+
+    def apply_plan(self, plan, workers=8):
+        """
+        Make the writes in ``plan`` concurrently. With ``dry_run`` set on
+        this client they are only logged.
+        """
+        return apply_plan(self, plan, workers=workers)
+
     def reauth(self, uid):
         return self._post('/auth/gds/api/users/{}/reauth'.format(uid), None)
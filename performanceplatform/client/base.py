@@ -1,15 +1,30 @@
 import datetime
+import gzip
 import json
 import logging
+import os
+import threading
+import time
+from collections import namedtuple
 from functools import wraps
+from io import BytesIO
 
 import backoff
 import pkg_resources
 import pytz
 import requests
 
+from .dryrun import DryRunReport, format_stats, measure, measure_encoded
+from .isolation import bisect_failures
+from .workers import ForkSafeLock, imap_bounded
+
 log = logging.getLogger(__name__)
 
+try:
+    _BUFFER_TYPES = (buffer,)
+except NameError:
+    _BUFFER_TYPES = ()
+
 
 class ChunkingError(Exception):
     def __init__(self, value):
@@ -19,11 +34,86 @@ class ChunkingError(Exception):
         return repr(self.value)
 
 
+class EncodedPayload(object):
+
+    """
+    A request body which is already JSON encoded and maybe compressed.
+
+    ``body`` may be bytes, a buffer (``bytearray``, ``memoryview``), an
+    ``mmap`` or an open file. Buffers and files are streamed from where
+    they are rather than copied into memory. ``records`` is the number of
+    records in the body, if it is known.
+    """
+
+    def __init__(self, body, content_encoding=None, records=None):
+        self.body = body
+        self.content_encoding = content_encoding
+        self.records = records
+
+    def __repr__(self):
+        length = _body_length(self.body)
+        return '<EncodedPayload {} bytes{}>'.format(
+            '?' if length is None else length,
+            ' ({})'.format(self.content_encoding)
+            if self.content_encoding else '')
+
+
+class BufferReader(object):
+
+    """
+    A read-only file over a buffer, so that it can be streamed in blocks
+    without copying the whole thing.
+    """
+
+    def __init__(self, buf):
+        self._view = memoryview(buf)
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def read(self, size=-1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        block = self._view[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return block
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        self._position = offset + (len(self) if whence == 2 else 0)
+
+
+ClientConfig = namedtuple('ClientConfig',
+                          'token dry_run retry_on_error should_gzip')
+
+
+def config_property(name, settable=True):
+    """A property reading (and replacing) one field of ``self.config``"""
+    def get(self):
+        return getattr(self.config, name)
+
+    def set(self, value):
+        self.reconfigure(**{name: value})
+    return property(get, set if settable else None)
+
+
 class BaseClient(object):
+
+    """
+    Clients can be shared between threads. Their settings are held in an
+    immutable ``ClientConfig`` which each request reads once, without
+    locking, so a request never sees half of a change made while it is
+    being sent. ``reconfigure`` replaces several settings at once. Clients
+    keep no connections between requests and their lock is re-created in a
+    forked child, so they are safe to use after ``fork``.
+    """
+
     def __init__(self, base_url, token, dry_run=False, request_id_fn=None,
                  retry_on_error=True):
-        self.should_gzip = True
-
         if not isinstance(base_url, basestring):
             raise ValueError("base_url must be a string")
 
@@ -31,9 +121,16 @@ class BaseClient(object):
             raise ValueError("token must be a string or None")
 
         self._base_url = base_url
-        self._token = token
-        self._dry_run = dry_run
-        self.retry_on_error = retry_on_error
+        self._config_lock = ForkSafeLock()
+        self._config = ClientConfig(token=token, dry_run=dry_run,
+                                    retry_on_error=retry_on_error,
+                                    should_gzip=True)
+        self.capture = None
+        self.limiter = None
+        self.hedger = None
+        self.endpoints = None
+        self.log_payloads = False
+        self.dry_run_report = DryRunReport()
         if request_id_fn:
             self._request_id_fn = request_id_fn
         else:
@@ -44,39 +141,74 @@ class BaseClient(object):
         return self._base_url
 
     @property
-    def token(self):
-        return self._token
-
-    @property
-    def dry_run(self):
-        return self._dry_run
+    def config(self):
+        return self._config
 
-    def _get(self, path, params=None):
-        return self._request(method='GET', path=path, params=params)
+    def reconfigure(self, **changes):
+        """Replace the named ``ClientConfig`` fields in one step"""
+        if 'token' in changes and changes['token'] is not None and \
+                not isinstance(changes['token'], basestring):
+            raise ValueError("token must be a string or None")
+        with self._config_lock:
+            self._config = self._config._replace(**changes)
+
+    token = config_property('token', settable=False)
+    dry_run = config_property('dry_run', settable=False)
+    retry_on_error = config_property('retry_on_error')
+    should_gzip = config_property('should_gzip')
+
+    def _get(self, path, params=None, decode=None):
+        return self._request(method='GET', path=path, params=params,
+                             decode=decode)
+
+    def _post(self, path, data, chunk_size=0, workers=1, progress=None,
+              isolate=False):
+        """
+        With ``isolate``, chunks the server rejects as invalid are split up
+        to find the bad records while the rest are still sent, and a list
+        of ``(record, error text)`` is returned (see ``isolation``). Raw and
+        encoded bodies cannot be split into records, so are refused.
+        """
+        if isolate and (_is_raw_body(data) or isinstance(data, basestring)):
+            raise ValueError('Can only isolate failures in records, not in '
+                             'an encoded body')
+        is_iter = hasattr(data, '__iter__') and not _is_raw_body(data)
+
+        def post(records):
+            return self._send_records(path, records)
 
-    def _post(self, path, data, chunk_size=0):
-        is_iter = hasattr(data, '__iter__')
         if chunk_size > 0:
-            if is_iter:
-                chunk = []
-                chunk_num = 1
-                for datum in data:
-                    chunk.append(datum)
-                    if len(chunk) == chunk_size:
-                        log.info('Sending chunk {}'.format(chunk_num))
-                        self._request('POST', path, chunk)
-                        chunk = []
-                        chunk_num += 1
-
-                if len(chunk) > 0:
-                    log.info('Sending chunk {}'.format(chunk_num))
-                    self._request('POST', path, chunk)
-            else:
+            if not is_iter:
                 raise ChunkingError('Can only chunk on lists')
+
+            def send(numbered_chunk):
+                chunk_num, chunk = numbered_chunk
+                log.info('Sending chunk {}'.format(chunk_num))
+                if isolate:
+                    return numbered_chunk, bisect_failures(post, chunk)
+                post(chunk)
+                return numbered_chunk, []
+
+            failures = []
+            chunks = enumerate(_chunked(data, chunk_size), 1)
+            for (chunk_num, chunk), rejected in imap_bounded(
+                    send, chunks, workers):
+                failures.extend(rejected)
+                if progress is not None:
+                    progress(chunk_num, len(chunk))
+            if isolate:
+                return failures
         else:
-            if is_iter and not isinstance(data, (dict, list)):
+            if is_iter and not isinstance(data, (dict, list, EncodedPayload)):
                 data = list(data)
-            return self._request('POST', path, data)
+            if isolate:
+                return bisect_failures(
+                    post, [data] if isinstance(data, dict) else data)
+            return post(data)
+
+    def _send_records(self, path, records):
+        """POST one body's worth of records"""
+        return self._request('POST', path, records)
 
     def _put(self, path, data):
         return self._request('PUT', path, data)
@@ -88,8 +220,44 @@ class BaseClient(object):
         return pkg_resources.\
             get_distribution('performanceplatform-client').version
 
-    def _request(self, method, path, data=None, params=None):
+    def _encode(self, headers, data, should_gzip=None):
+        if should_gzip is None:
+            should_gzip = self.should_gzip
+        if isinstance(data, EncodedPayload):
+            if data.content_encoding is not None:
+                headers['Content-Encoding'] = data.content_encoding
+            data = _streamable(data.body)
+        elif _is_raw_body(data):
+            data = _streamable(data)
+        elif data is not None:
+            if not isinstance(data, (bytes, str)):
+                data = _encode_json(data)
+            headers, data = _gzip_payload(headers, data, should_gzip)
+        return headers, data
+
+    def _measure(self, data, should_gzip):
+        """What sending ``data`` would cost, without encoding it whole"""
+        if data is None:
+            return measure_encoded(0)
+        if isinstance(data, EncodedPayload):
+            return measure_encoded(_body_length(data.body))
+        if _is_raw_body(data):
+            return measure_encoded(_body_length(data))
+        if isinstance(data, (bytes, str)):
+            stats = measure_encoded(len(data))
+            if _should_compress(data, should_gzip):
+                stats.sent_bytes = len(_gzip(
+                    data if isinstance(data, bytes) else data.encode('utf-8')))
+            return stats
+        return measure(data, _encode_json, should_gzip)
+
+    def _send(self, **kwargs):
+        return requests.request(**kwargs)
+
+    def _request(self, method, path, data=None, params=None, decode=None):
         json = None
+        # One snapshot for the whole request, whatever changes meanwhile
+        config = self.config
         url = self.base_url + path
         headers = {
             'Accept': 'application/json',
@@ -98,20 +266,26 @@ class BaseClient(object):
             'Govuk-Request-Id': self._request_id_fn(),
         }
 
-        if self.token is not None:
-            headers['Authorization'] = 'Bearer ' + self._token
+        if config.token is not None:
+            headers['Authorization'] = 'Bearer ' + config.token
         if data is not None:
             headers['Content-Type'] = 'application/json'
 
-        if self.dry_run:
+        if config.dry_run:
             log.info('HTTP {} to "{}"\nheaders: {}'.format(
                 method, url, headers))
-            log.info(data)
+            stats = self._measure(data, config.should_gzip)
+            self.dry_run_report.add(stats)
+            log.info('dry run: {}'.format(
+                format_stats(stats, self.dry_run_report.model)))
+            if self.log_payloads:
+                log.info(data)
+            if self.capture is not None:
+                headers, data = self._encode(headers, data,
+                                             config.should_gzip)
+                self.capture.record(method, url, headers, data, params)
         else:
-            if data is not None:
-                if not isinstance(data, str):
-                    data = _encode_json(data)
-                headers, data = _gzip_payload(headers, data, self.should_gzip)
+            headers, data = self._encode(headers, data, config.should_gzip)
 
             kwargs = dict(
                 method=method,
@@ -120,10 +294,41 @@ class BaseClient(object):
                 data=data,
                 params=params,
             )
-            if self.retry_on_error:
-                response = _exponential_backoff(requests.request)(**kwargs)
+            # Streamed bodies must be rewound before each attempt
+            position = data.tell() if hasattr(data, 'seek') else None
+            limiter = self.limiter if method != 'GET' else None
+            hedger = self.hedger if method == 'GET' else None
+            endpoints = self.endpoints
+
+            def attempt(**kwargs):
+                if endpoints is None:
+                    return self._send(**kwargs)
+                url = kwargs.pop('url')
+                return endpoints.run(
+                    url, lambda url: self._send(url=url, **kwargs),
+                    read=method == 'GET')
+
+            def send(**kwargs):
+                if position is not None:
+                    data.seek(position)
+                if limiter is not None:
+                    return limiter.run(lambda: attempt(**kwargs))
+                if hedger is not None:
+                    return hedger.run(lambda: attempt(**kwargs))
+                return attempt(**kwargs)
+
+            started = time.time()
+            if config.retry_on_error:
+                response = _exponential_backoff(send)(**kwargs)
             else:
-                response = requests.request(**kwargs)
+                response = send(**kwargs)
+            if self.capture is not None:
+                if position is not None:
+                    data.seek(position)
+                self.capture.record(
+                    method, url, headers, data, params, started=started,
+                    status=response.status_code,
+                    elapsed=time.time() - started)
 
             try:
                 response.raise_for_status()
@@ -132,7 +337,10 @@ class BaseClient(object):
                 raise
 
             if response.status_code != 204:
-                json = response.json()
+                if decode is not None:
+                    json = decode(response)
+                else:
+                    json = response.json()
 
         return json
 
@@ -152,20 +360,61 @@ def return_none_on(status_code):
     return decorator
 
 
+def _chunked(data, chunk_size):
+    chunk = []
+    for datum in data:
+        chunk.append(datum)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _is_raw_body(data):
+    """True for bodies that are sent exactly as they are"""
+    return isinstance(data, (EncodedPayload, bytearray, memoryview) +
+                      _BUFFER_TYPES) or hasattr(data, 'read')
+
+
+def _streamable(body):
+    if isinstance(body, bytes) or hasattr(body, 'read'):
+        return body
+    return BufferReader(body)
+
+
+def _body_length(body):
+    if hasattr(body, '__len__'):
+        return len(body)
+    try:
+        return os.fstat(body.fileno()).st_size - body.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
 def _gzip_payload(headers, data, should_gzip):
-    if len(data) > 2048 and should_gzip:
+    if _should_compress(data, should_gzip):
         headers['Content-Encoding'] = 'gzip'
-        import gzip
-        from io import BytesIO
-        zipped_data = BytesIO()
-        with gzip.GzipFile(filename='', mode='wb', fileobj=zipped_data) as f:
-            f.write(data.encode())
-        zipped_data.seek(0)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        zipped_data = BytesIO(_gzip(data))
 
         return headers, zipped_data
     return headers, data
 
 
+def _should_compress(data, should_gzip):
+    return len(data) > 2048 and should_gzip
+
+
+def _gzip(data):
+    zipped_data = BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=zipped_data) as f:
+        f.write(data)
+    return zipped_data.getvalue()
+
+
 _exponential_backoff = backoff.on_predicate(
     backoff.expo,
     lambda response: response.status_code in [500, 502, 503],
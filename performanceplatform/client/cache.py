@@ -0,0 +1,297 @@
+"""
+A read cache for data set queries that knows about time.
+
+A query whose window ended in the past (``end_at`` before now) will get
+the same answer until somebody writes to the data set, so it is kept
+until it is invalidated or pushed out by newer entries. Anything that
+might include the present is only kept for ``live_ttl`` seconds.
+
+Entries hold the raw response text, so callers never share a mutable
+result and every result mode (dicts, compact batches, arrays) can be
+served from the same entry.
+
+``RefreshAhead`` keeps popular live entries warm by fetching them again in
+the background shortly before they expire.
+"""
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import pytz
+
+from .dates import parse_datetime
+from .workers import ForkSafeLock, imap_bounded
+
+
+log = logging.getLogger(__name__)
+
+
+# Query parameters whose list values are order independent
+_UNORDERED = ('filter_by', 'filter_by_prefix', 'collect')
+_TIMES = ('start_at', 'end_at', 'date')
+
+
+def _normalise(name, value):
+    if isinstance(value, (list, tuple)):
+        values = [_normalise(name, item) for item in value]
+        return tuple(sorted(values) if name in _UNORDERED else values)
+    if isinstance(value, datetime.datetime):
+        return _canonical_time(value)
+    if name in _TIMES and isinstance(value, basestring):
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            return _canonical_time(parsed)
+    return u'{}'.format(value)
+
+
+def _canonical_time(moment):
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=pytz.UTC)
+    return moment.astimezone(pytz.UTC).isoformat()
+
+
+def cache_key(base_url, query_parameters):
+    """A hashable key that is equal for equivalent queries"""
+    query = query_parameters or {}
+    return (base_url, tuple(sorted(
+        (name, _normalise(name, value)) for name, value in query.items()
+        if value is not None)))
+
+
+def is_historical(query_parameters, now):
+    """True if the query's window closed before ``now``"""
+    end_at = (query_parameters or {}).get('end_at')
+    if end_at is None:
+        return False
+    if not isinstance(end_at, datetime.datetime):
+        end_at = parse_datetime(end_at)
+        if end_at is None:
+            return False
+    if end_at.tzinfo is None:
+        end_at = end_at.replace(tzinfo=pytz.UTC)
+    return end_at <= now
+
+
+class _Entry(object):
+
+    __slots__ = ('text', 'expires_at', 'ttl', 'hits', 'refresh',
+                 'refreshing')
+
+    def __init__(self, text, expires_at, ttl, refresh):
+        self.text = text
+        self.expires_at = expires_at
+        self.ttl = ttl
+        self.hits = 0
+        self.refresh = refresh
+        self.refreshing = False
+
+
+class QueryCache(object):
+
+    """A thread-safe LRU cache of query responses shared by data sets"""
+
+    def __init__(self, live_ttl=60, max_entries=1000, clock=time.time):
+        self.live_ttl = live_ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._keys_by_url = {}
+        # Bumped by every invalidation, so that text fetched before one is
+        # not stored after it
+        self._generations = {}
+        self._cleared = 0
+        self._lock = ForkSafeLock()
+        self.hits = 0
+        self.misses = 0
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self._clock(), pytz.UTC)
+
+    def ttl_for(self, query_parameters):
+        """``None`` (no expiry) for historical windows, else ``live_ttl``"""
+        if is_historical(query_parameters, self.now()):
+            return None
+        return self.live_ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and \
+                    entry.expires_at <= self._clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.hits += 1
+            self._entries[key] = self._entries.pop(key)
+            return entry.text
+
+    def generation(self, key):
+        """
+        A token to take before fetching the text for ``key``; it changes
+        whenever the key's data set is invalidated.
+        """
+        with self._lock:
+            return self._cleared, self._generations.get(key[0], 0)
+
+    def set(self, key, text, ttl=None, refresh=None, generation=None):
+        """
+        Store ``text`` for ``ttl`` seconds (forever if ``None``).
+        ``refresh`` is a function returning fresh text for the key, used by
+        ``RefreshAhead``. Given the ``generation`` taken before the text was
+        fetched, nothing is stored if the data set has been invalidated
+        since. Returns whether the text was stored.
+        """
+        with self._lock:
+            if generation is not None and generation != (
+                    self._cleared, self._generations.get(key[0], 0)):
+                return False
+            self._store(key, text, ttl, refresh)
+            return True
+
+    def _store(self, key, text, ttl, refresh):
+        expires_at = None if ttl is None else self._clock() + ttl
+        entry = _Entry(text, expires_at, ttl, refresh)
+        if key in self._entries:
+            # Popularity decays with every refresh rather than resetting
+            entry.hits = self._entries[key].hits // 2
+            self._remove(key)
+        self._entries[key] = entry
+        self._keys_by_url.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, base_url):
+        """Forget every cached query against ``base_url``"""
+        with self._lock:
+            self._generations[base_url] = \
+                self._generations.get(base_url, 0) + 1
+            for key in list(self._keys_by_url.get(base_url, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._cleared += 1
+            self._entries.clear()
+            self._keys_by_url.clear()
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys_by_url.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_url[key[0]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def expiring(self, within, min_hits=1, limit=None):
+        """
+        Keys of refreshable entries expiring in the next ``within`` seconds
+        that have been read at least ``min_hits`` times, most popular first.
+        The entries are marked as being refreshed.
+        """
+        deadline = self._clock() + within
+        with self._lock:
+            candidates = [
+                (entry.hits, key) for key, entry in self._entries.items()
+                if entry.refresh is not None and not entry.refreshing and
+                entry.expires_at is not None and
+                entry.expires_at <= deadline and entry.hits >= min_hits]
+            candidates.sort(key=lambda candidate: -candidate[0])
+            keys = [key for _, key in candidates[:limit]]
+            for key in keys:
+                self._entries[key].refreshing = True
+            return keys
+
+    def refresh(self, key):
+        """Fetch ``key`` again with its refresh function and store it."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.refresh is None:
+            return False
+        try:
+            text = entry.refresh()
+        except Exception:
+            with self._lock:
+                entry.refreshing = False
+            raise
+        with self._lock:
+            entry.refreshing = False
+            if text is None or self._entries.get(key) is not entry:
+                # Invalidated or replaced while we were fetching
+                return False
+            self._store(key, text, entry.ttl, entry.refresh)
+        return True
+
+
+class RefreshAhead(object):
+
+    """
+    Re-fetches hot cache entries in the background before they expire.
+
+    Every ``interval`` seconds, entries expiring within ``lead_time`` with
+    at least ``min_hits`` reads are refreshed, most popular first, on at
+    most ``max_concurrency`` threads. Read counts halve at each refresh so
+    entries that stop being read soon drop out.
+    """
+
+    def __init__(self, cache, lead_time=10, interval=1, min_hits=2,
+                 max_concurrency=4, max_per_run=None):
+        self.cache = cache
+        self.lead_time = lead_time
+        self.interval = interval
+        self.min_hits = min_hits
+        self.max_concurrency = max_concurrency
+        self.max_per_run = max_per_run
+        self.refreshes = 0
+        self.errors = 0
+        self._counts_lock = ForkSafeLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        keys = self.cache.expiring(self.lead_time, self.min_hits,
+                                   self.max_per_run)
+        for refreshed in imap_bounded(
+                self._refresh, keys, self.max_concurrency):
+            if refreshed:
+                with self._counts_lock:
+                    self.refreshes += 1
+        return len(keys)
+
+    def _refresh(self, key):
+        try:
+            return self.cache.refresh(key)
+        except Exception:
+            log.exception('Failed to refresh {}'.format(key))
+            with self._counts_lock:
+                self.errors += 1
+            return False
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='pp-refresh-ahead')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
@@ -0,0 +1,274 @@
+"""
+Record the requests a client makes and replay them as load.
+
+Set a client's ``capture`` to a ``Capture`` and every request it makes,
+live or in ``dry_run``, is written to a file with its method, path and
+query string, encoded (and possibly gzipped) body and start time::
+
+    data_set.capture = Capture('upload.ppcap')
+    data_set.post(records, chunk_size=1000, workers=4)
+    data_set.capture.close()
+
+``replay`` sends a capture to another host at a multiple of the original
+rate, on concurrent workers, and reports latencies and status codes.
+Authorization headers are never written to captures; give ``replay`` a
+token instead.
+
+A capture file is ``MAGIC`` followed by one JSON line per request,
+each followed directly by ``size`` bytes of body.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from .stats import percentile
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'PPCAP01\n'
+
+# Headers worth replaying; Authorization is deliberately left out
+_KEPT_HEADERS = ('Accept', 'Content-Type', 'Content-Encoding')
+
+
+CapturedRequest = namedtuple(
+    'CapturedRequest', 't method path headers body status elapsed')
+
+
+def _body_bytes(body):
+    if body is None:
+        return None
+    if hasattr(body, 'getvalue'):
+        return body.getvalue()
+    if hasattr(body, 'read'):
+        position = body.tell()
+        data = body.read()
+        body.seek(position)
+        return data
+    if not isinstance(body, bytes):
+        return body.encode('utf-8')
+    return body
+
+
+def _path_and_query(method, url, params):
+    if params:
+        url = requests.Request(method, url, params=params).prepare().url
+    parts = urlsplit(url)
+    if parts.query:
+        return '{}?{}'.format(parts.path, parts.query)
+    return parts.path
+
+
+class Capture(object):
+
+    """A thread-safe writer of captured requests"""
+
+    def __init__(self, path_or_file):
+        if isinstance(path_or_file, basestring):
+            self._file = open(path_or_file, 'wb')
+            self._owns_file = True
+        else:
+            self._file = path_or_file
+            self._owns_file = False
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._origin = time.time()
+        self.count = 0
+
+    def record(self, method, url, headers, body, params=None, started=None,
+               status=None, elapsed=None):
+        started = time.time() if started is None else started
+        body = _body_bytes(body)
+        meta = {
+            't': round(max(started - self._origin, 0), 6),
+            'method': method,
+            'path': _path_and_query(method, url, params),
+            'headers': dict((name, value) for name, value in headers.items()
+                            if name in _KEPT_HEADERS),
+            'size': None if body is None else len(body),
+            'status': status,
+            'elapsed': None if elapsed is None else round(elapsed, 6),
+        }
+        line = json.dumps(meta, sort_keys=True).encode('utf-8') + b'\n'
+        with self._lock:
+            self._file.write(line)
+            if body:
+                self._file.write(body)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._owns_file:
+                self._file.close()
+            else:
+                self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_capture(path_or_file):
+    """Yield each ``CapturedRequest`` in a capture file, in order."""
+    if isinstance(path_or_file, basestring):
+        with open(path_or_file, 'rb') as f:
+            for request in read_capture(f):
+                yield request
+        return
+
+    f = path_or_file
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a capture file')
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        meta = json.loads(line.decode('utf-8'))
+        size = meta['size']
+        body = None if size is None else f.read(size)
+        if body is not None and len(body) != size:
+            raise ValueError('capture file is truncated')
+        yield CapturedRequest(
+            meta['t'], meta['method'], meta['path'], meta['headers'], body,
+            meta['status'], meta['elapsed'])
+
+
+def replay(captured, target, speed=1.0, workers=8, token=None,
+           timeout=None):
+    """
+    Send ``captured`` requests to the host at ``target``.
+
+    Requests are sent at ``speed`` times the rate they were captured at,
+    or as fast as ``workers`` threads allow if ``speed`` is ``None``.
+    At most ``2 * workers`` requests are queued ahead of the threads, so
+    memory use does not grow with the size of the capture.
+    Returns a report of request, error and status counts, the
+    ``latencies`` of every request and ``max_lag``, the furthest any
+    request fell behind its schedule.
+    """
+    target = target.rstrip('/')
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    backlog = threading.BoundedSemaphore(2 * workers)
+
+    def send(request, due):
+        try:
+            return _send(request, due)
+        finally:
+            backlog.release()
+
+    def _send(request, due):
+        started = time.time()
+        headers = dict(request.headers)
+        if token is not None:
+            headers['Authorization'] = 'Bearer ' + token
+        try:
+            response = session.request(
+                method=request.method, url=target + request.path,
+                headers=headers, data=request.body, timeout=timeout)
+            status, error = response.status_code, None
+        except requests.RequestException as e:
+            status, error = None, e
+        return status, error, time.time() - started, started - due
+
+    report = {'requests': 0, 'errors': 0, 'statuses': {}, 'latencies': [],
+              'max_lag': 0.0, 'seconds': 0.0}
+
+    def collect(result):
+        status, error, latency, lag = result
+        report['requests'] += 1
+        report['latencies'].append(latency)
+        report['max_lag'] = max(report['max_lag'], lag)
+        if error is not None:
+            report['errors'] += 1
+            log.warning('Replay request failed: {}'.format(error))
+        else:
+            report['statuses'][status] = \
+                report['statuses'].get(status, 0) + 1
+
+    pool = ThreadPool(workers)
+    origin = time.time()
+    try:
+        for request in captured:
+            due = time.time()
+            if speed:
+                due = origin + request.t / float(speed)
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            backlog.acquire()
+            pool.apply_async(send, (request, due), callback=collect)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        session.close()
+
+    report['seconds'] = time.time() - origin
+    return report
+
+
+def format_report(report):
+    latencies = report['latencies']
+    lines = ['{requests} requests in {seconds:.2f}s, {errors} errors'.format(
+        **report)]
+    lines.extend('  HTTP {}: {}'.format(status, count)
+                 for status, count in sorted(report['statuses'].items()))
+    if latencies:
+        lines.append('  latency p50 {:.3f}s p95 {:.3f}s p99 {:.3f}s '
+                     'max {:.3f}s'.format(
+                         percentile(latencies, 0.5),
+                         percentile(latencies, 0.95),
+                         percentile(latencies, 0.99), max(latencies)))
+    lines.append('  max lag behind schedule {:.3f}s'.format(
+        report['max_lag']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay a captured request stream against a host')
+    parser.add_argument('path', help='capture file')
+    parser.add_argument('--target', required=True,
+                        help='scheme and host to send to, eg. '
+                             'http://localhost:3038')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='multiple of the captured rate; 0 sends as '
+                             'fast as possible')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--token', default=os.environ.get('PP_TOKEN'),
+                        help='bearer token (defaults to $PP_TOKEN)')
+    parser.add_argument('--timeout', type=float)
+    args = parser.parse_args(argv)
+
+    report = replay(read_capture(args.path), args.target,
+                    speed=args.speed or None, workers=args.workers,
+                    token=args.token, timeout=args.timeout)
+    sys.stdout.write(format_report(report) + '\n')
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
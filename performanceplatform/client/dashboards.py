@@ -0,0 +1,105 @@
+"""
+Load a dashboard together with its modules and their data sets.
+
+The dashboard and its module list are fetched together, each module is
+fetched as soon as its id is known and each module's data set lookup
+starts as soon as that module arrives, so loading takes roughly three
+round trips however many modules there are. Data sets used by several
+modules are only looked up once.
+"""
+import logging
+
+from .workers import TaskPool
+
+
+log = logging.getLogger(__name__)
+
+
+def data_set_reference(module):
+    """
+    A hashable reference to the data set behind ``module``, or ``None``.
+
+    Modules name their data set either directly (``data_set`` holding a
+    name, or a dict with a ``name``) or by ``data_group``/``data_type``.
+    """
+    data_set = module.get('data_set') or module.get('data-set')
+    if isinstance(data_set, dict):
+        if data_set.get('name'):
+            return ('name', data_set['name'])
+        group = data_set.get('data_group') or data_set.get('data-group')
+        data_type = data_set.get('data_type') or data_set.get('data-type')
+    elif data_set:
+        return ('name', data_set)
+    else:
+        group = module.get('data_group')
+        data_type = module.get('data_type')
+    if group and data_type:
+        return ('group_and_type', group, data_type)
+    return None
+
+
+def _child_modules(module):
+    return [child for child in module.get('modules') or []
+            if isinstance(child, dict)]
+
+
+def load_dashboard_graph(admin, dashboard_id, workers=8):
+    """
+    Fetch a dashboard, its modules and their data sets concurrently.
+
+    Returns a dict with the ``dashboard``, its fully fetched ``modules`` in
+    order and the ``data_sets`` they use, keyed by reference. Each module
+    (including nested section modules) gains a ``data_set_config`` key
+    linking to the shared data set dict, or ``None``.
+    """
+    def lookup(reference):
+        if reference[0] == 'name':
+            return admin.get_data_set_by_name(reference[1])
+        return admin.get_data_set(reference[1], reference[2])
+
+    def request_data_sets(module):
+        for item in [module] + _child_modules(module):
+            reference = data_set_reference(item)
+            if reference is not None:
+                tasks.submit(('data_set',) + reference, lookup, (reference,))
+
+    def on_module(module):
+        try:
+            if module:
+                request_data_sets(module)
+        except Exception:
+            # Raising here would kill the pool's result handler
+            log.exception('Could not queue data set lookups')
+
+    with TaskPool(workers) as tasks:
+        dashboard = tasks.submit(
+            ('dashboard', dashboard_id), admin.get_dashboard, (dashboard_id,))
+        listed = tasks.submit(
+            ('modules', dashboard_id), admin.list_modules_on_dashboard,
+            (dashboard_id,))
+
+        module_results = [
+            tasks.submit(('module', summary['id']), admin.get_module,
+                         (summary['id'],), callback=on_module)
+            for summary in listed.get() or []]
+        modules = [result.get() for result in module_results]
+        dashboard = dashboard.get()
+
+        data_sets = {}
+        for module in modules:
+            for item in ([module] + _child_modules(module)) if module else []:
+                reference = data_set_reference(item)
+                if reference is None:
+                    item['data_set_config'] = None
+                    continue
+                if reference not in data_sets:
+                    data_sets[reference] = tasks.submit(
+                        ('data_set',) + reference, lookup,
+                        (reference,)).get()
+                item['data_set_config'] = data_sets[reference]
+
+    return {
+        'dashboard': dashboard,
+        'modules': modules,
+        'data_sets': data_sets,
+    }
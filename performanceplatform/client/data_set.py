@@ -1,8 +1,23 @@
 from __future__ import unicode_literals
 
+import copy
+import json
 import logging
 
-from performanceplatform.client.base import BaseClient
+import requests
+
+from performanceplatform.client.base import BaseClient, EncodedPayload
+from performanceplatform.client.cache import cache_key
+from performanceplatform.client.frames import (
+    arrays_from_json, frame_from_arrays
+)
+from performanceplatform.client.payloads import post_json_lines
+from performanceplatform.client.records import RecordBatch
+from performanceplatform.client.replace import replace_records
+from performanceplatform.client.scheduler import NORMAL
+from performanceplatform.client.sharding import get_sharded
+from performanceplatform.client.spool import SpoolNotEmpty, is_outage
+from performanceplatform.client.sync import sync_records
 
 
 log = logging.getLogger(__name__)
@@ -12,6 +27,28 @@ class DataSet(BaseClient):
 
     """Client for writing to a Performance Platform data-set"""
 
+    # A spool.Spool to hold writes while the API is unavailable, and
+    # whether to send every write through it
+    spool = None
+    defer_writes = False
+    # A scheduler.WriteScheduler shared with other data sets, and this data
+    # set's place in it
+    scheduler = None
+    priority = NORMAL
+    weight = 1
+    # A replica.Replica answering queries from a copy held in memory
+    replica = None
+
+    def __init__(self, base_url, token, dry_run=False, request_id_fn=None,
+                 retry_on_error=True, cache=None):
+        super(DataSet, self).__init__(
+            base_url,
+            token,
+            dry_run,
+            request_id_fn,
+            retry_on_error)
+        self.cache = cache
+
     @staticmethod
     def from_config(config):
         return DataSet(
@@ -21,7 +58,7 @@ class DataSet(BaseClient):
         )
 
     @staticmethod
-    def from_name(api_url, name, dry_run=False):
+    def from_name(api_url, name, dry_run=False, cache=None):
         """
             doesn't require a token config param
             as all of our data is currently public
@@ -29,29 +66,265 @@ class DataSet(BaseClient):
         return DataSet(
             '/'.join([api_url, name]).rstrip('/'),
             token=None,
-            dry_run=dry_run
+            dry_run=dry_run,
+            cache=cache,
         )
 
     @staticmethod
     def from_group_and_type(api_url, data_group, data_type, dry_run=False,
-                            token=None):
+                            token=None, cache=None):
         return DataSet(
             '/'.join([api_url, data_group, data_type]).rstrip('/'),
             token,
             dry_run=dry_run,
+            cache=cache,
         )
 
     def set_token(self, token):
         if not isinstance(token, basestring):
             raise Exception("token must be a string")
 
-        self._token = token
+        self.reconfigure(token=token)
+
+    def get(self, query_parameters=None, compact=False):
+        """
+        Query the data set. With ``compact`` the result is a
+        ``records.RecordBatch`` rather than a dict of lists of dicts, which
+        takes a fraction of the memory for large results.
 
-    def get(self, query_parameters=None):
+        If the data set has a ``cache`` (a ``cache.QueryCache``) results
+        are served from it; writes through this client invalidate it.
+        Likewise a ``replica`` answers the queries it can.
+        """
+        if self.replica is not None and not compact:
+            result = self.replica.query(query_parameters)
+            if result is not None:
+                return result
+        if compact:
+            return self._query(query_parameters, RecordBatch.from_json)
+        if self.cache is not None:
+            return self._query(query_parameters, json.loads)
         return self._get(path="", params=query_parameters)
 
-    def post(self, records, chunk_size=0):
-        return self._post('', records, chunk_size=chunk_size)
+    def _query(self, query_parameters, decode_text):
+        """
+        GET the data set and decode the response text, going through
+        ``cache`` (a ``cache.QueryCache``) if there is one.
+        """
+        if self.cache is None:
+            return self._get(
+                path="", params=query_parameters,
+                decode=lambda response: decode_text(response.text))
+
+        # fetch is kept by the cache for RefreshAhead, so it must not see
+        # later changes to the caller's dict
+        query_parameters = copy.deepcopy(query_parameters)
+
+        def fetch():
+            return self._get(path="", params=query_parameters,
+                             decode=lambda response: response.text)
+
+        key = cache_key(self.base_url, query_parameters)
+        text = self.cache.get(key)
+        if text is None:
+            # A write while we fetch makes the result too old to keep
+            generation = self.cache.generation(key)
+            text = fetch()
+            if text is None:
+                return None
+            self.cache.set(key, text, self.cache.ttl_for(query_parameters),
+                           refresh=fetch, generation=generation)
+        return decode_text(text)
+
+    def _invalidate_cache(self):
+        if self.cache is not None:
+            self.cache.invalidate(self.base_url)
+        if self.replica is not None:
+            self.replica.invalidate()
+
+    def get_sharded(self, query_parameters, workers=4, shards=None,
+                    shard_size=None, periods_per_shard=None,
+                    target_records=None):
+        """
+        Split a query with ``start_at`` and ``end_at`` into smaller time
+        windows, fetch them concurrently and merge the results, combining
+        grouped aggregates where that can be done exactly. See
+        ``sharding.get_sharded`` for how windows are chosen.
+        """
+        return get_sharded(self, query_parameters, workers=workers,
+                           shards=shards, shard_size=shard_size,
+                           periods_per_shard=periods_per_shard,
+                           target_records=target_records)
+
+    def get_arrays(self, query_parameters=None, parse_dates=True, dates=(),
+                   exact_ints=False):
+        """
+        Query the data set and return an ordered dict of column name to
+        NumPy array, decoded without building a dict per record. Timestamp
+        columns become ``datetime64[us]`` in UTC. See
+        ``frames.arrays_from_json``. Needs ``numpy``.
+        """
+        def decode(text):
+            return arrays_from_json(text, parse_dates, dates, exact_ints)
+        return self._query(query_parameters, decode)
+
+    def get_frame(self, query_parameters=None, parse_dates=True, dates=()):
+        """``get_arrays`` as a pandas ``DataFrame``. Needs ``pandas``."""
+        arrays = self.get_arrays(query_parameters, parse_dates, dates)
+        if arrays is None:
+            return None
+        return frame_from_arrays(arrays)
+
+    def post(self, records, chunk_size=0, workers=1, progress=None,
+             validator=None, reject=None, isolate=False):
+        """
+        Send ``records`` (a record or an iterable of them), optionally in
+        chunks of ``chunk_size`` posted on up to ``workers`` threads.
+
+        With a ``validator`` (a ``validation.Validator``) records are
+        checked before anything is sent. Invalid ones are passed to
+        ``reject(record, errors)``, or if there is no ``reject`` a
+        ``validation.ValidationError`` is raised.
+
+        With ``isolate`` a rejected chunk does not stop the upload: it is
+        split up until the bad records are found, the good ones are sent
+        and ``(record, error text)`` is returned for each bad one. Raw
+        and encoded bodies raise ``ValueError`` with ``isolate``.
+        """
+        if validator is not None:
+            if isinstance(records, dict):
+                records = [records]
+            records = validator.check(records, reject)
+            if not chunk_size:
+                records = list(records)
+            if not records:
+                return [] if isolate else None
+        try:
+            return self._post('', records, chunk_size=chunk_size,
+                              workers=workers, progress=progress,
+                              isolate=isolate)
+        finally:
+            self._invalidate_cache()
+
+    def post_json_lines(self, path, chunk_bytes=1024 * 1024, workers=1,
+                        progress=None):
+        """
+        Post a JSON Lines file in chunks of about ``chunk_bytes`` without
+        decoding its records. See ``payloads.post_json_lines``.
+        """
+        try:
+            return post_json_lines(self, path, chunk_bytes=chunk_bytes,
+                                   workers=workers, progress=progress)
+        finally:
+            self._invalidate_cache()
+
+    def _send_records(self, path, records):
+        spool = self.spool
+        if spool is None or self.dry_run:
+            return self._schedule(path, records)
+        if self.defer_writes or not spool.empty:
+            # Queue behind anything already spooled to keep writes in order
+            return self._spool_records(records)
+        records = _rewindable(records)
+        stream = _stream(records)
+        position = None if stream is None else stream.tell()
+        try:
+            return self._schedule(path, records)
+        except requests.RequestException as e:
+            if not is_outage(e):
+                raise
+            log.warning('Spooling write while the API is unavailable: '
+                        '{}'.format(e))
+            # The failed attempt may have read some or all of a stream
+            if stream is not None:
+                stream.seek(position)
+            return self._spool_records(records)
+
+    def _schedule(self, path, records):
+        send = super(DataSet, self)._send_records
+        scheduler = self.scheduler
+        if scheduler is None or self.dry_run:
+            return send(path, records)
+        return scheduler.run(self.base_url, lambda: send(path, records),
+                             cost=_cost(records), weight=self.weight,
+                             priority=self.priority)
+
+    def _spool_records(self, records):
+        headers, body = self._encode({}, records)
+        if hasattr(body, 'getvalue'):
+            body = body.getvalue()
+        elif hasattr(body, 'read'):
+            body = body.read()
+        elif not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.spool.append(body, headers.get('Content-Encoding'))
+
+    def sync(self, records, index, key='_id', chunk_size=0, workers=1):
+        """
+        Post only records which are new or have changed since they were last
+        synced through ``index``, a ``sync.HashIndex``. Records are matched
+        on ``key``: a field name, a list of field names or a callable.
+        """
+        return sync_records(self, records, index, key=key,
+                            chunk_size=chunk_size, workers=workers)
+
+    def _check_spool_drained(self, action):
+        """
+        Spooled writes would be sent after an empty or replace, undoing
+        it, and a ``PUT`` cannot be spooled behind them.
+        """
+        spool = self.spool
+        if spool is not None and not self.dry_run and not spool.empty:
+            raise SpoolNotEmpty('cannot {} {} until its spool has '
+                                'drained'.format(action, self.base_url))
 
     def empty_data_set(self):
-        return self._put('', [])
+        self._check_spool_drained('empty')
+        try:
+            return self._put('', [])
+        finally:
+            self._invalidate_cache()
+
+    def replace(self, records, chunk_size=1000, workers=1):
+        """
+        Replace the contents of the data set with ``records``.
+
+        Chunks are encoded and compressed before the data set is emptied so
+        that it is only empty or partial while they are uploaded. Returns a
+        report with per-phase timings. Raises ``spool.SpoolNotEmpty`` if
+        writes are still waiting in the data set's spool.
+        """
+        self._check_spool_drained('replace')
+        try:
+            return replace_records(self, records, chunk_size=chunk_size,
+                                   workers=workers)
+        finally:
+            self._invalidate_cache()
+
+
+def _stream(records):
+    """The file-like object a raw body is read from, if it is one"""
+    body = records.body if isinstance(records, EncodedPayload) else records
+    return body if hasattr(body, 'read') else None
+
+
+def _rewindable(records):
+    """``records``, with a stream that cannot seek read into memory"""
+    stream = _stream(records)
+    if stream is None or hasattr(stream, 'seek'):
+        return records
+    if isinstance(records, EncodedPayload):
+        return EncodedPayload(stream.read(), records.content_encoding,
+                              records.records)
+    return stream.read()
+
+
+def _cost(records):
+    """The number of records in a request body, as far as it is known"""
+    if isinstance(records, EncodedPayload):
+        if records.records is not None:
+            return records.records
+        return getattr(records.body, 'records', 1)
+    if isinstance(records, (list, tuple)):
+        return max(len(records), 1)
+    return 1
@@ -0,0 +1,62 @@
+import datetime
+import re
+
+import pytz
+
+
+_ISO_8601 = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?'
+    r'(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO 8601 string as produced by ``JsonEncoder`` or backdrop.
+
+    Returns ``None`` if ``value`` does not look like a date. Values with an
+    offset come back timezone aware, others are naive (which ``JsonEncoder``
+    treats as UTC).
+
+    >>> parse_datetime('2012-12-12T10:30:00+00:00')
+    datetime.datetime(2012, 12, 12, 10, 30, tzinfo=<UTC>)
+    >>> parse_datetime('2012-12-12')
+    datetime.datetime(2012, 12, 12, 0, 0)
+    >>> parse_datetime('12/12/2012') is None
+    True
+    """
+    match = _ISO_8601.match(value)
+    if match is None:
+        return None
+
+    (year, month, day, hour, minute, second,
+     fraction, offset) = match.groups()
+    try:
+        parsed = datetime.datetime(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0),
+            int((fraction or '0').ljust(6, '0')))
+    except ValueError:
+        return None
+
+    if offset is not None:
+        parsed = parsed.replace(tzinfo=_parse_offset(offset))
+
+    return parsed
+
+
+def has_time(value):
+    """True if ``value`` is an ISO 8601 string with a time component."""
+    match = _ISO_8601.match(value)
+    return match is not None and match.group(4) is not None
+
+
+def _parse_offset(offset):
+    if offset == 'Z':
+        return pytz.UTC
+    sign = -1 if offset[0] == '-' else 1
+    digits = offset[1:].replace(':', '')
+    minutes = int(digits[:2]) * 60 + int(digits[2:])
+    if minutes == 0:
+        return pytz.UTC
+    return pytz.FixedOffset(sign * minutes)
@@ -0,0 +1,147 @@
+"""
+What a dry run would have sent, without building the request bodies.
+
+Each record is encoded on its own and fed through a streaming compressor,
+so sizes match what would have gone over the wire (gzip where the client
+would compress) without ever holding a whole payload as one string. The
+totals build up in a ``DryRunReport`` across every request a client
+makes, with an upload time estimated from an ``UploadModel``.
+"""
+import zlib
+
+from .workers import ForkSafeLock
+
+
+# The header and trailer gzip adds around the deflate stream
+_GZIP_OVERHEAD = 18
+# Bodies of this size or less are never compressed, see base._should_compress
+_COMPRESS_OVER = 2048
+
+
+class UploadModel(object):
+
+    """
+    A simple model of the link to the API: ``bytes_per_second`` of
+    bandwidth shared by all requests and ``round_trip`` seconds of latency
+    per request.
+    """
+
+    def __init__(self, bytes_per_second=1.25e6, round_trip=0.1):
+        self.bytes_per_second = float(bytes_per_second)
+        self.round_trip = round_trip
+
+    def seconds(self, requests, sent_bytes, workers=1):
+        return (requests * self.round_trip / max(workers, 1) +
+                sent_bytes / self.bytes_per_second)
+
+
+class PayloadStats(object):
+
+    __slots__ = ('records', 'encoded_bytes', 'sent_bytes', 'largest_record')
+
+    def __init__(self, records, encoded_bytes, sent_bytes, largest_record):
+        self.records = records
+        self.encoded_bytes = encoded_bytes
+        self.sent_bytes = sent_bytes
+        self.largest_record = largest_record
+
+
+def _bytes(encoded):
+    if isinstance(encoded, bytes):
+        return encoded
+    return encoded.encode('utf-8')
+
+
+def _pieces(data, encode):
+    """The encoded body in fragments, with the size of each record"""
+    if not isinstance(data, (list, tuple)):
+        encoded = _bytes(encode(data))
+        yield encoded, len(encoded)
+        return
+    yield b'[', None
+    for index, record in enumerate(data):
+        if index:
+            yield b', ', None
+        encoded = _bytes(encode(record))
+        yield encoded, len(encoded)
+    yield b']', None
+
+
+def measure(data, encode, should_gzip=True):
+    """
+    ``PayloadStats`` for ``data`` (a record or a list of them) as
+    ``BaseClient`` would send it, encoding each record with ``encode``.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    records = encoded_bytes = compressed_bytes = largest = 0
+    for piece, size in _pieces(data, encode):
+        if size is not None:
+            records += 1
+            largest = max(largest, size)
+        encoded_bytes += len(piece)
+        if should_gzip:
+            compressed_bytes += len(compressor.compress(piece))
+
+    sent_bytes = encoded_bytes
+    if should_gzip and encoded_bytes > _COMPRESS_OVER:
+        sent_bytes = compressed_bytes + len(compressor.flush()) + \
+            _GZIP_OVERHEAD
+    return PayloadStats(records, encoded_bytes, sent_bytes, largest)
+
+
+def measure_encoded(length):
+    """
+    ``PayloadStats`` for an already encoded body of ``length`` bytes (or
+    ``None`` if unknown), which is sent as it is. Its records are not
+    counted.
+    """
+    return PayloadStats(None, length, length, None)
+
+
+class DryRunReport(object):
+
+    """Running totals for the requests a client made in ``dry_run``"""
+
+    def __init__(self, model=None):
+        self.model = model or UploadModel()
+        self._lock = ForkSafeLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.records = 0
+            self.encoded_bytes = 0
+            self.sent_bytes = 0
+            self.largest_record = 0
+
+    def add(self, stats):
+        with self._lock:
+            self.requests += 1
+            self.records += stats.records or 0
+            self.encoded_bytes += stats.encoded_bytes or 0
+            self.sent_bytes += stats.sent_bytes or 0
+            self.largest_record = max(self.largest_record,
+                                      stats.largest_record or 0)
+
+    def estimated_seconds(self, workers=1):
+        return self.model.seconds(self.requests, self.sent_bytes, workers)
+
+    def format(self, workers=1):
+        return ('{} requests, {} records, {} bytes encoded, {} bytes sent, '
+                'largest record {} bytes, about {:.2f}s to upload'.format(
+                    self.requests, self.records, self.encoded_bytes,
+                    self.sent_bytes, self.largest_record,
+                    self.estimated_seconds(workers)))
+
+
+def format_stats(stats, model):
+    """One line describing a single request's payload"""
+    def known(value):
+        return '?' if value is None else value
+
+    return ('{} records, {} bytes encoded, {} bytes to send, largest record '
+            '{} bytes, about {:.3f}s'.format(
+                known(stats.records), known(stats.encoded_bytes),
+                known(stats.sent_bytes), known(stats.largest_record),
+                model.seconds(1, stats.sent_bytes or 0)))
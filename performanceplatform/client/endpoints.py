@@ -0,0 +1,177 @@
+"""
+Spread reads over several copies of the API, and keep going if one dies.
+
+An ``EndpointPool`` holds the root URLs of backdrop instances serving the
+same data, one of which is the primary::
+
+    pool = EndpointPool(['https://backdrop-1', 'https://backdrop-2',
+                         'https://backdrop-3'], primary='https://backdrop-1')
+    data_set = DataSet('https://backdrop-1/data/carers/claims', token)
+    data_set.endpoints = pool
+
+The client's URL must start with one of the roots; for each request that
+root is swapped for the one chosen. Writes always go to the primary.
+Reads go to the healthy endpoint with the lowest recent latency (a moving
+average) times the requests it already has in flight, so a slow or busy
+replica is passed over until it catches up. An endpoint that has never
+answered counts as fastest, so every endpoint gets tried.
+
+A read that fails to connect, times out or gets a 5xx is tried on the
+next best endpoint. Failed endpoints are left out for ``cooldown``
+seconds, doubling with each consecutive failure up to ``max_cooldown``;
+if every endpoint is down they are tried anyway, soonest back first.
+"""
+import logging
+import time
+
+import requests
+
+from .workers import ForkSafeLock
+
+
+log = logging.getLogger(__name__)
+
+
+class Endpoint(object):
+
+    """The state kept for one root URL"""
+
+    __slots__ = ('url', 'outstanding', 'latency', 'requests', 'failures',
+                 'consecutive_failures', 'down_until')
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0
+
+    def score(self):
+        return (self.outstanding + 1) * (self.latency or 0)
+
+
+class EndpointPool(object):
+
+    """The root URLs of interchangeable backdrop instances"""
+
+    def __init__(self, urls, primary=None, cooldown=1.0, max_cooldown=60.0,
+                 smoothing=0.3, clock=time.time):
+        urls = [url.rstrip('/') for url in urls]
+        if not urls:
+            raise ValueError('at least one endpoint is needed')
+        primary = urls[0] if primary is None else primary.rstrip('/')
+        if primary not in urls:
+            raise ValueError('primary {} is not one of the endpoints'.format(
+                primary))
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.primary = self.endpoints[urls.index(primary)]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+        self._clock = clock
+        self._lock = ForkSafeLock(after_fork=self._after_fork)
+        # Longest first, so that a root which is a prefix of another
+        # cannot match its URLs
+        self._roots = sorted(urls, key=len, reverse=True)
+
+    def _after_fork(self):
+        # Requests outstanding at fork belong to threads the child lacks
+        for endpoint in self.endpoints:
+            endpoint.outstanding = 0
+
+    def healthy(self, endpoint):
+        return self._clock() >= endpoint.down_until
+
+    def metrics(self):
+        with self._lock:
+            return dict((endpoint.url, {
+                'healthy': self.healthy(endpoint),
+                'outstanding': endpoint.outstanding,
+                'latency': endpoint.latency,
+                'requests': endpoint.requests,
+                'failures': endpoint.failures,
+            }) for endpoint in self.endpoints)
+
+    def _path(self, url):
+        for root in self._roots:
+            if url == root or url.startswith(root + '/') or \
+                    url.startswith(root + '?'):
+                return url[len(root):]
+        raise ValueError('{} is not under any endpoint in the pool'.format(
+            url))
+
+    def run(self, url, send, read=True):
+        """
+        ``send(url)`` with ``url`` moved to the endpoint chosen for it,
+        failing over to the others if ``read``.
+        """
+        path = self._path(url)
+        if not read:
+            return self._call(self.primary, path, send)
+
+        tried = set()
+        while True:
+            endpoint = self._choose(tried)
+            tried.add(endpoint)
+            last = len(tried) == len(self.endpoints)
+            try:
+                response = self._call(endpoint, path, send)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise
+                log.warning('Failing over from {}: {}'.format(
+                    endpoint.url, e))
+                continue
+            if response.status_code < 500 or last:
+                return response
+            log.warning('Failing over from {}: HTTP {}'.format(
+                endpoint.url, response.status_code))
+
+    def _choose(self, tried):
+        with self._lock:
+            untried = [endpoint for endpoint in self.endpoints
+                       if endpoint not in tried]
+            healthy = [endpoint for endpoint in untried
+                       if self.healthy(endpoint)]
+            if healthy:
+                return min(healthy, key=Endpoint.score)
+            return min(untried, key=lambda endpoint: endpoint.down_until)
+
+    def _call(self, endpoint, path, send):
+        with self._lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        started = self._clock()
+        try:
+            response = send(endpoint.url + path)
+        except (requests.ConnectionError, requests.Timeout):
+            self._release(endpoint, None)
+            raise
+        except BaseException:
+            with self._lock:
+                endpoint.outstanding -= 1
+            raise
+        self._release(endpoint, None if response.status_code >= 500
+                      else self._clock() - started)
+        return response
+
+    def _release(self, endpoint, latency):
+        """Record how a request went; ``latency`` is None if it failed"""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if latency is None:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                doublings = min(endpoint.consecutive_failures - 1, 16)
+                endpoint.down_until = self._clock() + min(
+                    self.max_cooldown, self.cooldown * 2 ** doublings)
+                return
+            endpoint.consecutive_failures = 0
+            endpoint.down_until = 0
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += (latency - endpoint.latency) * \
+                    self.smoothing
@@ -0,0 +1,228 @@
+"""
+Decode data set query results straight into NumPy columns.
+
+Objects are collected per shape (set of field names) as value tuples while
+the JSON is parsed and transposed into columns in one step, so no dict is
+built per record. Backdrop timestamp columns (``_timestamp`` and the
+``_*_at`` fields) are converted to ``datetime64`` in bulk.
+
+NumPy is needed for arrays and pandas for data frames; both are optional.
+"""
+import json
+from collections import OrderedDict
+from operator import itemgetter
+
+import pytz
+
+from .dates import parse_datetime
+from .records import _import_numpy
+
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+_keys = itemgetter(0)
+_values = itemgetter(1)
+
+
+class _Rows(object):
+
+    """Value tuples for every object with the same fields"""
+
+    __slots__ = ('keys', 'rows')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.rows = []
+
+    def columns(self):
+        if not self.rows:
+            return [() for _ in self.keys]
+        return list(zip(*self.rows))
+
+    def as_dict(self, row):
+        return dict((key, _plain(value))
+                    for key, value in zip(self.keys, self.rows[row]))
+
+
+class _Ref(object):
+
+    """Stands in for a decoded object until it is placed in a column"""
+
+    __slots__ = ('shape', 'row')
+
+    def __init__(self, shape, row):
+        self.shape = shape
+        self.row = row
+
+
+def _plain(value):
+    if isinstance(value, _Ref):
+        return value.shape.as_dict(value.row)
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+class ColumnDecoder(object):
+
+    """A ``json`` object hook collecting values per shape"""
+
+    def __init__(self):
+        self._shapes = {}
+
+    def __call__(self, pairs):
+        keys = tuple(map(_keys, pairs))
+        shape = self._shapes.get(keys)
+        if shape is None:
+            shape = self._shapes[keys] = _Rows(keys)
+        shape.rows.append(tuple(map(_values, pairs)))
+        return _Ref(shape, len(shape.rows) - 1)
+
+
+def is_timestamp_field(name):
+    return name == '_timestamp' or (
+        name.startswith('_') and name.endswith('_at'))
+
+
+def arrays_from_json(text, parse_dates=True, dates=(), exact_ints=False):
+    """
+    Decode a backdrop response into an ordered dict of column name to
+    NumPy array. Timestamp columns, and any named in ``dates``, become
+    ``datetime64[us]`` in UTC when ``parse_dates`` is set.
+
+    Integer columns with missing values become floats with NaN for the
+    gaps, unless ``exact_ints`` is set, when they are kept as object
+    arrays of ``int`` and ``None``.
+    """
+    numpy = _import_numpy()
+    decoded = json.loads(text, object_pairs_hook=ColumnDecoder())
+    if isinstance(decoded, _Ref):
+        top = decoded.shape
+        if 'data' in top.keys:
+            decoded = top.rows[decoded.row][top.keys.index('data')]
+        else:
+            decoded = []
+    columns = _assemble(decoded, numpy)
+    return _to_arrays(columns, numpy, parse_dates, dates, exact_ints)
+
+
+def arrays_from_columns(columns, parse_dates=True, dates=(),
+                        exact_ints=False):
+    """Like ``arrays_from_json`` for columns already in memory"""
+    return _to_arrays(columns, _import_numpy(), parse_dates, dates,
+                      exact_ints)
+
+
+def frame_from_arrays(arrays):
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError('pandas is required for data frames; install '
+                          'performanceplatform-client[pandas]')
+    return pandas.DataFrame(arrays, columns=list(arrays))
+
+
+def _assemble(refs, numpy):
+    """Gather the columns of the top-level records, in order."""
+    count = len(refs)
+    shapes = OrderedDict()
+    for position, ref in enumerate(refs):
+        shapes.setdefault(ref.shape, ([], []))
+        rows, positions = shapes[ref.shape]
+        rows.append(ref.row)
+        positions.append(position)
+
+    names = []
+    for shape in shapes:
+        names.extend(key for key in shape.keys if key not in names)
+
+    if len(shapes) == 1:
+        shape = next(iter(shapes))
+        if len(shape.rows) == count:
+            # The common case: every object parsed was a top-level record
+            return OrderedDict(zip(shape.keys, shape.columns()))
+
+    columns = OrderedDict(
+        (name, numpy.empty(count, dtype=object)) for name in names)
+    for shape, (rows, positions) in shapes.items():
+        positions = numpy.asarray(positions)
+        rows = numpy.asarray(rows)
+        for name, values in zip(shape.keys, shape.columns()):
+            column = numpy.empty(len(values), dtype=object)
+            column[:] = values
+            columns[name][positions] = column[rows]
+    return columns
+
+
+def _to_arrays(columns, numpy, parse_dates, dates, exact_ints=False):
+    arrays = OrderedDict()
+    for name, values in columns.items():
+        values = _object_array(values, numpy)
+        if parse_dates and (is_timestamp_field(name) or name in dates):
+            arrays[name] = _datetimes(values, numpy)
+            continue
+
+        kinds = set(map(type, values))
+        if _Ref in kinds or list in kinds:
+            values = _object_array(list(map(_plain, values)), numpy)
+        arrays[name] = _narrow(values, numpy, exact_ints)
+    return arrays
+
+
+def _object_array(values, numpy):
+    if isinstance(values, numpy.ndarray):
+        return values
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _narrow(values, numpy, exact_ints=False):
+    """Give a column a native dtype where its values allow it."""
+    missing = numpy.equal(values, None)
+    present = values[~missing]
+    if not len(present):
+        return values
+    kinds = set(map(type, present))
+    if kinds <= set([int, long, float]):
+        if float not in kinds and (
+                missing.any() and exact_ints or not _fits_int64(present)):
+            return values
+        if missing.any() or float in kinds:
+            result = numpy.full(len(values), numpy.nan)
+            result[~missing] = present.astype(float)
+            return result
+        return values.astype(numpy.int64)
+    if kinds == set([bool]) and not missing.any():
+        return values.astype(bool)
+    return values
+
+
+def _fits_int64(values):
+    return _INT64_MIN <= min(values) and max(values) <= _INT64_MAX
+
+
+def _datetimes(values, numpy):
+    result = numpy.full(len(values), numpy.datetime64('NaT'),
+                        dtype='datetime64[us]')
+    missing = numpy.equal(values, None)
+    present = values[~missing].astype(numpy.unicode_)
+    if not len(present):
+        return result
+
+    # backdrop writes UTC timestamps with a fixed width, which can be
+    # trimmed and parsed by NumPy in one go
+    if (numpy.char.str_len(present) == 25).all() and \
+            numpy.char.endswith(present, '+00:00').all():
+        result[~missing] = present.astype('U19').astype('datetime64[us]')
+        return result
+
+    parsed = []
+    for value in present:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError('{!r} is not a timestamp'.format(value))
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(pytz.UTC).replace(tzinfo=None)
+        parsed.append(moment)
+    result[~missing] = numpy.array(parsed, dtype='datetime64[us]')
+    return result
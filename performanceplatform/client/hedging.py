@@ -0,0 +1,140 @@
+"""
+Cut the tail latency of reads by sending a second copy of slow ones.
+
+Most GETs answer quickly, but the occasional one lands on a busy backend
+and takes many times longer. A ``Hedger`` remembers how long recent GETs
+took; when one has not answered within ``percentile`` of those, the same
+request is sent again and whichever answers first is used::
+
+    data_set.hedger = Hedger(percentile=0.95, budget=0.05)
+
+GETs are idempotent, so the extra copy is harmless, but it is still load.
+No more than ``budget`` of requests (5% by default) are ever hedged, and
+nothing is hedged until ``min_samples`` latencies have been seen. The
+slower copy is left to finish in the background and its latency recorded
+like any other.
+"""
+import threading
+import time
+from collections import deque
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from .stats import percentile
+from .workers import ForkSafeLock
+
+
+# Recalculate the hedging delay after this many new latencies
+_RECALCULATE_EVERY = 16
+
+
+class Hedger(object):
+
+    """Sends a second copy of any request slower than most recent ones"""
+
+    def __init__(self, percentile=0.95, budget=0.05, min_samples=20,
+                 window=1000, min_delay=0.005, clock=time.time):
+        if not 0 < percentile < 1:
+            raise ValueError('percentile must be between 0 and 1')
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._clock = clock
+        self._lock = ForkSafeLock()
+        self._latencies = deque(maxlen=window)
+        self._delay = None
+        self._stale = 0
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    @property
+    def delay(self):
+        """How long to wait before hedging, or ``None`` if not yet known"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            if self._delay is None or self._stale >= _RECALCULATE_EVERY:
+                self._delay = max(self.min_delay, percentile(
+                    self._latencies, self.percentile))
+                self._stale = 0
+            return self._delay
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'denied': self.denied,
+                'delay': self._delay,
+            }
+
+    def run(self, send):
+        """Call ``send``, and again if it is slow; return the first answer"""
+        delay = self.delay
+        with self._lock:
+            self.requests += 1
+        if delay is None:
+            started = self._clock()
+            response = send()
+            self._observe(self._clock() - started)
+            return response
+
+        results = queue.Queue()
+        self._attempt(send, results, hedge=False)
+        attempts = 1
+        try:
+            outcome = results.get(timeout=delay)
+        except queue.Empty:
+            if self._may_hedge():
+                self._attempt(send, results, hedge=True)
+                attempts = 2
+            outcome = results.get()
+
+        hedge, response, error = outcome
+        if error is not None and attempts == 2:
+            # A failure only wins if the other copy fails as well
+            other = results.get()
+            if other[2] is None:
+                hedge, response, error = other
+        if error is not None:
+            raise error
+        if hedge:
+            with self._lock:
+                self.hedge_wins += 1
+        return response
+
+    def _attempt(self, send, results, hedge):
+        def attempt():
+            started = self._clock()
+            try:
+                response = send()
+            except Exception as e:
+                results.put((hedge, None, e))
+            else:
+                self._observe(self._clock() - started)
+                results.put((hedge, response, None))
+
+        thread = threading.Thread(target=attempt, name='pp-hedge')
+        thread.daemon = True
+        thread.start()
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                self.denied += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def _observe(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._stale += 1
@@ -0,0 +1,220 @@
+"""
+Stream CSV or JSON Lines files into a data set.
+
+Records are read, coerced and uploaded one chunk at a time so memory use
+does not grow with the size of the input.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from .data_set import DataSet
+from .dates import has_time, parse_datetime
+
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+
+_INTEGER = re.compile(r'^-?(0|[1-9]\d*)$')
+_FLOAT = re.compile(r'^-?(0|[1-9]\d*)\.\d+$')
+
+
+def coerce_value(value, numbers=True):
+    """
+    Turn a string from an input file into the value backdrop expects.
+
+    Strings carrying a date and time become ``datetime`` objects so that
+    ``JsonEncoder`` serialises them exactly as it would for a record built
+    in Python; ones that only look like a date and time (such as
+    ``2012-02-30 10:00``) are kept as they are. With ``numbers`` set,
+    integers, floats and booleans are converted too; strings with leading
+    zeros are left alone.
+
+    >>> coerce_value('42'), coerce_value('007'), coerce_value('true')
+    (42, '007', True)
+    >>> coerce_value('2012-12-12 10:00:00')
+    datetime.datetime(2012, 12, 12, 10, 0)
+    """
+    if not isinstance(value, basestring):
+        return value
+    if has_time(value):
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            return parsed
+        return value
+    if numbers:
+        if _INTEGER.match(value):
+            return int(value)
+        if _FLOAT.match(value):
+            return float(value)
+        lowered = value.lower()
+        if lowered in ('true', 'false'):
+            return lowered == 'true'
+    return value
+
+
+def read_csv(f, coerce=True, keep_empty=False):
+    """
+    Yield a record for each row. Empty cells are left out of the record
+    (backdrop refuses an empty ``_timestamp``, for one) unless
+    ``keep_empty`` is set.
+    """
+    for row in csv.DictReader(f):
+        if not keep_empty:
+            row = dict((k, v) for k, v in row.items() if v != '')
+        if coerce:
+            row = dict((k, coerce_value(v)) for k, v in row.items())
+        yield row
+
+
+def read_jsonl(f, coerce=True):
+    for line_num, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError('line {}: {}'.format(line_num, e))
+        if coerce and isinstance(record, dict):
+            record = dict(
+                (k, coerce_value(v, numbers=False))
+                for k, v in record.items())
+        yield record
+
+
+def read_records(f, format, coerce=True, keep_empty=False):
+    """Lazily yield records from the open file ``f``."""
+    if format == 'csv':
+        return read_csv(f, coerce, keep_empty)
+    if format == 'jsonl':
+        return read_jsonl(f, coerce)
+    raise ValueError('format must be one of {}'.format(', '.join(FORMATS)))
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise ValueError('cannot guess the format of {}'.format(path))
+
+
+class Progress(object):
+
+    """Counts records as chunks are acknowledged and logs the rate"""
+
+    def __init__(self, every=1, out=None):
+        self.every = every
+        self.out = out
+        self.chunks = 0
+        self.records = 0
+        self.started = time.time()
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.records / elapsed if elapsed > 0 else 0.0
+
+    def __call__(self, chunk_num, chunk_length):
+        self.chunks = chunk_num
+        self.records += chunk_length
+        if chunk_num % self.every == 0:
+            self.report()
+
+    def report(self):
+        message = 'Sent {} records in {} chunks ({:.0f} records/s)'.format(
+            self.records, self.chunks, self.rate)
+        if self.out is not None:
+            self.out.write(message + '\n')
+            self.out.flush()
+        else:
+            log.info(message)
+
+
+def import_records(data_set, records, chunk_size=1000, workers=1,
+                   progress=None):
+    """
+    Upload an iterable of records through the chunked ``post`` path.
+
+    Returns the ``Progress`` object with the final record and chunk counts.
+    """
+    if progress is None:
+        progress = Progress()
+    data_set.post(records, chunk_size=chunk_size, workers=workers,
+                  progress=progress)
+    return progress
+
+
+def import_file(data_set, path, format=None, coerce=True, chunk_size=1000,
+                workers=1, progress=None, keep_empty=False):
+    """Stream the CSV or JSON Lines file at ``path`` into ``data_set``."""
+    format = format or guess_format(path)
+    with _open(path, format) as f:
+        return import_records(
+            data_set, read_records(f, format, coerce, keep_empty),
+            chunk_size=chunk_size, workers=workers, progress=progress)
+
+
+def _open(path, format):
+    if sys.version_info[0] < 3:
+        return open(path, 'rb')
+    if format == 'csv':
+        return open(path, 'r', newline='')
+    return open(path, 'r')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Stream a CSV or JSON Lines file into a data set')
+    parser.add_argument('path', help='file to import, or - for stdin')
+    parser.add_argument('--url', required=True,
+                        help='full URL of the data set')
+    parser.add_argument('--token', default=os.environ.get('PP_TOKEN'),
+                        help='bearer token (defaults to $PP_TOKEN)')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='input format (guessed from the extension)')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--no-coerce', dest='coerce', action='store_false',
+                        help='send values exactly as they appear')
+    parser.add_argument('--keep-empty', action='store_true',
+                        help='send empty CSV cells as empty strings')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.path == '-' and args.format is None:
+        parser.error('--format is required when reading from stdin')
+
+    data_set = DataSet(args.url, args.token, dry_run=args.dry_run)
+    progress = Progress(every=10, out=None if args.quiet else sys.stderr)
+    options = dict(chunk_size=args.chunk_size, workers=args.workers,
+                   progress=progress)
+
+    if args.path == '-':
+        records = read_records(sys.stdin, args.format, args.coerce,
+                               args.keep_empty)
+        import_records(data_set, records, **options)
+    else:
+        import_file(data_set, args.path, format=args.format,
+                    coerce=args.coerce, keep_empty=args.keep_empty,
+                    **options)
+
+    if not args.quiet:
+        progress.report()
+        if args.dry_run:
+            sys.stderr.write('Dry run: {}\n'.format(
+                data_set.dry_run_report.format(args.workers)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
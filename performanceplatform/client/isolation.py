@@ -0,0 +1,60 @@
+"""
+Find the records that made the server reject a chunk.
+
+A rejected chunk is split in half and each half sent again, recursively,
+so the good records still get through and each bad one is pinned down
+with the server's error. With ``k`` bad records in a chunk of ``n`` this
+takes roughly ``k * log2(n)`` extra requests, each half the size of the
+last, instead of ``n`` single-record ones. A half is not sent at all when
+the other half was accepted, as it must hold the bad record.
+
+Backdrop checks every record in a request before writing any of them, so
+sending halves again never writes a record twice.
+"""
+import logging
+
+import requests
+
+
+log = logging.getLogger(__name__)
+
+# Responses meaning the records were bad, rather than the request or server
+REJECTED_STATUSES = (400, 422)
+
+
+def is_rejection(error):
+    response = getattr(error, 'response', None)
+    return response is not None and \
+        response.status_code in REJECTED_STATUSES
+
+
+def bisect_failures(send, records, rejected=None):
+    """
+    Send ``records`` with ``send(records)``, splitting them up if they are
+    rejected. Returns ``(record, error text)`` for each record the server
+    would not take. Other errors are raised as usual.
+
+    ``rejected`` is the error text if ``records`` are already known to be
+    rejected, in which case they are split without being sent.
+    """
+    records = list(records)
+    if not records:
+        return []
+    if rejected is None:
+        try:
+            send(records)
+            return []
+        except requests.HTTPError as e:
+            if not is_rejection(e):
+                raise
+            rejected = e.response.text
+    if len(records) == 1:
+        return [(records[0], rejected)]
+    log.warning('{} records rejected, splitting them to find out '
+                'which'.format(len(records)))
+
+    middle = len(records) // 2
+    failures = bisect_failures(send, records[:middle])
+    # If the first half went through, the second half must be to blame
+    return failures + bisect_failures(
+        send, records[middle:], None if failures else rejected)
@@ -0,0 +1,157 @@
+"""
+Find out how many writes the API can take at once, rather than guess.
+
+With a fixed number of workers, parallel posts either leave backdrop idle
+or push it into 503s. An ``AdaptiveLimiter`` caps the requests in flight
+and moves the cap the way TCP moves its congestion window: it grows by
+``increase`` each time a full window of requests succeeds at a healthy
+latency, and is multiplied by ``decrease`` when a request fails with a
+5xx or 429, times out, or the smoothed latency climbs past
+``latency_tolerance`` times the lowest seen::
+
+    data_set.limiter = AdaptiveLimiter(initial=4, maximum=32)
+    data_set.post(records, chunk_size=1000, workers=32)
+
+``workers`` then only sets the most that may ever be in flight. Each
+attempt made by ``_exponential_backoff`` goes through the limiter, so a
+struggling backend sees fewer requests as well as later ones.
+
+Only requests started after the last cut can cut again, so one burst of
+failures halves the limit once rather than collapsing it.
+"""
+import logging
+import time
+
+import requests
+
+from .workers import ForkSafeCondition
+
+
+log = logging.getLogger(__name__)
+
+# Once the latency is known it is only ever allowed to drift up this much
+# of the way towards each new measurement, so slow responses cannot
+# quickly become the new normal
+_BASELINE_DRIFT = 0.01
+
+
+class AdaptiveLimiter(object):
+
+    """
+    Caps requests in flight at a limit between ``minimum`` and ``maximum``.
+    Latencies under ``min_latency`` seconds are too noisy to compare, so
+    the baseline is never taken to be lower.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0,
+                 decrease=0.5, latency_tolerance=2.0, smoothing=0.2,
+                 min_latency=0.01, clock=time.time):
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError('need 1 <= minimum <= initial <= maximum')
+        if not 0 < decrease < 1:
+            raise ValueError('decrease must be between 0 and 1')
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.min_latency = min_latency
+        self._clock = clock
+        self._condition = ForkSafeCondition(after_fork=self._after_fork)
+        self._epoch = 0
+
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.decreases = 0
+        self.latency = None
+        self.baseline = None
+
+    def _after_fork(self):
+        # Requests in flight at fork belong to threads the child lacks
+        self.in_flight = 0
+
+    def metrics(self):
+        """A consistent snapshot of the limiter's state"""
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'failures': self.failures,
+                'decreases': self.decreases,
+                'latency': self.latency,
+                'baseline_latency': self.baseline,
+            }
+
+    def run(self, send):
+        """
+        Call ``send`` once there is room under the limit and return the
+        response, adjusting the limit by how it went.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            epoch = self._epoch
+        started = self._clock()
+        try:
+            response = send()
+        except (requests.ConnectionError, requests.Timeout):
+            self._release(epoch, None, overloaded=True)
+            raise
+        except BaseException:
+            self._release(epoch, None, overloaded=False)
+            raise
+        self._release(epoch, self._clock() - started,
+                      overloaded=response.status_code >= 500 or
+                      response.status_code == 429)
+        return response
+
+    def _release(self, epoch, latency, overloaded):
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if overloaded:
+                self.failures += 1
+            elif latency is not None:
+                self._observe(latency)
+
+            if overloaded or self._inflated():
+                if epoch == self._epoch:
+                    self._cut('failure' if overloaded else 'latency')
+                    if not overloaded:
+                        # Judge the new limit on latencies measured under it
+                        self.latency = self.baseline
+            elif latency is not None and \
+                    self.in_flight + 1 >= self.limit / 2:
+                # Only grow while the current limit is actually being used
+                self.limit = min(self.maximum,
+                                 self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+    def _observe(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += (latency - self.latency) * self.smoothing
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        else:
+            self.baseline += (self.latency - self.baseline) * _BASELINE_DRIFT
+
+    def _inflated(self):
+        return self.baseline is not None and self.latency > max(
+            self.baseline, self.min_latency) * self.latency_tolerance
+
+    def _cut(self, reason):
+        if self.limit <= self.minimum:
+            return
+        limit = max(self.minimum, self.limit * self.decrease)
+        log.info('Cutting concurrency limit from {} to {} ({})'.format(
+            int(self.limit), int(limit), reason))
+        self.limit = limit
+        self.decreases += 1
+        self._epoch += 1
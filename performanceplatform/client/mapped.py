@@ -0,0 +1,270 @@
+"""
+Keep data set columns in a file that many processes map read-only.
+
+Each web worker holding its own copy of a large data set multiplies memory
+by the number of workers. ``write_columns`` saves NumPy columns (as from
+``DataSet.get_arrays``) in a compact columnar file, and ``MappedColumns``
+maps it so that every process reads the same pages from the OS page
+cache::
+
+    write_columns('/var/cache/pp/claims.ppcols', data_set.get_arrays())
+    columns = MappedColumns('/var/cache/pp/claims.ppcols').columns()
+
+The file starts with a magic string, the length of a JSON header and the
+header itself, which lists each column's type and where its data is.
+Column data is aligned to 64 bytes. Numbers, booleans and timestamps are
+stored as little-endian arrays and read without copying. Other columns
+(mostly strings) are stored as ``int32`` codes into a dictionary of their
+distinct values, with ``-1`` for a missing value. The dictionary is read
+once per process, and the codes are mapped like any other column. Asked
+for ``columns(decode=False)``, they stay that way as ``DictionaryColumn``
+objects, which only decode the rows taken from them.
+
+Files are written to a temporary name and renamed over the old one, so a
+reader sees either the old snapshot or the new one in full. Processes
+that still map the old file keep it until they let go of it.
+``file_lock`` lets one process write a file while the rest wait for it.
+Needs ``numpy``.
+"""
+import json
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .records import _import_numpy
+
+
+MAGIC = b'PPCOLS1\n'
+ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct('<Q')
+
+
+class SnapshotError(Exception):
+
+    """Raised for a file that is not a readable columns snapshot"""
+
+
+def _padding(offset):
+    return -offset % ALIGNMENT
+
+
+def _encode_dictionary(values, numpy):
+    """``int32`` codes for ``values`` and the distinct values they index"""
+    codes = numpy.empty(len(values), dtype='<i4')
+    positions = {}
+    dictionary = []
+    for row, value in enumerate(values):
+        if value is None or value != value:
+            codes[row] = -1
+            continue
+        # Strings are kept apart from other values with the same JSON
+        if isinstance(value, basestring):
+            key = (True, value)
+        else:
+            key = (False, json.dumps(value, sort_keys=True))
+        code = positions.get(key)
+        if code is None:
+            code = positions[key] = len(dictionary)
+            dictionary.append(value)
+        codes[row] = code
+    return codes, dictionary
+
+
+def write_columns(path, columns, metadata=None):
+    """
+    Save ``columns`` (an ordered mapping of name to NumPy array) to
+    ``path``, replacing any file already there in one step.
+    """
+    numpy = _import_numpy()
+    lengths = set(len(values) for values in columns.values())
+    if len(lengths) > 1:
+        raise ValueError('columns must all be the same length')
+    descriptors = []
+    blocks = []
+    offset = [0]
+
+    def add(data):
+        start = offset[0]
+        blocks.append(data)
+        offset[0] += len(data) + _padding(len(data))
+        return start
+
+    for name, values in columns.items():
+        if values.dtype.kind == 'O':
+            codes, dictionary = _encode_dictionary(values, numpy)
+            descriptors.append({
+                'name': name,
+                'encoding': 'dictionary',
+                'codes': add(codes.tobytes()),
+                'dictionary': add(json.dumps(dictionary).encode('utf-8')),
+                'dictionary_bytes': len(blocks[-1]),
+            })
+        else:
+            dtype = values.dtype.newbyteorder('<')
+            descriptors.append({
+                'name': name,
+                'encoding': 'plain',
+                'dtype': dtype.str,
+                'offset': add(numpy.ascontiguousarray(
+                    values, dtype=dtype).tobytes()),
+            })
+
+    header = json.dumps({
+        'length': lengths.pop() if lengths else 0,
+        'metadata': metadata or {},
+        'columns': descriptors,
+    }).encode('utf-8')
+    preamble = MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(preamble + b'\0' * _padding(len(preamble)))
+            for data in blocks:
+                f.write(data)
+                f.write(b'\0' * _padding(len(data)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class DictionaryColumn(object):
+
+    """
+    A dictionary column left encoded: ``codes`` (usually mapped) into
+    ``dictionary``. Indexing it decodes only the rows asked for, into an
+    object array.
+    """
+
+    def __init__(self, codes, dictionary, numpy):
+        self.codes = codes
+        # Code -1 picks the None on the end
+        self._lookup = numpy.empty(len(dictionary) + 1, dtype=object)
+        self._lookup[:-1] = dictionary
+        self.dtype = self._lookup.dtype
+
+    @property
+    def dictionary(self):
+        return self._lookup[:-1]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return self._lookup[self.codes[rows]]
+
+
+class MappedColumns(object):
+
+    """The columns in a snapshot file, mapped read-only"""
+
+    def __init__(self, path):
+        self._numpy = _import_numpy()
+        self.path = path
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError('{} is empty'.format(path))
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise SnapshotError('{} is not a columns snapshot'.format(path))
+        header_length, = _HEADER_LENGTH.unpack(
+            self._map[len(MAGIC):start])
+        header = json.loads(self._map[start:start + header_length].decode(
+            'utf-8'))
+        self._data = start + header_length + _padding(start + header_length)
+        self.length = header['length']
+        self.metadata = header['metadata']
+        self._descriptors = OrderedDict(
+            (column['name'], column) for column in header['columns'])
+        self._dictionaries = {}
+        self._decoded = {}
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def names(self):
+        return list(self._descriptors)
+
+    def replaced(self):
+        """Whether a newer snapshot has been renamed over this one"""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    def _array(self, dtype, offset):
+        return self._numpy.frombuffer(self._map, dtype=dtype,
+                                      count=self.length,
+                                      offset=self._data + offset)
+
+    def codes(self, name):
+        """The mapped ``int32`` codes of a dictionary column"""
+        return self._array('<i4', self._descriptors[name]['codes'])
+
+    def dictionary(self, name):
+        """The distinct values of a dictionary column"""
+        dictionary = self._dictionaries.get(name)
+        if dictionary is None:
+            column = self._descriptors[name]
+            start = self._data + column['dictionary']
+            dictionary = self._dictionaries[name] = json.loads(
+                self._map[start:start + column['dictionary_bytes']].decode(
+                    'utf-8'))
+        return dictionary
+
+    def __getitem__(self, name):
+        """
+        A column as a NumPy array: mapped for plain columns, and an object
+        array of the dictionary's values for dictionary columns.
+        """
+        column = self._descriptors[name]
+        if column['encoding'] == 'plain':
+            return self._array(column['dtype'], column['offset'])
+        values = self._decoded.get(name)
+        if values is None:
+            values = self._decoded[name] = self.encoded(name)[:]
+        return values
+
+    def encoded(self, name):
+        """A dictionary column as a ``DictionaryColumn`` over its codes"""
+        return DictionaryColumn(self.codes(name), self.dictionary(name),
+                                self._numpy)
+
+    def columns(self, decode=True):
+        """
+        Every column by name. Without ``decode``, dictionary columns are
+        ``DictionaryColumn`` objects, so that they stay shared too.
+        """
+        return OrderedDict(
+            (name, self[name] if decode or column['encoding'] == 'plain'
+             else self.encoded(name))
+            for name, column in self._descriptors.items())
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on ``path`` (where ``fcntl`` is available)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,141 @@
+"""
+Post a JSON Lines file without decoding it.
+
+The file is memory mapped and cut into chunks of about ``chunk_bytes`` at
+line boundaries. Each chunk is sent as a JSON array by streaming the
+mapped bytes with newlines turned into commas, so records are never parsed
+and nothing larger than a socket write is copied. Chunks with blank lines
+inside them, which would not make valid JSON that way, are rebuilt line by
+line instead.
+"""
+import mmap
+import re
+
+from .base import EncodedPayload
+from .workers import imap_bounded
+
+
+_WHITESPACE = b' \t\r\n'
+_BLANK_LINE = re.compile(br'\n[ \t\r]*\n')
+_NEWLINE = re.compile(br'\n')
+
+
+class JsonArrayReader(object):
+
+    """
+    Streams the JSON Lines in ``buf[start:end]`` as a JSON array.
+
+    ``start`` and ``end`` must not cut a line in two and the range must
+    not contain blank lines.
+    """
+
+    def __init__(self, buf, start, end):
+        self._buf = buf
+        self._start = start
+        self._length = end - start + 2
+        self._position = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def records(self):
+        return sum(1 for _ in _NEWLINE.finditer(
+            self._buf, self._start, self._start + self._length - 2)) + 1
+
+    def read(self, size=-1):
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        end = self._position + size
+        parts = []
+        if self._position == 0 and size > 0:
+            parts.append(b'[')
+        data_from = max(self._position, 1)
+        data_to = min(end, self._length - 1)
+        if data_from < data_to:
+            offset = self._start - 1
+            parts.append(self._buf[offset + data_from:offset + data_to]
+                         .replace(b'\n', b','))
+        if end == self._length and size > 0:
+            parts.append(b']')
+        self._position = end
+        return b''.join(parts)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        self._position = offset + (self._length if whence == 2 else 0)
+
+
+def line_ranges(buf, chunk_bytes):
+    """
+    Yield ``(start, end)`` offsets of chunks of whole lines in ``buf``,
+    each about ``chunk_bytes`` long (longer if a single line is), without
+    leading or trailing whitespace.
+    """
+    size = len(buf)
+    start = 0
+    while True:
+        while start < size and buf[start:start + 1] in _WHITESPACE:
+            start += 1
+        if start >= size:
+            return
+        if start + chunk_bytes >= size:
+            end = size
+        else:
+            end = buf.rfind(b'\n', start, start + chunk_bytes) + 1
+            if end <= start:
+                end = buf.find(b'\n', start + chunk_bytes) + 1 or size
+        next_start = end
+        while end > start and buf[end - 1:end] in _WHITESPACE:
+            end -= 1
+        yield start, end
+        start = next_start
+
+
+def _payload(buf, start, end):
+    """An ``EncodedPayload`` for the lines in ``buf[start:end]``"""
+    if _BLANK_LINE.search(buf, start, end) is None:
+        return EncodedPayload(JsonArrayReader(buf, start, end))
+    lines = [line for line in buf[start:end].split(b'\n') if line.strip()]
+    return EncodedPayload(b'[' + b','.join(lines) + b']',
+                          records=len(lines))
+
+
+def _records(payload):
+    if payload.records is not None:
+        return payload.records
+    return payload.body.records
+
+
+def post_json_lines(data_set, path, chunk_bytes=1024 * 1024, workers=1,
+                    progress=None):
+    """
+    Post the JSON Lines file at ``path`` to ``data_set`` in chunks of about
+    ``chunk_bytes``, on up to ``workers`` threads. ``progress`` is called
+    with the chunk number and record count after each chunk, in order.
+    Returns the number of chunks sent.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        if f.tell() == 0:
+            return 0
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        def send(numbered_range):
+            chunk_num, (start, end) = numbered_range
+            payload = _payload(buf, start, end)
+            data_set._send_records('', payload)
+            return chunk_num, payload
+
+        sent = 0
+        numbered = enumerate(line_ranges(buf, chunk_bytes), 1)
+        for chunk_num, payload in imap_bounded(send, numbered, workers):
+            sent = chunk_num
+            if progress is not None:
+                progress(chunk_num, _records(payload))
+        return sent
+    finally:
+        buf.close()
@@ -0,0 +1,226 @@
+"""
+Declarative management of admin objects.
+
+``make_plan`` reads the current data sets, dashboards and module types in
+parallel, compares them with the desired definitions and works out the
+smallest set of writes needed. Only fields present in a desired
+definition are compared, so server-managed fields such as ids and
+timestamps never show up as changes. ``apply_plan`` then performs the
+writes concurrently, creating data sets and module types before the
+dashboards that might use them. A dashboard update sends the whole
+dashboard, with the desired fields laid over its current definition.
+
+Planning with a ``dry_run`` client still reads the current state from the
+API, so that the plan shows what would really be written.
+
+The admin API cannot update data sets or module types, so changes to
+existing ones are reported but not applied.
+"""
+import copy
+import logging
+from collections import namedtuple
+
+from .workers import imap_bounded
+
+
+log = logging.getLogger(__name__)
+
+# kind: (identifying field, list method, create method, update method)
+KINDS = {
+    'data_sets': ('name', 'list_data_sets', 'create_data_set', None),
+    'module_types': ('name', 'list_module_types', 'add_module_type', None),
+    'dashboards': ('slug', 'list_dashboards', 'create_dashboard',
+                   'update_dashboard'),
+}
+# Objects that others may refer to are written first
+PHASES = (('data_sets', 'module_types'), ('dashboards',))
+
+SYMBOLS = {'create': '+', 'update': '~', 'delete': '-', 'unsupported': '!'}
+
+
+class Action(namedtuple('Action', 'operation kind key data current_id '
+                                  'changes')):
+
+    """One write needed to reach the desired state"""
+
+    def describe(self):
+        line = '{} {} {} {}'.format(
+            SYMBOLS[self.operation], self.operation, self.kind[:-1],
+            self.key)
+        if self.changes:
+            line += ' ({})'.format(', '.join(sorted(self.changes)))
+        return line
+
+
+class Plan(object):
+
+    def __init__(self, actions):
+        self.actions = actions
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    @property
+    def writes(self):
+        return [action for action in self.actions
+                if action.operation != 'unsupported']
+
+    def format(self):
+        if not self.actions:
+            return 'No changes.'
+        lines = [action.describe() for action in self.actions]
+        counts = dict((operation, sum(1 for action in self.actions
+                                      if action.operation == operation))
+                      for operation in SYMBOLS)
+        lines.append(
+            '{create} to create, {update} to update, {delete} to delete, '
+            '{unsupported} unsupported.'.format(**counts))
+        return '\n'.join(lines)
+
+
+def changed_fields(desired, current):
+    """Top-level fields of ``desired`` whose values differ in ``current``"""
+    return [key for key, value in desired.items()
+            if not _matches(value, current.get(key))]
+
+
+def _matches(desired, current):
+    if isinstance(desired, dict):
+        return isinstance(current, dict) and \
+            not changed_fields(desired, current)
+    if isinstance(desired, list):
+        return isinstance(current, list) and len(desired) == len(current) \
+            and all(_matches(d, c) for d, c in zip(desired, current))
+    return desired == current
+
+
+def _unwrap(listing, kind):
+    if isinstance(listing, dict):
+        listing = listing.get(kind, [])
+    return listing or []
+
+
+def _reader(admin):
+    """``admin``, or a copy of it that makes real reads if it is dry run"""
+    if not admin.dry_run:
+        return admin
+    reader = copy.copy(admin)
+    reader.reconfigure(dry_run=False)
+    return reader
+
+
+def read_state(admin, kinds=None, workers=3):
+    """Current objects of each kind, keyed by their identifying field."""
+    admin = _reader(admin)
+    kinds = list(kinds or KINDS)
+
+    def read(kind):
+        field, list_method = KINDS[kind][:2]
+        listing = _unwrap(getattr(admin, list_method)(), kind)
+        return kind, dict((item.get(field), item) for item in listing)
+
+    return dict(imap_bounded(read, kinds, workers))
+
+
+def make_plan(admin, desired, prune=False, workers=8):
+    """
+    Compare ``desired`` (a dict of kind to list of definitions, for kinds
+    ``data_sets``, ``module_types`` and ``dashboards``) with the admin API.
+
+    With ``prune``, dashboards that are not in ``desired`` are deleted.
+    """
+    unknown = set(desired) - set(KINDS)
+    if unknown:
+        raise ValueError('unknown kinds: {}'.format(', '.join(unknown)))
+
+    current = read_state(admin, [kind for kind in KINDS if kind in desired])
+    _fill_in_dashboards(admin, desired, current, workers)
+
+    actions = []
+    for kind in sorted(desired):
+        field, _, _, update = KINDS[kind]
+        wanted = set()
+        for definition in desired[kind]:
+            key = definition[field]
+            wanted.add(key)
+            existing = current[kind].get(key)
+            if existing is None:
+                actions.append(Action('create', kind, key, definition,
+                                      None, ()))
+                continue
+            changes = changed_fields(definition, existing)
+            if changes:
+                actions.append(Action(
+                    'update' if update else 'unsupported', kind, key,
+                    dict(existing, **definition), existing.get('id'),
+                    tuple(changes)))
+
+        if prune and kind == 'dashboards':
+            for key, existing in sorted(current[kind].items()):
+                if key in wanted:
+                    continue
+                if existing.get('id') is None:
+                    log.warning('Cannot delete dashboard {} without an '
+                                'id'.format(key))
+                    continue
+                actions.append(Action('delete', kind, key, None,
+                                      existing['id'], ()))
+    return Plan(actions)
+
+
+def _fill_in_dashboards(admin, desired, current, workers):
+    """
+    Dashboard listings are summaries; fetch the full definition of each
+    desired dashboard that exists, both to compare it and because an
+    update replaces the whole dashboard.
+    """
+    admin = _reader(admin)
+    listed = current.get('dashboards', {})
+    existing = [
+        definition['slug'] for definition in desired.get('dashboards', [])
+        if definition['slug'] in listed and
+        listed[definition['slug']].get('id') is not None]
+    ids = [listed[slug]['id'] for slug in existing]
+
+    for slug, dashboard in zip(
+            existing, imap_bounded(admin.get_dashboard, ids, workers)):
+        if dashboard:
+            listed[slug] = dashboard
+
+
+def apply_plan(admin, plan, workers=8):
+    """
+    Carry out the writes in ``plan`` concurrently, one phase at a time.
+
+    With a ``dry_run`` client the requests are only logged. Returns a list
+    of ``(action, result)`` pairs, or ``(action, exception)`` for writes
+    that failed.
+    """
+    def perform(action):
+        log.info(action.describe())
+        _, _, create, update = KINDS[action.kind]
+        try:
+            if action.operation == 'create':
+                return action, getattr(admin, create)(action.data)
+            if action.operation == 'update':
+                return action, getattr(admin, update)(
+                    action.current_id, action.data)
+            return action, admin.delete_dashboard(action.current_id)
+        except Exception as e:
+            log.error('{} failed: {}'.format(action.describe(), e))
+            return action, e
+
+    writes = plan.writes
+    phases = [[action for action in writes
+               if action.kind in kinds and action.operation != 'delete']
+              for kinds in PHASES]
+    phases.append([action for action in writes
+                   if action.operation == 'delete'])
+
+    results = []
+    for actions in phases:
+        results.extend(imap_bounded(perform, actions, workers))
+    return results
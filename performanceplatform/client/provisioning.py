@@ -0,0 +1,183 @@
+"""
+Create many admin objects at once, in dependency order and in parallel.
+
+Definitions are dicts with a ``kind`` and the ``data`` that would be
+passed to the matching ``AdminAPI.create_*`` call::
+
+    {'kind': 'data_group', 'data': {'name': 'carers'}}
+    {'kind': 'data_set', 'data': {'name': 'carers_claims',
+                                  'data_group': 'carers', ...}}
+    {'kind': 'transform', 'data': {'input': {'data-group': 'carers', ...}}}
+    {'kind': 'dashboard', 'data': {'slug': 'carers', ...}}
+    {'kind': 'module', 'dashboard': 'carers', 'data': {...}}
+
+Dependencies on other objects in the same batch are worked out from those
+fields (a group before its data sets, data sets before their transforms,
+a dashboard before its modules). Anything referring to an object outside
+the batch is assumed to exist already. Each object is created as soon as
+everything it depends on has been, and objects whose dependencies failed
+are skipped.
+"""
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+log = logging.getLogger(__name__)
+
+KINDS = ('data_group', 'data_set', 'transform', 'dashboard', 'module')
+
+
+def _get(data, name):
+    """Read ``name`` in either its snake_case or kebab-case spelling."""
+    value = data.get(name)
+    if value is None:
+        value = data.get(name.replace('_', '-'))
+    return value
+
+
+def provides(definition):
+    """The references other definitions can use to depend on this one."""
+    kind, data = definition['kind'], definition.get('data') or {}
+    if kind == 'data_group':
+        return [('data_group', data.get('name'))]
+    if kind == 'data_set':
+        return [('data_set', data.get('name')),
+                ('data_set', _get(data, 'data_group'),
+                 _get(data, 'data_type'))]
+    if kind == 'dashboard':
+        return [('dashboard', data.get('slug'))]
+    return []
+
+
+def requires(definition):
+    kind, data = definition['kind'], definition.get('data') or {}
+    if kind == 'data_set':
+        return [('data_group', _get(data, 'data_group'))]
+    if kind == 'transform':
+        return [('data_set', _get(side, 'data_group'),
+                 _get(side, 'data_type'))
+                for side in (data.get('input'), data.get('output')) if side]
+    if kind == 'module':
+        references = [('dashboard', definition.get('dashboard'))]
+        data_set = data.get('data_set') or data.get('data-set')
+        if isinstance(data_set, dict):
+            references.append(('data_set', _get(data_set, 'data_group'),
+                               _get(data_set, 'data_type')))
+        elif data_set:
+            references.append(('data_set', data_set))
+        return references
+    return []
+
+
+def dependency_graph(definitions):
+    """For each definition, the indexes of the definitions it needs."""
+    providers = {}
+    for index, definition in enumerate(definitions):
+        if definition.get('kind') not in KINDS:
+            raise ValueError('unknown kind {!r} at {}'.format(
+                definition.get('kind'), index))
+        for reference in provides(definition):
+            providers.setdefault(reference, index)
+
+    return [sorted(set(providers[reference]
+                       for reference in requires(definition)
+                       if reference in providers and
+                       providers[reference] != index))
+            for index, definition in enumerate(definitions)]
+
+
+def provision(admin, definitions, workers=8):
+    """
+    Create every object in ``definitions`` using ``admin``.
+
+    Returns one report dict per definition, in the same order, with its
+    ``status`` (``created``, ``failed`` or ``skipped``), the API ``result``
+    or ``error`` and the time taken in ``seconds``.
+    """
+    definitions = list(definitions)
+    needs = dependency_graph(definitions)
+    dependents = [[] for _ in definitions]
+    for index, dependencies in enumerate(needs):
+        for dependency in dependencies:
+            dependents[dependency].append(index)
+    waiting = [len(dependencies) for dependencies in needs]
+    reports = [{'kind': definition['kind'], 'status': None, 'result': None,
+                'error': None, 'seconds': 0.0}
+               for definition in definitions]
+    dashboard_ids = {}
+
+    def create(index):
+        definition = definitions[index]
+        kind, data = definition['kind'], definition.get('data') or {}
+        if kind == 'module':
+            slug = definition.get('dashboard')
+            dashboard_id = definition.get('dashboard_id') or \
+                dashboard_ids.get(slug)
+            if dashboard_id is None:
+                raise ValueError('no id for dashboard {!r}'.format(slug))
+            return admin.add_module_to_dashboard(dashboard_id, data)
+        return getattr(admin, 'create_' + kind)(data)
+
+    def run(index):
+        started = time.time()
+        try:
+            return index, True, create(index), time.time() - started
+        except Exception as e:
+            return index, False, e, time.time() - started
+
+    finished = Queue()
+    pool = ThreadPool(workers)
+
+    def start(index):
+        pool.apply_async(run, (index,), callback=finished.put)
+
+    def skip(index, because):
+        for dependent in dependents[index]:
+            if reports[dependent]['status'] is None:
+                reports[dependent]['status'] = 'skipped'
+                reports[dependent]['error'] = because
+                skip(dependent, because)
+
+    try:
+        for index, count in enumerate(waiting):
+            if count == 0:
+                start(index)
+
+        outstanding = sum(1 for count in waiting if count == 0)
+        while outstanding:
+            index, ok, value, seconds = finished.get()
+            outstanding -= 1
+            report = reports[index]
+            report['seconds'] = seconds
+            if not ok:
+                report['status'], report['error'] = 'failed', value
+                log.error('Failed to create {} #{}: {}'.format(
+                    report['kind'], index, value))
+                skip(index, 'dependency #{} failed'.format(index))
+                continue
+
+            report['status'], report['result'] = 'created', value
+            if report['kind'] == 'dashboard':
+                slug = (definitions[index].get('data') or {}).get('slug')
+                dashboard_ids[slug] = (value or {}).get('id') or \
+                    (slug if admin.dry_run else None)
+            for dependent in dependents[index]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0 and \
+                        reports[dependent]['status'] is None:
+                    start(dependent)
+                    outstanding += 1
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return reports
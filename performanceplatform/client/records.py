@@ -0,0 +1,206 @@
+"""
+Compact containers for data set query results.
+
+Decoding a backdrop response into dicts costs a hash table per record.
+``RecordBatch`` instead keeps each record as a ``__slots__`` object holding
+a tuple of values and a reference to a ``Shape`` (the tuple of field names)
+shared by every record with the same fields. Field names and short string
+values are de-duplicated while parsing, and dates are only parsed when a
+column is asked for.
+"""
+import json
+from collections import OrderedDict
+
+from .dates import parse_datetime
+
+
+# Longer strings are unlikely to repeat and are not worth interning
+_SHARE_MAX_LENGTH = 64
+
+
+class Shape(object):
+
+    """The ordered field names shared by records with the same layout"""
+
+    __slots__ = ('keys', 'positions')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = dict((key, i) for i, key in enumerate(keys))
+
+
+class Record(object):
+
+    """A read-only, dict-like view of one record"""
+
+    __slots__ = ('_shape', '_values')
+
+    def __init__(self, shape, values):
+        self._shape = shape
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._shape.positions[key]]
+
+    def get(self, key, default=None):
+        position = self._shape.positions.get(key)
+        return default if position is None else self._values[position]
+
+    def __contains__(self, key):
+        return key in self._shape.positions
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._shape.keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return list(zip(self._shape.keys, self._values))
+
+    def to_dict(self):
+        return dict((key, _to_plain(value)) for key, value in self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Record({!r})'.format(self.to_dict())
+
+
+def _to_plain(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_to_plain(item) for item in value]
+    return value
+
+
+class Decoder(object):
+
+    """A ``json`` object hook that builds ``Record`` objects"""
+
+    def __init__(self):
+        self._strings = {}
+        self._shapes = {}
+
+    def share(self, value):
+        if isinstance(value, basestring) and \
+                len(value) <= _SHARE_MAX_LENGTH:
+            return self._strings.setdefault(value, value)
+        return value
+
+    def __call__(self, pairs):
+        keys = tuple(self.share(key) for key, _ in pairs)
+        shape = self._shapes.get(keys)
+        if shape is None:
+            shape = self._shapes[keys] = Shape(keys)
+        return Record(shape, tuple(self.share(value) for _, value in pairs))
+
+
+class RecordBatch(object):
+
+    """An immutable sequence of ``Record`` objects from one query"""
+
+    def __init__(self, records, meta=None):
+        self._records = records
+        self.meta = meta or {}
+
+    @classmethod
+    def from_json(cls, text):
+        decoded = json.loads(text, object_pairs_hook=Decoder())
+        if isinstance(decoded, Record):
+            meta = dict((key, _to_plain(value))
+                        for key, value in decoded.items() if key != 'data')
+            return cls(decoded.get('data', []), meta)
+        return cls(decoded)
+
+    @classmethod
+    def from_response(cls, response):
+        return cls.from_json(response.text)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def keys(self):
+        """Every field name in the batch, in the order first seen"""
+        seen = []
+        for shape in _unique(record._shape for record in self._records):
+            seen.extend(key for key in shape.keys if key not in seen)
+        return seen
+
+    def column(self, name, default=None, parse_dates=False):
+        values = [record.get(name, default) for record in self._records]
+        if parse_dates:
+            values = [_parse_if_date(value) for value in values]
+        return values
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self._records]
+
+    def to_numpy(self, name, dtype=None):
+        """The ``name`` column as a NumPy array (needs ``numpy``)"""
+        numpy = _import_numpy()
+        return numpy.asarray(self.column(name), dtype=dtype)
+
+    def to_arrays(self, parse_dates=True, dates=()):
+        """
+        Every column as a NumPy array, with timestamp columns converted to
+        ``datetime64`` (see ``frames.arrays_from_json``).
+        """
+        from .frames import arrays_from_columns
+        columns = OrderedDict()
+        for name in self.keys():
+            values = self.column(name)
+            kinds = set(map(type, values))
+            if Record in kinds or list in kinds:
+                values = list(map(_to_plain, values))
+            columns[name] = values
+        return arrays_from_columns(columns, parse_dates, dates)
+
+    def __repr__(self):
+        return '<RecordBatch of {} records>'.format(len(self))
+
+
+def _unique(items):
+    seen = set()
+    for item in items:
+        if id(item) not in seen:
+            seen.add(id(item))
+            yield item
+
+
+def _parse_if_date(value):
+    if isinstance(value, basestring):
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            return parsed
+    return value
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('numpy is required for array conversion; install '
+                          'performanceplatform-client[numpy]')
+    return numpy
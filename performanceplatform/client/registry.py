@@ -0,0 +1,246 @@
+"""
+Cheap data set clients that share one connection pool per host.
+
+A ``DataSet`` carries its own settings and opens a new connection for
+every request, which is wasteful when a process talks to thousands of data
+sets on the same host. A ``DataSetRegistry`` keeps one ``Transport`` (a
+``requests`` session plus the settings every client would otherwise copy)
+and hands out ``DataSetHandle`` objects that hold nothing but a reference
+to it, their URL and an optional write token::
+
+    registry = DataSetRegistry('https://www.performance.service.gov.uk/data')
+    claims = registry.data_set('carers-allowance', 'weekly-claims')
+
+Handles are cached, so asking for the same data set with the same token
+again returns the same object. They support everything a ``DataSet`` does,
+and like any client can be shared between threads. A process forked from
+one using the registry opens its own connections rather than share its
+parent's sockets, and its own locks rather than inherit ones held by
+threads that did not survive the fork.
+"""
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .base import ClientConfig, config_property
+from .data_set import DataSet
+from .dryrun import DryRunReport
+from .workers import ForkSafeLock
+
+
+class Transport(object):
+
+    """
+    Connection pool, retry policy, encoding and auth shared by handles.
+    The settings are held in an immutable ``ClientConfig``, as in
+    ``BaseClient``.
+    """
+
+    def __init__(self, token=None, dry_run=False, request_id_fn=None,
+                 retry_on_error=True, should_gzip=True, cache=None,
+                 pool_size=10, scheduler=None, limiter=None,
+                 hedger=None, endpoints=None):
+        if not isinstance(token, basestring) and token is not None:
+            raise ValueError("token must be a string or None")
+
+        self._config_lock = ForkSafeLock()
+        self._config = ClientConfig(token=token, dry_run=dry_run,
+                                    retry_on_error=retry_on_error,
+                                    should_gzip=should_gzip)
+        self.request_id_fn = request_id_fn or (lambda: 'Not-Set')
+        self.cache = cache
+        self.scheduler = scheduler
+        self.limiter = limiter
+        self.hedger = hedger
+        self.endpoints = endpoints
+        self.capture = None
+        self.log_payloads = False
+        self.dry_run_report = DryRunReport()
+        self.pool_size = pool_size
+        self._process = (os.getpid(), self._new_session())
+
+    @property
+    def config(self):
+        return self._config
+
+    def reconfigure(self, **changes):
+        with self._config_lock:
+            self._config = self._config._replace(**changes)
+
+    token = config_property('token')
+    dry_run = config_property('dry_run')
+    retry_on_error = config_property('retry_on_error')
+    should_gzip = config_property('should_gzip')
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def session(self):
+        """
+        This process's session. A forked child gets a new one: sharing
+        the parent's pooled sockets would interleave their requests.
+        """
+        pid, session = self._process
+        if pid != os.getpid():
+            # The parent's session is dropped, not closed, as closing it
+            # could shut down connections the parent is still using
+            pid, session = self._process = (os.getpid(), self._new_session())
+        return session
+
+    def send(self, **kwargs):
+        return self.session.request(**kwargs)
+
+    def close(self):
+        pid, session = self._process
+        if pid == os.getpid():
+            session.close()
+
+
+class DataSetHandle(DataSet):
+
+    """A ``DataSet`` whose settings and connections live in a ``Transport``"""
+
+    # Nothing is ever stored in the instance dict inherited from DataSet,
+    # so it is never allocated
+    __slots__ = ('_transport', '_base_url', '_token')
+
+    def __init__(self, transport, base_url, token=None):
+        self._transport = transport
+        self._base_url = base_url
+        self._token = token
+
+    @property
+    def config(self):
+        config = self._transport.config
+        if self._token is not None:
+            return config._replace(token=self._token)
+        return config
+
+    def reconfigure(self, **changes):
+        raise AttributeError('DataSetHandle settings are shared; change '
+                             'them on the registry\'s transport')
+
+    def set_token(self, token):
+        if not isinstance(token, basestring):
+            raise Exception("token must be a string")
+
+        self._token = token
+
+    @property
+    def cache(self):
+        return self._transport.cache
+
+    @property
+    def scheduler(self):
+        return self._transport.scheduler
+
+    @property
+    def limiter(self):
+        return self._transport.limiter
+
+    @property
+    def hedger(self):
+        return self._transport.hedger
+
+    @property
+    def endpoints(self):
+        return self._transport.endpoints
+
+    @property
+    def capture(self):
+        return self._transport.capture
+
+    @property
+    def log_payloads(self):
+        return self._transport.log_payloads
+
+    @property
+    def dry_run_report(self):
+        return self._transport.dry_run_report
+
+    @property
+    def _request_id_fn(self):
+        return self._transport.request_id_fn
+
+    def _send(self, **kwargs):
+        return self._transport.send(**kwargs)
+
+    def __repr__(self):
+        return '<DataSetHandle {}>'.format(self._base_url)
+
+
+class DataSetRegistry(object):
+
+    """
+    Hands out ``DataSetHandle`` objects for data sets under ``api_url``.
+
+    ``token`` is used for any handle without a token of its own. The other
+    arguments are as for ``DataSet``; ``pool_size`` is the number of
+    connections kept open to the host. Writes from every handle go through
+    ``scheduler`` (a ``scheduler.WriteScheduler``) and ``limiter`` (a
+    ``limiter.AdaptiveLimiter``), and reads through ``hedger`` (a
+    ``hedging.Hedger``), if they are given. With ``endpoints`` (an
+    ``endpoints.EndpointPool``) reads are spread over its endpoints;
+    ``api_url`` must be under one of them.
+    """
+
+    def __init__(self, api_url, token=None, dry_run=False,
+                 request_id_fn=None, retry_on_error=True, cache=None,
+                 pool_size=10, scheduler=None, limiter=None, hedger=None,
+                 endpoints=None):
+        if not isinstance(api_url, basestring):
+            raise ValueError("api_url must be a string")
+
+        self.api_url = api_url.rstrip('/')
+        self.transport = Transport(
+            token=token, dry_run=dry_run, request_id_fn=request_id_fn,
+            retry_on_error=retry_on_error, cache=cache, pool_size=pool_size,
+            scheduler=scheduler, limiter=limiter, hedger=hedger,
+            endpoints=endpoints)
+        self._handles = {}
+        self._lock = ForkSafeLock()
+
+    def data_set(self, data_group, data_type, token=None):
+        return self._handle((data_group, data_type), token)
+
+    def data_set_by_name(self, name, token=None):
+        return self._handle((name,), token)
+
+    def _handle(self, key, token):
+        # Handles are kept per token, so one caller's token never changes
+        # the handle another caller holds
+        if not isinstance(token, basestring) and token is not None:
+            raise ValueError("token must be a string or None")
+        # Handles are never removed, so only creating one needs the lock
+        handle = self._handles.get(key, {}).get(token)
+        if handle is None:
+            with self._lock:
+                by_token = self._handles.setdefault(key, {})
+                handle = by_token.get(token)
+                if handle is None:
+                    base_url = '/'.join((self.api_url,) + key).rstrip('/')
+                    handle = DataSetHandle(self.transport, base_url, token)
+                    by_token[token] = handle
+        return handle
+
+    def __len__(self):
+        return sum(len(by_token) for by_token in self._handles.values())
+
+    def __contains__(self, key):
+        return key in self._handles
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
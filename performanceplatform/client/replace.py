@@ -0,0 +1,111 @@
+"""
+Replace the contents of a data set while keeping it empty for as short a
+time as possible.
+
+Backdrop has no way to write to a staging data set and swap it in, so the
+work is ordered instead: every chunk is encoded and compressed into a
+temporary file before the data set is emptied, leaving only the upload
+itself (optionally concurrent) inside the window where readers see partial
+data.
+"""
+import logging
+import tempfile
+import threading
+import time
+
+from .base import (
+    EncodedPayload, _chunked, _encode_json, _gzip, _should_compress
+)
+from .workers import imap_bounded
+
+
+log = logging.getLogger(__name__)
+
+
+class StagedChunks(object):
+
+    """Encoded request bodies spooled to a temporary file"""
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+        self._chunks = []
+        self.records = 0
+        self.bytes = 0
+
+    def add(self, body, content_encoding, records):
+        offset = self._file.tell()
+        self._file.write(body)
+        self._chunks.append((offset, len(body), content_encoding, records))
+        self.records += records
+        self.bytes += len(body)
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def payload(self, chunk_num):
+        offset, length, content_encoding, records = self._chunks[chunk_num]
+        with self._lock:
+            self._file.seek(offset)
+            body = self._file.read(length)
+        return EncodedPayload(body, content_encoding, records)
+
+    def close(self):
+        self._file.close()
+
+
+def stage(records, chunk_size, should_gzip=True):
+    staged = StagedChunks()
+    for chunk in _chunked(records, chunk_size):
+        body = _encode_json(chunk).encode('utf-8')
+        if _should_compress(body, should_gzip):
+            staged.add(_gzip(body), 'gzip', len(chunk))
+        else:
+            staged.add(body, None, len(chunk))
+    return staged
+
+
+def replace_records(data_set, records, chunk_size=1000, workers=1):
+    """
+    Replace everything in ``data_set`` with ``records``.
+
+    Returns a report of the number of records, chunks and bytes sent and
+    the time in seconds spent in each phase. ``gap`` is how long readers
+    could have seen an empty or partial data set.
+    """
+    if chunk_size <= 0:
+        raise ValueError('chunk_size must be positive')
+
+    timings = {}
+    started = time.time()
+    staged = stage(records, chunk_size, data_set.should_gzip)
+    timings['stage'] = time.time() - started
+
+    try:
+        started = time.time()
+        data_set.empty_data_set()
+        timings['empty'] = time.time() - started
+
+        def send(chunk_num):
+            log.info('Sending chunk {}'.format(chunk_num + 1))
+            data_set._schedule('', staged.payload(chunk_num))
+
+        started = time.time()
+        for _ in imap_bounded(send, range(len(staged)), workers):
+            pass
+        timings['upload'] = time.time() - started
+    finally:
+        staged.close()
+
+    timings['gap'] = timings['empty'] + timings['upload']
+    report = {
+        'records': staged.records,
+        'chunks': len(staged),
+        'bytes': staged.bytes,
+        'timings': timings,
+    }
+    log.info('Replaced data set with {} records in {} chunks; staged in '
+             '{:.2f}s, empty for {:.2f}s'.format(
+                 report['records'], report['chunks'],
+                 timings['stage'], timings['gap']))
+    return report
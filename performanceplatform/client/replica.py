@@ -0,0 +1,783 @@
+"""
+Answer data set queries from a copy held in memory.
+
+Data that changes a few times a day does not need a round trip to
+backdrop for every dashboard read. A ``Replica`` keeps a snapshot of a
+data set as NumPy columns, sorted by ``_timestamp``, and answers the usual
+query parameters itself::
+
+    data_set.replica = Replica(data_set, max_age=300)
+    data_set.get({'group_by': 'channel', 'collect': 'count:sum',
+                  'period': 'week', 'start_at': ..., 'end_at': ...})
+
+``start_at``, ``end_at``, ``duration``, ``filter_by``,
+``filter_by_prefix``, ``group_by``, ``collect`` (with ``sum``, ``count``,
+``mean``, ``set`` or a plain list), ``period``, ``sort_by`` and ``limit``
+are understood; a query using anything else goes to the server as before.
+Time windows are found by binary search on the sorted timestamps, filters
+through an index of row positions per value (built the first time a field
+is filtered on) and aggregates are computed a column at a time.
+
+The snapshot is refreshed once it is ``max_age`` seconds old, or after a
+write through the data set's client. A refresh only fetches records from
+``overlap`` before the newest timestamp held, replacing what was there; the
+whole data set is fetched again every ``full_refresh`` seconds, to pick up
+changes to older records. While one thread refreshes, others keep reading
+the previous snapshot. If a refresh fails the previous snapshot is used
+(or the server, before there is one) and it is tried again after
+``retry_after`` seconds. Dry run clients always go to the server.
+
+Given a ``path``, replicas in different processes share one copy of the
+data: whichever process refreshes first fetches the records and writes
+them to a ``mapped`` columns file, and the others map that file rather
+than fetching it again. String columns stay as their mapped dictionary
+codes, which indexes and groups are built from, and only the rows a query
+returns are decoded. Needs ``numpy``.
+"""
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .dates import parse_datetime
+from .mapped import (
+    DictionaryColumn, MappedColumns, SnapshotError, file_lock, write_columns
+)
+from .records import _import_numpy
+from .sharding import _as_list, _as_utc, _format, _sort, add_periods
+
+
+log = logging.getLogger(__name__)
+
+SUPPORTED_PARAMETERS = frozenset([
+    'start_at', 'end_at', 'duration', 'filter_by', 'filter_by_prefix',
+    'group_by', 'collect', 'period', 'sort_by', 'limit',
+])
+PERIODS = ('hour', 'day', 'week', 'month', 'quarter', 'year')
+COLLECT_METHODS = ('sum', 'count', 'mean', 'set')
+
+
+class Unsupported(Exception):
+
+    """Raised for a query the replica cannot answer the way backdrop would"""
+
+
+class Snapshot(object):
+
+    """
+    Immutable columns of a data set, sorted by ``_timestamp`` (records
+    without one first), with indexes on the fields filtered by.
+    """
+
+    def __init__(self, columns):
+        numpy = self._numpy = _import_numpy()
+        columns = OrderedDict(columns)
+        self.length = len(next(iter(columns.values()))) if columns else 0
+        timestamps = columns.get('_timestamp')
+        if timestamps is not None and timestamps.dtype.kind == 'M':
+            ticks = timestamps.view('i8')
+            # Sorted columns (as read from a shared file) are not copied
+            if (ticks[1:] < ticks[:-1]).any():
+                order = numpy.argsort(ticks, kind='mergesort')
+                columns = OrderedDict((name, values[order])
+                                      for name, values in columns.items())
+            self._ticks = columns['_timestamp'].view('i8')
+        else:
+            self._ticks = None
+        self.columns = columns
+        self._indexes = {}
+        self._ranks = {}
+        # Re-entrant, as building an index looks up ranks
+        self._lock = threading.RLock()
+
+    @property
+    def high_water(self):
+        """The newest ``_timestamp`` held, as a UTC ``datetime``"""
+        if self._ticks is None or not self.length or \
+                self._ticks[-1] == _NAT:
+            return None
+        return _to_datetime(self.columns['_timestamp'][-1])
+
+    def window(self, start, end):
+        """The ``(lo, hi)`` rows with ``start <= _timestamp < end``"""
+        if start is None and end is None:
+            return 0, self.length
+        if self._ticks is None:
+            raise Unsupported('data set has no _timestamp column')
+        lo = 0 if start is None else self._ticks.searchsorted(
+            _to_ticks(start), 'left')
+        hi = self.length if end is None else self._ticks.searchsorted(
+            _to_ticks(end), 'left')
+        # Records without a timestamp sort first and are never in a window
+        lo = max(lo, self._ticks.searchsorted(_NAT, 'right'))
+        return lo, max(lo, hi)
+
+    def index(self, name):
+        """Sorted row positions for each value of ``name``"""
+        index = self._indexes.get(name)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(name)
+                if index is None:
+                    index = self._indexes[name] = self._build_index(name)
+        return index
+
+    def ranks(self, name):
+        """
+        The sorted distinct values of a ``DictionaryColumn`` and the
+        position of each of its codes in them.
+        """
+        ranks = self._ranks.get(name)
+        if ranks is None:
+            with self._lock:
+                ranks = self._ranks.get(name)
+                if ranks is None:
+                    ranks = self._ranks[name] = _unique(
+                        self.columns[name].dictionary, self._numpy)
+        return ranks
+
+    def _build_index(self, name):
+        numpy = self._numpy
+        values = self.columns.get(name)
+        if values is None:
+            return {}
+        present = numpy.flatnonzero(~_missing_rows(values, None, numpy))
+        keys, inverse = _unique_rows(self, name, present)
+        order = numpy.argsort(inverse, kind='mergesort')
+        splits = numpy.cumsum(numpy.bincount(inverse,
+                                             minlength=len(keys)))[:-1]
+        return dict(zip(_plain_list(keys),
+                        numpy.split(present[order], splits)))
+
+    def replace_from(self, start, columns):
+        """
+        A new snapshot with the records from ``start`` on replaced by
+        ``columns``.
+        """
+        keep = self._ticks.searchsorted(_to_ticks(start), 'left')
+        fetched = len(next(iter(columns.values()))) if columns else 0
+        names = list(self.columns) + [name for name in columns
+                                      if name not in self.columns]
+        return Snapshot(OrderedDict(
+            (name, _concatenate(self._numpy,
+                                _head(self.columns.get(name), keep), keep,
+                                columns.get(name), fetched))
+            for name in names))
+
+
+_NAT = -2 ** 63
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_ticks(moment):
+    moment = _as_utc(moment).replace(tzinfo=None)
+    delta = moment - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+        delta.microseconds
+
+
+def _to_datetime(value):
+    ticks = int(value.astype('datetime64[us]').view('i8'))
+    return (_EPOCH + datetime.timedelta(microseconds=ticks)).replace(
+        tzinfo=_as_utc(_EPOCH).tzinfo)
+
+
+def _head(values, count):
+    return None if values is None else values[:count]
+
+
+def _missing(values, numpy):
+    kind = values.dtype.kind
+    if kind == 'f':
+        return numpy.isnan(values)
+    if kind == 'M':
+        return numpy.isnat(values)
+    if kind == 'O':
+        return numpy.array([value is None or value != value
+                            for value in values], dtype=bool)
+    return numpy.zeros(len(values), dtype=bool)
+
+
+def _missing_rows(column, rows, numpy):
+    """``_missing`` for ``rows`` of ``column`` (all of it for ``None``)"""
+    if isinstance(column, DictionaryColumn):
+        codes = column.codes if rows is None else column.codes[rows]
+        return codes < 0
+    return _missing(column if rows is None else column[rows], numpy)
+
+
+def _unique_rows(snapshot, name, rows):
+    """
+    ``_unique`` for ``rows`` (none of them missing) of column ``name``,
+    from the codes of a ``DictionaryColumn`` rather than its values.
+    """
+    numpy = snapshot._numpy
+    column = snapshot.columns[name]
+    if not isinstance(column, DictionaryColumn):
+        return _unique(column[rows], numpy)
+    keys, ranks = snapshot.ranks(name)
+    used, inverse = numpy.unique(ranks[column.codes[rows]],
+                                 return_inverse=True)
+    return keys[used], inverse
+
+
+def _unique(values, numpy):
+    """Sorted distinct ``values`` and the position of each value in them"""
+    if values.dtype.kind != 'O':
+        return numpy.unique(values, return_inverse=True)
+    positions = {}
+    inverse = numpy.empty(len(values), dtype=numpy.int64)
+    for row, value in enumerate(values):
+        inverse[row] = positions.setdefault(value, len(positions))
+    keys = sorted(positions)
+    ranks = numpy.empty(len(keys), dtype=numpy.int64)
+    for rank, key in enumerate(keys):
+        ranks[positions[key]] = rank
+    result = numpy.empty(len(keys), dtype=object)
+    result[:] = keys
+    return result, ranks[inverse]
+
+
+def _concatenate(numpy, old, old_length, new, new_length):
+    if old is not None and new is not None and old.dtype == new.dtype:
+        return numpy.concatenate([old, new])
+    present = [values for values in (old, new) if values is not None]
+    kinds = set(values.dtype.kind for values in present)
+    # Integers with gaps stay exact as objects, like exact_ints columns
+    if 'f' in kinds and kinds <= set('if'):
+        dtype, blank = float, numpy.nan
+    elif kinds == set('M'):
+        dtype, blank = 'datetime64[us]', numpy.datetime64('NaT')
+    else:
+        dtype, blank = object, None
+
+    def part(values, length):
+        if values is None:
+            return numpy.full(length, blank, dtype=dtype)
+        return values.astype(dtype)
+    return numpy.concatenate([part(old, old_length), part(new, new_length)])
+
+
+def _plain_list(values):
+    """``values`` as plain Python values, timestamps as backdrop writes them"""
+    if values.dtype.kind == 'M':
+        return [_timestamp_text(text) for text in
+                values.astype('datetime64[us]').astype(str).tolist()]
+    return values.tolist()
+
+
+def _timestamp_text(text):
+    if text == 'NaT':
+        return None
+    # Microseconds only when there are any, as datetime.isoformat does
+    if text.endswith('.000000'):
+        text = text[:-7]
+    return text + '+00:00'
+
+
+def _parse_time(value):
+    if isinstance(value, datetime.datetime):
+        return _as_utc(value)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise Unsupported('{!r} is not a timestamp'.format(value))
+    return _as_utc(parsed)
+
+
+def _single(query, name):
+    values = _as_list(query.get(name))
+    if len(values) > 1:
+        raise Unsupported('{} given more than once'.format(name))
+    return values[0] if values else None
+
+
+def parse_query(query_parameters):
+    """
+    The parts of a backdrop query, raising ``Unsupported`` if it uses
+    anything the replica does not understand.
+    """
+    query = dict(query_parameters or {})
+    unknown = set(query) - SUPPORTED_PARAMETERS
+    if unknown:
+        raise Unsupported('unsupported parameters {}'.format(
+            ', '.join(sorted(unknown))))
+
+    period = _single(query, 'period')
+    if period is not None and period not in PERIODS:
+        raise Unsupported('unknown period {}'.format(period))
+    start = _single(query, 'start_at')
+    end = _single(query, 'end_at')
+    start = None if start is None else _parse_time(start)
+    end = None if end is None else _parse_time(end)
+
+    duration = _single(query, 'duration')
+    if duration is not None:
+        if period is None or (start is None) == (end is None):
+            raise Unsupported('duration needs a period and one of '
+                              'start_at or end_at')
+        if start is None:
+            start = add_periods(end, period, -int(duration))
+        else:
+            end = add_periods(start, period, int(duration))
+
+    filters = []
+    for name in ('filter_by', 'filter_by_prefix'):
+        for each in _as_list(query.get(name)):
+            field, separator, value = each.partition(':')
+            if not separator:
+                raise Unsupported('{} needs field:value'.format(name))
+            filters.append((field, value, name == 'filter_by_prefix'))
+
+    collect = []
+    for each in _as_list(query.get('collect')):
+        field, _, method = each.partition(':')
+        if method and method not in COLLECT_METHODS:
+            raise Unsupported('unknown collect method {}'.format(method))
+        collect.append((field, method or None))
+
+    limit = _single(query, 'limit')
+    return {
+        'start': start,
+        'end': end,
+        'period': period,
+        'filters': filters,
+        'group_by': _as_list(query.get('group_by')),
+        'collect': collect,
+        'sort_by': _single(query, 'sort_by'),
+        'limit': None if limit is None else int(limit),
+    }
+
+
+def execute(snapshot, query):
+    """Answer a parsed ``query`` from ``snapshot`` as backdrop would"""
+    numpy = snapshot._numpy
+    rows = _select(snapshot, query, numpy)
+    if query['group_by'] or query['period']:
+        data = _aggregate(snapshot, rows, query, numpy)
+    else:
+        data = _raw(snapshot, rows, query, numpy)
+    if query['sort_by']:
+        data = _sort(data, query['sort_by'])
+    if query['limit'] is not None:
+        data = data[:query['limit']]
+    return {'data': data}
+
+
+def _select(snapshot, query, numpy):
+    """Sorted positions of the rows in the window matching the filters"""
+    lo, hi = snapshot.window(query['start'], query['end'])
+    selected = None
+    for field, value, prefix in query['filters']:
+        index = snapshot.index(field)
+        if prefix:
+            parts = [positions for key, positions in index.items()
+                     if isinstance(key, basestring) and
+                     key.startswith(value)]
+            positions = numpy.sort(numpy.concatenate(parts)) if parts \
+                else numpy.empty(0, dtype=numpy.int64)
+        else:
+            positions = _lookup(index, value, snapshot.columns.get(field))
+        positions = positions[positions.searchsorted(lo):
+                              positions.searchsorted(hi)]
+        selected = positions if selected is None else numpy.intersect1d(
+            selected, positions, assume_unique=True)
+    if selected is None:
+        return numpy.arange(lo, hi)
+    return selected
+
+
+def _lookup(index, value, column):
+    """Row positions for a ``filter_by`` value, typed like the column"""
+    empty = _import_numpy().empty(0, dtype='int64')
+    if column is None:
+        return empty
+    candidates = [value]
+    if value in ('true', 'false'):
+        candidates.append(value == 'true')
+    try:
+        candidates.append(float(value))
+    except ValueError:
+        pass
+    if column.dtype.kind == 'M':
+        moment = parse_datetime(value)
+        candidates = [] if moment is None else [
+            _as_utc(moment).strftime('%Y-%m-%dT%H:%M:%S+00:00')]
+    for candidate in candidates:
+        if candidate in index:
+            return index[candidate]
+    return empty
+
+
+def _raw(snapshot, rows, query, numpy):
+    if query['limit'] is not None and not query['sort_by']:
+        rows = rows[:query['limit']]
+    names = list(snapshot.columns)
+    columns = [_plain_list(snapshot.columns[name][rows]) for name in names]
+    return [dict((name, value) for name, value in zip(names, values)
+                 if value is not None and value == value)
+            for values in zip(*columns)]
+
+
+def _aggregate(snapshot, rows, query, numpy):
+    group_by = query['group_by']
+    period = query['period']
+
+    # Records without every group_by field are left out, as in backdrop
+    for field in group_by:
+        values = snapshot.columns.get(field)
+        if values is None:
+            return []
+        rows = rows[~_missing_rows(values, rows, numpy)]
+
+    group_codes = numpy.zeros(len(rows), dtype=numpy.int64)
+    for field in group_by:
+        keys, inverse = _unique_rows(snapshot, field, rows)
+        group_codes = group_codes * len(keys) + inverse
+    if group_by:
+        groups, group_codes = numpy.unique(group_codes, return_inverse=True)
+        group_count = len(groups)
+    else:
+        group_count = 1
+    first = numpy.zeros(group_count, dtype=numpy.int64)
+    first[group_codes[::-1]] = numpy.arange(len(rows))[::-1]
+    keys = [_plain_list(snapshot.columns[field][rows[first]])
+            for field in group_by]
+
+    if period is None:
+        cells = _collect(snapshot, rows, group_codes, group_count,
+                         query['collect'], numpy)
+        return [dict(zip(group_by, key), **cell)
+                for key, cell in zip(zip(*keys), cells)]
+
+    starts = _period_starts(snapshot.columns['_timestamp'][rows], period,
+                            numpy)
+    periods = _period_range(query['start'], query['end'], period, numpy)
+    if periods is None:
+        periods = numpy.unique(starts)
+    period_codes = periods.searchsorted(starts)
+    cells = _collect(snapshot, rows,
+                     group_codes * len(periods) + period_codes,
+                     group_count * len(periods), query['collect'], numpy)
+    bounds = list(zip(_plain_list(periods),
+                      _plain_list(_next_period(periods, period, numpy))))
+
+    def period_rows(group):
+        for position, (start_at, end_at) in enumerate(bounds):
+            cell = cells[group * len(periods) + position]
+            yield dict(cell, _start_at=start_at, _end_at=end_at)
+
+    if not group_by:
+        return list(period_rows(0))
+    result = []
+    for group, key in enumerate(zip(*keys)):
+        values = list(period_rows(group))
+        result.append(dict(zip(group_by, key), values=values,
+                           _count=sum(value['_count'] for value in values),
+                           _group_count=len(values)))
+    return result
+
+
+def _collect(snapshot, rows, codes, size, collect, numpy):
+    """``_count`` and collected values for each code in ``range(size)``"""
+    counts = numpy.bincount(codes, minlength=size)
+    cells = [{'_count': count} for count in counts.tolist()]
+    grouped = None
+    for field, method in collect:
+        key = field if method is None else '{}:{}'.format(field, method)
+        column = snapshot.columns.get(field)
+        if column is None:
+            for cell in cells:
+                cell[key] = None
+            continue
+        values = column[rows]
+        present = ~_missing(values, numpy)
+        numeric = values.dtype.kind in 'iuf'
+        if method in ('sum', 'count', 'mean') and numeric:
+            totals = _totals(codes[present], values[present], size, numpy)
+            present_counts = numpy.bincount(codes[present], minlength=size)
+            if method == 'count':
+                results = present_counts.tolist()
+            elif method == 'sum':
+                results = [total if count else None for total, count in
+                           zip(totals.tolist(), present_counts)]
+            else:
+                results = [total / float(count) if count else None
+                           for total, count in zip(totals.tolist(),
+                                                   present_counts)]
+        else:
+            if grouped is None:
+                grouped = numpy.split(numpy.argsort(codes, kind='mergesort'),
+                                      numpy.cumsum(counts)[:-1])
+            plain = _plain_list(values)
+            results = [_collect_one([plain[row] for row in group
+                                     if present[row]], method)
+                       for group in grouped]
+        for cell, result in zip(cells, results):
+            cell[key] = result
+    return cells
+
+
+def _totals(codes, values, size, numpy):
+    """Per-code sums of ``values``, exact for integer columns"""
+    if values.dtype.kind in 'iu':
+        totals = numpy.zeros(size, dtype=numpy.int64)
+        numpy.add.at(totals, codes, values)
+        return totals
+    return numpy.bincount(codes, weights=values, minlength=size)
+
+
+def _collect_one(values, method):
+    if method is None:
+        return values
+    if method == 'set':
+        return sorted(set(values))
+    if method == 'count':
+        return len(values)
+    numbers = [value for value in values
+               if isinstance(value, (int, long, float)) and
+               not isinstance(value, bool)]
+    if not numbers:
+        return None
+    if method == 'sum':
+        return sum(numbers)
+    return sum(numbers) / float(len(numbers))
+
+
+def _period_starts(timestamps, period, numpy):
+    if period == 'hour':
+        starts = timestamps.astype('datetime64[h]')
+    elif period == 'day':
+        starts = timestamps.astype('datetime64[D]')
+    elif period == 'week':
+        days = timestamps.astype('datetime64[D]')
+        # 1970-01-01 was a Thursday and backdrop weeks start on Monday
+        starts = days - ((days.view('i8') + 3) % 7).astype('timedelta64[D]')
+    elif period == 'month':
+        starts = timestamps.astype('datetime64[M]')
+    elif period == 'quarter':
+        months = timestamps.astype('datetime64[M]').view('i8')
+        starts = (months - months % 3).astype('datetime64[M]')
+    else:
+        starts = timestamps.astype('datetime64[Y]')
+    return starts.astype('datetime64[us]')
+
+
+def _next_period(starts, period, numpy):
+    if period == 'hour':
+        return starts + numpy.timedelta64(1, 'h')
+    if period == 'day':
+        return starts + numpy.timedelta64(1, 'D')
+    if period == 'week':
+        return starts + numpy.timedelta64(7, 'D')
+    if period == 'year':
+        return (starts.astype('datetime64[Y]') + 1).astype('datetime64[us]')
+    months = 3 if period == 'quarter' else 1
+    return (starts.astype('datetime64[M]') + months).astype(
+        'datetime64[us]')
+
+
+def _period_range(start, end, period, numpy):
+    """Every period from ``start`` to ``end``, as backdrop fills them in"""
+    if start is None or end is None:
+        return None
+    first = _period_starts(numpy.array([_to_ticks(start)]).astype(
+        'datetime64[us]'), period, numpy)
+    end = numpy.datetime64(_to_ticks(end), 'us')
+    periods = [first]
+    while True:
+        following = _next_period(periods[-1], period, numpy)
+        if following[0] >= end:
+            break
+        periods.append(following)
+    return numpy.concatenate(periods)
+
+
+class Replica(object):
+
+    """A data set's records held in memory and kept up to date"""
+
+    def __init__(self, data_set, max_age=300, overlap=datetime.timedelta(
+            days=1), full_refresh=24 * 60 * 60, path=None, retry_after=30,
+            clock=time.time):
+        _import_numpy()
+        self.data_set = data_set
+        self.max_age = max_age
+        self.overlap = overlap
+        self.full_refresh = full_refresh
+        self.path = path
+        self.retry_after = retry_after
+        self._retry_at = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stale = True
+        self._invalidated_at = None
+        self._refreshed_at = None
+        self._full_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.snapshot = None
+
+        self.hits = 0
+        self.fallbacks = 0
+        self.refreshes = 0
+
+    def invalidate(self):
+        """Refresh before the next query, as the data set has changed"""
+        self._invalidated_at = self._clock()
+        self._stale = True
+
+    def query(self, query_parameters=None):
+        """
+        The response to ``query_parameters``, or ``None`` if only the
+        server can answer it.
+        """
+        if self.data_set.dry_run:
+            # Dry run clients read nothing, so there is nothing to copy
+            self.fallbacks += 1
+            return None
+        try:
+            query = parse_query(query_parameters)
+        except Unsupported as e:
+            log.debug('Replica cannot answer query: {}'.format(e))
+            self.fallbacks += 1
+            return None
+        try:
+            snapshot = self._current()
+        except Exception:
+            log.exception('Replica refresh failed')
+            snapshot = self.snapshot
+        if snapshot is None:
+            self.fallbacks += 1
+            return None
+        try:
+            result = execute(snapshot, query)
+        except Unsupported as e:
+            log.debug('Replica cannot answer query: {}'.format(e))
+            self.fallbacks += 1
+            return None
+        self.hits += 1
+        return result
+
+    def _current(self):
+        """
+        The snapshot to answer from, refreshed first if it is due. Failed
+        refreshes are not retried for ``retry_after`` seconds, meanwhile
+        the previous snapshot (or the server, if there is none) is used.
+        """
+        if self._clock() < self._retry_at:
+            return self.snapshot
+        if self.snapshot is None:
+            with self._lock:
+                if self.snapshot is None:
+                    self._refresh()
+        elif self._stale or \
+                self._clock() - self._refreshed_at >= self.max_age:
+            # Whoever gets here first refreshes; the rest read the old copy
+            if self._lock.acquire(False):
+                try:
+                    self._refresh()
+                finally:
+                    self._lock.release()
+        return self.snapshot
+
+    def refresh(self, full=False):
+        with self._lock:
+            self._refresh(full)
+
+    def _refresh(self, full=False):
+        try:
+            self._refresh_from_source(full)
+        except Exception:
+            # Try again after a pause, even if nothing else has changed
+            self._stale = True
+            self._retry_at = self._clock() + self.retry_after
+            raise
+        self._retry_at = 0
+
+    def _refresh_from_source(self, full=False):
+        if self.path is None:
+            self._fetch(full)
+            return
+        with file_lock(self.path + '.lock'):
+            # Another process may have refreshed the file while we waited
+            if not full and self._map():
+                return
+            self._fetch(full)
+            write_columns(self.path, self.snapshot.columns, {
+                'refreshed_at': self._refreshed_at,
+                'full_at': self._full_at,
+            })
+            self._map()
+
+    def _map(self):
+        """
+        Take up the shared file if it is newer than the copy held,
+        returning whether it is recent enough to use without a refresh.
+        """
+        try:
+            mapped = MappedColumns(self.path)
+        except (IOError, OSError, SnapshotError):
+            return False
+        refreshed_at = mapped.metadata.get('refreshed_at')
+        if refreshed_at is None:
+            return False
+        if self._refreshed_at is None or refreshed_at >= self._refreshed_at:
+            self.snapshot = Snapshot(mapped.columns(decode=False))
+            self._refreshed_at = refreshed_at
+            self._full_at = mapped.metadata['full_at']
+        if self._clock() - refreshed_at >= self.max_age or \
+                (self._invalidated_at is not None and
+                 refreshed_at < self._invalidated_at):
+            return False
+        self._stale = False
+        return True
+
+    def _fetch(self, full=False):
+        now = self._clock()
+        # Cleared first, so that a write while fetching is not lost
+        self._stale = False
+        snapshot = self.snapshot
+        high_water = None if snapshot is None else snapshot.high_water
+        if full or high_water is None or \
+                now - self._full_at >= self.full_refresh:
+            self.snapshot = Snapshot(
+                self.data_set.get_arrays(exact_ints=True) or {})
+            self._full_at = now
+            log.info('Replica loaded {} records'.format(
+                self.snapshot.length))
+        else:
+            # Whole seconds, as start_at is sent, so that nothing fetched
+            # is also kept
+            since = (high_water - self.overlap).replace(microsecond=0)
+            until = max(high_water, _as_utc(datetime.datetime.utcfromtimestamp(
+                now))) + self.overlap
+            arrays = self.data_set.get_arrays({
+                'start_at': _format(since), 'end_at': _format(until)},
+                exact_ints=True)
+            self.snapshot = snapshot.replace_from(since, arrays or {})
+        self._refreshed_at = now
+        self.refreshes += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='pp-replica-refresh')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                log.exception('Replica refresh failed')
+            self._stop.wait(self.max_age)
@@ -0,0 +1,99 @@
+"""
+Share one uplink fairly between many data sets writing at once.
+
+Without a scheduler, chunks go out in whatever order threads get to them,
+so one large backfill can hold up small real-time writes for minutes.
+Give every data set the same ``WriteScheduler`` and each chunk waits its
+turn instead::
+
+    scheduler = WriteScheduler(max_concurrent=8)
+    for data_set in data_sets:
+        data_set.scheduler = scheduler
+    backfill.priority = BACKFILL
+
+At most ``max_concurrent`` chunks are sent at a time. A waiting chunk of a
+higher priority always goes before one of a lower priority. Within a
+priority, data sets take turns by weighted fair queuing: each chunk is
+tagged with the virtual time at which its data set would finish sending
+it, were the uplink shared out by ``weight``, and the lowest tag goes
+first. The cost of a chunk is its number of records, so a data set posting
+chunks of 1000 waits its turn behind 1000 single-record posts from others.
+
+The threads calling ``post`` send their own chunks; the scheduler only
+decides when, so no threads of its own are needed.
+"""
+import heapq
+import itertools
+
+from .workers import ForkSafeCondition
+
+
+REALTIME = 0
+NORMAL = 1
+BACKFILL = 2
+
+
+class WriteScheduler(object):
+
+    def __init__(self, max_concurrent=4):
+        if max_concurrent < 1:
+            raise ValueError('max_concurrent must be at least 1')
+        self.max_concurrent = max_concurrent
+        self._condition = ForkSafeCondition(after_fork=self._after_fork)
+        self._queue = []
+        self._sequence = itertools.count()
+        # Per priority: the virtual time, and the last finish tag per flow
+        self._virtual_time = {}
+        self._finish = {}
+        self._active = 0
+
+    def _after_fork(self):
+        # Chunks sending or queued at fork belong to threads the child lacks
+        self._queue = []
+        self._active = 0
+
+    @property
+    def active(self):
+        """Chunks being sent now"""
+        return self._active
+
+    @property
+    def waiting(self):
+        """Chunks waiting for their turn"""
+        return len(self._queue)
+
+    def run(self, flow, func, cost=1, weight=1, priority=NORMAL):
+        """
+        Call ``func`` once it is ``flow``'s turn to send something costing
+        ``cost``, and return what it returns.
+        """
+        if weight <= 0:
+            raise ValueError('weight must be positive')
+        with self._condition:
+            start = max(self._virtual_time.get(priority, 0.0),
+                        self._finish.get((priority, flow), 0.0))
+            finish = start + float(cost) / weight
+            self._finish[(priority, flow)] = finish
+            entry = (priority, finish, next(self._sequence), start)
+            heapq.heappush(self._queue, entry)
+            try:
+                while self._active >= self.max_concurrent or \
+                        self._queue[0] is not entry:
+                    self._condition.wait()
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._active += 1
+            self._virtual_time[priority] = max(
+                self._virtual_time.get(priority, 0.0), start)
+            # Let the next in line go if there is room for it too
+            self._condition.notify_all()
+        try:
+            return func()
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
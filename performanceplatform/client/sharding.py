@@ -0,0 +1,285 @@
+"""
+Split a time-bounded data set query into smaller windows, fetch them in
+parallel and merge the results as if one query had been made.
+
+Windows always start and end on period boundaries for ``period`` queries,
+so each period row comes back whole from exactly one shard. Grouped
+results are re-aggregated: counts and sums add up, means are weighted by
+``_count``, sets are unioned and collected lists and period ``values`` are
+concatenated in time order.
+"""
+import datetime
+import logging
+from collections import OrderedDict
+
+import pytz
+
+from .dates import parse_datetime
+from .workers import imap_bounded
+
+
+log = logging.getLogger(__name__)
+
+FIXED_PERIODS = {
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+    'week': datetime.timedelta(weeks=1),
+}
+CALENDAR_PERIODS = {
+    'month': 1,
+    'quarter': 3,
+    'year': 12,
+}
+
+
+def add_periods(moment, period, count):
+    if period in FIXED_PERIODS:
+        return moment + FIXED_PERIODS[period] * count
+    if period in CALENDAR_PERIODS:
+        years, month = divmod(
+            moment.month - 1 + CALENDAR_PERIODS[period] * count, 12)
+        return moment.replace(year=moment.year + years, month=month + 1)
+    raise ValueError('unknown period {}'.format(period))
+
+
+def shard_windows(start, end, period=None, periods_per_shard=None,
+                  shard_size=None, shards=None):
+    """
+    Split ``[start, end)`` into consecutive windows.
+
+    With a ``period`` each window spans ``periods_per_shard`` whole periods
+    (or enough to make ``shards`` windows). Otherwise windows are
+    ``shard_size`` long (a ``timedelta``) or the range is cut into
+    ``shards`` equal parts.
+    """
+    if end <= start:
+        raise ValueError('end_at must be after start_at')
+
+    if period is not None:
+        if periods_per_shard is None:
+            total = 0
+            while add_periods(start, period, total) < end:
+                total += 1
+            periods_per_shard = max(1, -(-total // (shards or 1)))
+        return _windows(start, end, lambda moment: add_periods(
+            moment, period, periods_per_shard))
+
+    if shard_size is None:
+        shard_size = (end - start) // (shards or 1)
+        if shard_size <= datetime.timedelta(0):
+            shard_size = end - start
+    return _windows(start, end, lambda moment: moment + shard_size)
+
+
+def _windows(start, end, step):
+    windows = []
+    while start < end:
+        stop = min(step(start), end)
+        windows.append((start, stop))
+        start = stop
+    return windows
+
+
+def windows_for_target(data_set, query, start, end, target_records):
+    """
+    Choose windows holding about ``target_records`` records each, from the
+    daily (or hourly) counts returned by one cheap probe query.
+    """
+    probe_period = None
+    for period in ('day', 'hour'):
+        if _is_aligned(start, period) and _is_aligned(end, period):
+            probe_period = period
+            break
+    if probe_period is None:
+        raise ValueError('target_records needs start_at and end_at on hour '
+                         'boundaries')
+
+    probe = dict((key, value) for key, value in query.items()
+                 if key in ('filter_by', 'filter_by_prefix'))
+    probe.update(start_at=_format(start), end_at=_format(end),
+                 period=probe_period)
+    rows = (data_set.get(probe) or {}).get('data', [])
+
+    windows, window_start, in_window = [], start, 0
+    for row in rows:
+        row_end = parse_datetime(row['_end_at'])
+        in_window += row.get('_count') or 0
+        if in_window >= target_records:
+            row_end = _as_utc(row_end)
+            windows.append((window_start, row_end))
+            window_start, in_window = row_end, 0
+    if window_start < end:
+        windows.append((window_start, end))
+    return windows
+
+
+def _is_aligned(moment, period):
+    if period == 'day':
+        return (moment.hour, moment.minute, moment.second,
+                moment.microsecond) == (0, 0, 0, 0)
+    return (moment.minute, moment.second, moment.microsecond) == (0, 0, 0)
+
+
+def _as_utc(moment):
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=pytz.UTC)
+    return moment.astimezone(pytz.UTC)
+
+
+def _format(moment):
+    return _as_utc(moment).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def check_shardable(query):
+    for required in ('start_at', 'end_at'):
+        if required not in query:
+            raise ValueError('sharded queries need {}'.format(required))
+    if 'duration' in query:
+        raise ValueError('sharded queries cannot use duration')
+    if 'limit' in query and (query.get('group_by') or query.get('period')):
+        raise ValueError('limit cannot be applied across shards of an '
+                         'aggregated query')
+
+
+def _combine(key, values, counts):
+    if key == '_count' or key.endswith(':sum') or key.endswith(':count'):
+        present = [value for value in values if value is not None]
+        return sum(present) if present else None
+    if key.endswith(':mean'):
+        weighted = [(value, count) for value, count in zip(values, counts)
+                    if value is not None and count]
+        if not weighted:
+            return None
+        total = sum(count for _, count in weighted)
+        return sum(value * count for value, count in weighted) / float(total)
+    if key.endswith(':set'):
+        combined = []
+        for value in values:
+            combined.extend(item for item in value or []
+                            if item not in combined)
+        return combined
+    if all(isinstance(value, list) for value in values):
+        return [item for value in values for item in value]
+    return values[0]
+
+
+def _merge_groups(rows_by_shard, group_fields):
+    groups = OrderedDict()
+    for rows in rows_by_shard:
+        for row in rows:
+            key = tuple(row.get(field) for field in group_fields)
+            groups.setdefault(key, []).append(row)
+
+    merged = []
+    for rows in groups.values():
+        if len(rows) == 1:
+            merged.append(rows[0])
+            continue
+
+        counts = [row.get('_count') for row in rows]
+        if any(key.endswith(':mean') for key in rows[0]) and \
+                None in counts:
+            raise ValueError('means cannot be combined without _count')
+
+        row = OrderedDict()
+        for key in _keys_in_order(rows):
+            if key in group_fields:
+                row[key] = rows[0][key]
+            elif key == '_group_count':
+                continue
+            else:
+                row[key] = _combine(
+                    key, [r.get(key) for r in rows], counts)
+        if '_group_count' in rows[0]:
+            row['_group_count'] = len(row['values']) if 'values' in row \
+                else sum(r.get('_group_count') or 0 for r in rows)
+        merged.append(dict(row))
+    return merged
+
+
+def _keys_in_order(rows):
+    keys = []
+    for row in rows:
+        keys.extend(key for key in row if key not in keys)
+    return keys
+
+
+def _sort(rows, sort_by):
+    field, _, direction = sort_by.partition(':')
+    return sorted(rows, key=lambda row: row.get(field),
+                  reverse=direction == 'descending')
+
+
+def merge_results(results, query):
+    """Merge the responses for consecutive shards of ``query``."""
+    results = [result or {} for result in results]
+    merged = dict((key, value) for key, value in
+                  (results[0].items() if results else [])
+                  if key != 'data')
+    rows_by_shard = [result.get('data', []) for result in results]
+
+    group_fields = _as_list(query.get('group_by'))
+    if group_fields:
+        data = _merge_groups(rows_by_shard, group_fields)
+    else:
+        data = [row for rows in rows_by_shard for row in rows]
+
+    if query.get('sort_by'):
+        data = _sort(data, query['sort_by'])
+    if query.get('limit') is not None:
+        data = data[:int(query['limit'])]
+
+    merged['data'] = data
+    return merged
+
+
+def get_sharded(data_set, query_parameters, workers=4, shards=None,
+                shard_size=None, periods_per_shard=None, target_records=None):
+    """
+    Run a time-bounded ``DataSet.get`` as several smaller queries on up to
+    ``workers`` threads and merge the results in order.
+
+    Shards are chosen by ``periods_per_shard`` (``period`` queries),
+    ``shard_size`` (a ``timedelta``), ``target_records`` (sized from one
+    probe query) or simply ``shards`` equal windows (``workers`` by
+    default).
+    """
+    query = dict(query_parameters)
+    check_shardable(query)
+    start = _as_utc(_parse(query['start_at']))
+    end = _as_utc(_parse(query['end_at']))
+
+    if target_records is not None and not query.get('period'):
+        windows = windows_for_target(
+            data_set, query, start, end, target_records)
+    else:
+        windows = shard_windows(
+            start, end, period=query.get('period'),
+            periods_per_shard=periods_per_shard, shard_size=shard_size,
+            shards=shards or workers)
+
+    def fetch(window):
+        shard_query = dict(query, start_at=_format(window[0]),
+                           end_at=_format(window[1]))
+        return data_set.get(shard_query)
+
+    log.info('Fetching {} shards on {} workers'.format(len(windows), workers))
+    results = list(imap_bounded(fetch, windows, workers))
+    return merge_results(results, query)
+
+
+def _parse(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError('{!r} is not a timestamp'.format(value))
+    return parsed
@@ -0,0 +1,357 @@
+"""
+A durable on-disk queue for writes the API could not take.
+
+Give a data set a ``Spool`` and writes that fail because backdrop is down
+(connection errors, timeouts and 5xx responses once retries are used up)
+are appended to it instead of raising. With ``defer_writes`` every write
+goes to the spool, so collection never waits on the network. Once anything
+is spooled, later writes queue behind it so that order is kept, and
+emptying or replacing the data set raises ``SpoolNotEmpty`` until the
+spool has drained::
+
+    data_set.spool = Spool('/var/spool/pp/claims')
+    drainer = Drainer(data_set, data_set.spool, bytes_per_second=1e6)
+    drainer.start()
+
+A ``Drainer`` sends spooled writes in order, at a limited rate, and waits
+for the next interval whenever the API is still unavailable.
+
+The spool is a directory of numbered segment files. Each entry is the
+encoded request body behind a header holding its length, a CRC32 and
+whether it is gzipped. A ``cursor`` file records how far the drainer has
+got; it is replaced atomically and segments behind it are deleted. An
+entry torn by a crash is cut off when the spool is opened again.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import requests
+
+from .base import EncodedPayload
+from .isolation import is_rejection
+
+
+log = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>IIB')
+_GZIPPED = 1
+_SEGMENT_SUFFIX = '.seg'
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class SpoolNotEmpty(Exception):
+    pass
+
+
+SpooledWrite = namedtuple('SpooledWrite', 'position body content_encoding')
+
+
+def is_outage(error):
+    """True if ``error`` means the API is unavailable, not that it refused"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and \
+        response is not None and response.status_code >= 500
+
+
+def _crc(body):
+    return zlib.crc32(body) & 0xffffffff
+
+
+def _read_entry(f):
+    """The next ``(body, flags)`` in ``f``, ``None`` at a clean or torn end"""
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    length, crc, flags = _HEADER.unpack(header)
+    body = f.read(length)
+    if len(body) < length or _crc(body) != crc:
+        return None
+    return body, flags
+
+
+class Spool(object):
+
+    """
+    An append-only queue of encoded request bodies in ``directory``.
+
+    Segments roll over at ``segment_bytes`` and ``append`` raises
+    ``SpoolFull`` rather than let the spool grow past ``max_bytes``.
+    ``fsync`` is ``always`` (after every append), ``interval`` (at most
+    every ``fsync_interval`` seconds) or ``never`` (leave it to the OS),
+    and applies to the cursor as well.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024,
+                 max_bytes=1024 * 1024 * 1024, fsync='interval',
+                 fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('fsync must be one of {}'.format(
+                ', '.join(FSYNC_POLICIES)))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._last_sync = 0
+        self._cursor_synced = 0
+        self._cursor_dirty = False
+        self._segments = sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(_SEGMENT_SUFFIX))
+        self._cursor = self._read_cursor()
+        if self._segments:
+            self._recover(self._segments[-1])
+        if not self._segments or self._cursor[0] > self._segments[-1]:
+            self._segments.append(self._cursor[0])
+        self._sizes = dict((number, os.path.getsize(self._path(number)))
+                           for number in self._segments
+                           if os.path.exists(self._path(number)))
+        self._file = open(self._path(self._segments[-1]), 'ab')
+        self._sizes.setdefault(self._segments[-1], 0)
+
+    def _path(self, number):
+        return os.path.join(self.directory,
+                            '{:020d}{}'.format(number, _SEGMENT_SUFFIX))
+
+    def _read_cursor(self):
+        try:
+            with open(os.path.join(self.directory, 'cursor')) as f:
+                number, offset = f.read().split()
+                cursor = int(number), int(offset)
+        except (IOError, OSError, ValueError):
+            cursor = (self._segments[0] if self._segments else 0, 0)
+        if self._segments and cursor[0] not in self._segments:
+            # Start at the oldest segment the cursor has not passed
+            later = [number for number in self._segments
+                     if number > cursor[0]]
+            cursor = (later[0] if later else self._segments[-1] + 1, 0)
+        return cursor
+
+    def _write_cursor(self, force=False):
+        path = os.path.join(self.directory, 'cursor')
+        now = time.time()
+        sync = self.fsync != 'never' and (
+            force or self.fsync == 'always' or
+            now - self._cursor_synced >= self.fsync_interval)
+        with open(path + '.tmp', 'w') as f:
+            f.write('{} {}\n'.format(*self._cursor))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        if sync:
+            self._cursor_synced = now
+        # A cursor lost in a crash only means some writes are sent again
+        self._cursor_dirty = not sync and self.fsync != 'never'
+
+    def _recover(self, number):
+        """Cut off an entry left half-written by a crash"""
+        path = self._path(number)
+        good = 0
+        with open(path, 'rb') as f:
+            while _read_entry(f) is not None:
+                good = f.tell()
+        if good < os.path.getsize(path):
+            log.warning('Truncating torn entry in spool segment {}'.format(
+                path))
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+
+    def _sync(self, force=False):
+        if self.fsync == 'never':
+            return
+        now = time.time()
+        if force or self.fsync == 'always' or \
+                now - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    @property
+    def size(self):
+        """Bytes on disk, including entries read but not yet deleted"""
+        return sum(self._sizes.values())
+
+    @property
+    def empty(self):
+        with self._lock:
+            number, offset = self._cursor
+            return offset >= self._sizes.get(number, 0) and not any(
+                self._sizes[segment] for segment in self._segments
+                if segment > number)
+
+    def append(self, body, content_encoding=None):
+        entry = _HEADER.pack(len(body), _crc(body),
+                             _GZIPPED if content_encoding == 'gzip' else 0)
+        with self._lock:
+            if self.size + len(entry) + len(body) > self.max_bytes:
+                raise SpoolFull('spool {} is full'.format(self.directory))
+            if self._sizes[self._segments[-1]] >= self.segment_bytes:
+                self._roll()
+            self._file.write(entry + body)
+            self._file.flush()
+            self._sizes[self._segments[-1]] += len(entry) + len(body)
+            self._sync()
+
+    def _roll(self):
+        self._sync(force=True)
+        self._file.close()
+        number = self._segments[-1] + 1
+        self._segments.append(number)
+        self._sizes[number] = 0
+        self._file = open(self._path(number), 'ab')
+
+    def read(self, limit=100):
+        """
+        Up to ``limit`` ``SpooledWrite`` entries from the cursor on, in
+        order. They stay in the spool until they are ``ack``ed.
+        """
+        entries = []
+        with self._lock:
+            number, offset = self._cursor
+            for segment in self._segments:
+                if segment < number or len(entries) >= limit:
+                    continue
+                with open(self._path(segment), 'rb') as f:
+                    f.seek(offset if segment == number else 0)
+                    while len(entries) < limit:
+                        entry = _read_entry(f)
+                        if entry is None:
+                            break
+                        body, flags = entry
+                        entries.append(SpooledWrite(
+                            (segment, f.tell()), body,
+                            'gzip' if flags & _GZIPPED else None))
+        return entries
+
+    def ack(self, position):
+        """
+        Mark everything up to ``position`` as sent. Acknowledging a batch
+        at once writes the cursor once.
+        """
+        with self._lock:
+            self._cursor = position
+            self._write_cursor()
+            while len(self._segments) > 1 and \
+                    self._segments[0] < position[0]:
+                finished = self._segments.pop(0)
+                del self._sizes[finished]
+                os.remove(self._path(finished))
+
+    def close(self):
+        with self._lock:
+            self._sync(force=True)
+            if self._cursor_dirty:
+                self._write_cursor(force=True)
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Drainer(object):
+
+    """
+    Sends spooled writes to ``data_set`` in order.
+
+    Every ``interval`` seconds the spool is drained until it is empty or
+    the API fails, sending at most ``bytes_per_second`` if given. Entries
+    the API rejects as invalid are passed to ``on_reject(entry, error)``
+    and dropped, so that one bad write cannot block the rest.
+    """
+
+    def __init__(self, data_set, spool, bytes_per_second=None, batch=100,
+                 interval=1.0, on_reject=None):
+        self.data_set = data_set
+        self.spool = spool
+        self.bytes_per_second = bytes_per_second
+        self.batch = batch
+        self.interval = interval
+        self.on_reject = on_reject
+        self.sent = 0
+        self.rejected = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Drain the spool; returns the number of writes sent."""
+        sent = 0
+        started = time.time()
+        sent_bytes = 0
+        while not self._stop.is_set():
+            entries = self.spool.read(self.batch)
+            if not entries:
+                break
+            landed = sent
+            position = None
+            try:
+                for entry in entries:
+                    if self.bytes_per_second:
+                        wait = started + sent_bytes / float(
+                            self.bytes_per_second) - time.time()
+                        if wait > 0:
+                            time.sleep(wait)
+                    try:
+                        self.data_set._request('POST', '', EncodedPayload(
+                            entry.body, entry.content_encoding))
+                    except requests.RequestException as e:
+                        if not is_rejection(e):
+                            self.failures += 1
+                            log.warning('Spool drain paused: {}'.format(e))
+                            return sent
+                        self.rejected += 1
+                        log.error('Dropping spooled write rejected by the '
+                                  'API: {}'.format(e))
+                        if self.on_reject is not None:
+                            self.on_reject(entry, e)
+                    else:
+                        sent += 1
+                        self.sent += 1
+                    sent_bytes += len(entry.body)
+                    position = entry.position
+            finally:
+                if position is not None:
+                    self.spool.ack(position)
+                # Reads cached while these writes sat in the spool no
+                # longer match what the API holds
+                if sent > landed:
+                    self.data_set._invalidate_cache()
+        return sent
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='pp-spool-drainer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
@@ -0,0 +1,9 @@
+"""Small summary statistics shared by the load tools and the hedger."""
+
+
+def percentile(values, fraction):
+    """The value ``fraction`` of the way through sorted ``values``"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
@@ -0,0 +1,296 @@
+"""
+Change detection for data set writes.
+
+A ``HashIndex`` remembers a short digest of every record that has been
+posted, keyed by a digest of the record's identity. Records whose content
+digest is unchanged are not sent again.
+
+The index is a sorted file of fixed width entries (12 byte key digest,
+8 byte content digest) that is memory mapped and binary searched, so a
+million keys cost about 20MB of disk and almost no heap. Updates are held
+in memory, spilling to sorted run files beside the index once there are
+``max_pending`` of them, until ``save`` merges them into a new file and
+renames it over the old one.
+"""
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import tempfile
+from collections import deque
+
+from .base import JsonEncoder
+
+
+log = logging.getLogger(__name__)
+
+_MAGIC = b'PPHIDX01'
+KEY_BYTES = 12
+DIGEST_BYTES = 8
+ENTRY_BYTES = KEY_BYTES + DIGEST_BYTES
+
+
+def _sha1(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).digest()
+
+
+def record_digest(record):
+    """A digest of the record's content, independent of key order."""
+    return _sha1(json.dumps(record, cls=JsonEncoder, sort_keys=True,
+                            separators=(',', ':')))[:DIGEST_BYTES]
+
+
+def key_digest(identity):
+    return _sha1(json.dumps(identity, cls=JsonEncoder))[:KEY_BYTES]
+
+
+def make_key_fn(key):
+    """
+    Build a function returning a record's identity, or ``None`` if the
+    record does not have one. ``key`` is a field name, a list of field names
+    or a callable taking the record.
+    """
+    if callable(key):
+        return key
+    if isinstance(key, basestring):
+        return lambda record: record.get(key)
+
+    fields = tuple(key)
+
+    def identity(record):
+        values = [record.get(field) for field in fields]
+        return None if all(v is None for v in values) else values
+    return identity
+
+
+class _Table(object):
+
+    """A memory mapped file of sorted index entries"""
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self.count = 0
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(_MAGIC) or (size - len(_MAGIC)) % ENTRY_BYTES:
+            self._file.close()
+            raise ValueError('{} is not a hash index'.format(path))
+        self.count = (size - len(_MAGIC)) // ENTRY_BYTES
+        if self.count:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:len(_MAGIC)] != _MAGIC:
+                self.close()
+                raise ValueError('{} is not a hash index'.format(path))
+
+    def _entry(self, position):
+        offset = len(_MAGIC) + position * ENTRY_BYTES
+        return self._map[offset:offset + ENTRY_BYTES]
+
+    def get(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            if entry[:KEY_BYTES] < key:
+                low = middle + 1
+            elif entry[:KEY_BYTES] > key:
+                high = middle
+            else:
+                return entry[KEY_BYTES:]
+        return None
+
+    def entries(self):
+        for position in range(self.count):
+            entry = self._entry(position)
+            yield entry[:KEY_BYTES], entry[KEY_BYTES:]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self.count = 0
+
+
+def _write_table(directory, entries, suffix):
+    """Write sorted ``entries`` to a new file, returning its path"""
+    fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_MAGIC)
+            for key, digest in entries:
+                f.write(key + digest)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _tagged(entries, tag):
+    for key, digest in entries:
+        yield key, tag, digest
+
+
+class HashIndex(object):
+
+    """
+    Persistent mapping of record key digests to content digests.
+
+    Once ``max_pending`` updates are held they are written out as a sorted
+    run beside the index, which lookups also search, so memory use stays
+    bounded however many keys are synced. ``save`` merges the runs in.
+    """
+
+    def __init__(self, path, max_pending=100000):
+        self.path = path
+        self.max_pending = max_pending
+        self._directory = os.path.dirname(os.path.abspath(path))
+        self._pending = {}
+        self._runs = []
+        self._table = None
+        self._open()
+
+    def _open(self):
+        if os.path.exists(self.path):
+            self._table = _Table(self.path)
+
+    @property
+    def _count(self):
+        return 0 if self._table is None else self._table.count
+
+    def _stored(self, key):
+        # The newest run holding the key has its latest digest
+        for run in reversed(self._runs):
+            digest = run.get(key)
+            if digest is not None:
+                return digest
+        return None if self._table is None else self._table.get(key)
+
+    def get(self, key):
+        if key in self._pending:
+            return self._pending[key]
+        return self._stored(key)
+
+    def set(self, key, digest):
+        self._pending[key] = digest
+        if len(self._pending) >= self.max_pending:
+            self._spill()
+
+    def _spill(self):
+        path = _write_table(self._directory, sorted(self._pending.items()),
+                            '.run')
+        self._runs.append(_Table(path))
+        self._pending = {}
+
+    def __len__(self):
+        if self._runs:
+            return sum(1 for _ in self._merged())
+        new_keys = sum(1 for key in self._pending
+                       if self._stored(key) is None)
+        return self._count + new_keys
+
+    def _merged(self):
+        sources = [run.entries() for run in self._runs]
+        sources.append(iter(sorted(self._pending.items())))
+        if self._table is not None:
+            sources.insert(0, self._table.entries())
+        # Tagged with their age, so the newest digest for a key comes first
+        tagged = [_tagged(source, -age) for age, source in enumerate(sources)]
+        previous = None
+        for key, _, digest in heapq.merge(*tagged):
+            if key != previous:
+                yield key, digest
+                previous = key
+
+    def save(self):
+        """Merge pending updates into the file, replacing it atomically."""
+        if not self._pending and not self._runs and \
+                os.path.exists(self.path):
+            return
+
+        tmp_path = _write_table(self._directory, self._merged(), '.tmp')
+        try:
+            self.close()
+            os.rename(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self._pending = {}
+        self._open()
+
+    def close(self):
+        """Close the index; updates since the last ``save`` are dropped"""
+        if self._table is not None:
+            self._table.close()
+            self._table = None
+        for run in self._runs:
+            run.close()
+            os.unlink(run.path)
+        self._runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+        self.close()
+
+
+def sync_records(data_set, records, index, key='_id', chunk_size=0,
+                 workers=1):
+    """
+    Post the records in ``records`` that ``index`` has not seen with the
+    same content, recording each one once the server has accepted it.
+
+    Records without a key are always sent. Returns a dict of counts.
+    """
+    identity = make_key_fn(key)
+    counts = {'sent': 0, 'unchanged': 0}
+    unacknowledged = deque()
+
+    def changed_records():
+        for record in records:
+            record_id = identity(record)
+            if record_id is None:
+                unacknowledged.append(None)
+                yield record
+                continue
+
+            entry = key_digest(record_id), record_digest(record)
+            if index.get(entry[0]) == entry[1]:
+                counts['unchanged'] += 1
+            else:
+                unacknowledged.append(entry)
+                yield record
+
+    def acknowledge(chunk_num, chunk_length):
+        for _ in range(chunk_length):
+            entry = unacknowledged.popleft()
+            if entry is not None:
+                index.set(*entry)
+        counts['sent'] += chunk_length
+
+    try:
+        if chunk_size > 0:
+            data_set.post(changed_records(), chunk_size=chunk_size,
+                          workers=workers, progress=acknowledge)
+        else:
+            changed = list(changed_records())
+            if changed:
+                data_set.post(changed)
+                acknowledge(1, len(changed))
+    finally:
+        index.save()
+
+    log.info('Sent {sent} records, skipped {unchanged} unchanged'.format(
+        **counts))
+    return counts
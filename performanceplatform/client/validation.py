@@ -0,0 +1,313 @@
+"""
+Check records against a data set's schema before they are sent.
+
+Backdrop rejects a whole chunk if any record in it is invalid, and only
+after it has been uploaded. A ``Validator`` compiles the JSON Schema from a
+data set's admin configuration into plain Python checks once, so records
+can be checked in bulk as they are posted and bad ones set aside::
+
+    schemas = SchemaCache(admin)
+    rejected = []
+    data_set.post(records, chunk_size=1000,
+                  validator=schemas.validator('carers', 'claims'),
+                  reject=lambda record, errors: rejected.append(record))
+
+The common JSON Schema keywords are supported (``type``, ``properties``,
+``required``, ``additionalProperties``, ``enum``, ``pattern``, lengths and
+bounds, ``items``, ``allOf``/``anyOf``/``oneOf``, local ``$ref`` and the
+``date-time`` format); others are ignored, so a record is only rejected
+for a reason the server would also have. Whatever the schema, ``_id``
+and ``_timestamp`` are checked the way backdrop checks them.
+"""
+import datetime
+import re
+import threading
+
+from .dates import parse_datetime
+
+
+class ValidationError(Exception):
+
+    """Raised when records fail validation and there is no reject channel"""
+
+    def __init__(self, rejected):
+        self.rejected = rejected
+        super(ValidationError, self).__init__(
+            '{} invalid records, first: {}'.format(
+                len(rejected), '; '.join(rejected[0][1])))
+
+
+_VALID_ID = re.compile(r'^[a-zA-Z0-9_\.\-=]+$')
+
+_TYPES = {
+    'string': lambda value: isinstance(value, (basestring,
+                                               datetime.datetime)),
+    'integer': lambda value: isinstance(value, (int, long)) and
+    not isinstance(value, bool),
+    'number': lambda value: isinstance(value, (int, long, float)) and
+    not isinstance(value, bool),
+    'boolean': lambda value: isinstance(value, bool),
+    'null': lambda value: value is None,
+    'array': lambda value: isinstance(value, (list, tuple)),
+    'object': lambda value: isinstance(value, dict),
+}
+
+
+def _is_date_time(value):
+    if isinstance(value, datetime.datetime):
+        return True
+    return isinstance(value, basestring) and \
+        parse_datetime(value) is not None
+
+
+def _builtin_errors(record):
+    """The checks backdrop makes of every record"""
+    errors = []
+    if '_timestamp' in record and not _is_date_time(record['_timestamp']):
+        errors.append('_timestamp is not a valid ISO 8601 timestamp')
+    if '_id' in record:
+        value = record['_id']
+        if not isinstance(value, basestring) or not _VALID_ID.match(value):
+            errors.append('_id is not a valid id')
+    return errors
+
+
+def compile_schema(schema):
+    """
+    Turn a JSON Schema into a function of a value returning a list of
+    error messages, empty if the value is valid.
+    """
+    return _compile(schema, schema, '')
+
+
+def _resolve(reference, root):
+    if not reference.startswith('#'):
+        return {}
+    node = root
+    for part in reference[1:].split('/'):
+        if part:
+            node = node.get(part, {})
+    return node
+
+
+def _compile(schema, root, path):
+    if not isinstance(schema, dict):
+        return lambda value: []
+    if '$ref' in schema:
+        return _compile(_resolve(schema['$ref'], root), root, path)
+
+    checks = []
+    name = path or 'record'
+
+    types = schema.get('type')
+    if types is not None:
+        checks.append(_type_check(
+            name, [types] if isinstance(types, basestring) else types))
+    if 'enum' in schema:
+        checks.append(_enum_check(name, schema['enum']))
+    if 'pattern' in schema:
+        checks.append(_pattern_check(name, schema['pattern']))
+    if schema.get('format') == 'date-time':
+        checks.append(_date_time_check(name))
+    if 'minimum' in schema:
+        checks.append(_bound(name, schema['minimum'],
+                             lambda value, bound: value < bound, 'at least'))
+    if 'maximum' in schema:
+        checks.append(_bound(name, schema['maximum'],
+                             lambda value, bound: value > bound, 'at most'))
+    if 'minLength' in schema:
+        checks.append(_length(name, schema['minLength'],
+                              lambda length, bound: length < bound,
+                              'at least'))
+    if 'maxLength' in schema:
+        checks.append(_length(name, schema['maxLength'],
+                              lambda length, bound: length > bound,
+                              'at most'))
+
+    if 'properties' in schema or 'required' in schema or \
+            schema.get('additionalProperties') is False:
+        checks.append(_object_check(schema, root, path))
+
+    if isinstance(schema.get('items'), dict):
+        item_check = _compile(schema['items'], root, name + '[]')
+        checks.append(lambda value: [
+            error for item in value for error in item_check(item)]
+            if isinstance(value, (list, tuple)) else [])
+
+    for keyword in ('allOf', 'anyOf', 'oneOf'):
+        if keyword in schema:
+            checks.append(_combination(keyword, schema[keyword], root, path))
+
+    def check(value):
+        errors = []
+        for each in checks:
+            errors.extend(each(value))
+        return errors
+    return check
+
+
+def _type_check(name, types):
+    tests = [_TYPES[each] for each in types if each in _TYPES]
+    message = '{} must be {}'.format(name, ' or '.join(types))
+    return lambda value: [] if not tests or any(
+        test(value) for test in tests) else [message]
+
+
+def _enum_check(name, allowed):
+    message = '{} must be one of {}'.format(name, allowed)
+    return lambda value: [] if value in allowed else [message]
+
+
+def _pattern_check(name, pattern):
+    message = '{} must match {}'.format(name, pattern)
+    pattern = re.compile(pattern)
+    return lambda value: [message] if isinstance(
+        value, basestring) and not pattern.search(value) else []
+
+
+def _date_time_check(name):
+    message = '{} must be an ISO 8601 date-time'.format(name)
+    return lambda value: [message] if isinstance(
+        value, basestring) and not _is_date_time(value) else []
+
+
+def _bound(name, bound, compare, word):
+    message = '{} must be {} {}'.format(name, word, bound)
+    return lambda value: [message] if isinstance(
+        value, (int, long, float)) and compare(value, bound) else []
+
+
+def _length(name, bound, compare, word):
+    message = '{} must be {} {} characters'.format(name, word, bound)
+    return lambda value: [message] if isinstance(
+        value, basestring) and compare(len(value), bound) else []
+
+
+def _object_check(schema, root, path):
+    prefix = path + '.' if path else ''
+    properties = dict(
+        (key, _compile(subschema, root, prefix + key))
+        for key, subschema in (schema.get('properties') or {}).items())
+    required = list(schema.get('required') or []) if isinstance(
+        schema.get('required'), list) else []
+    # Draft 3 marks required properties on the property itself
+    required.extend(key for key, subschema in
+                    (schema.get('properties') or {}).items()
+                    if isinstance(subschema, dict) and
+                    subschema.get('required') is True)
+    closed = schema.get('additionalProperties') is False
+
+    def check(value):
+        if not isinstance(value, dict):
+            return []
+        errors = ['{}{} is required'.format(prefix, key)
+                  for key in required if key not in value]
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(properties[key](item))
+            elif closed:
+                errors.append('{}{} is not allowed'.format(prefix, key))
+        return errors
+    return check
+
+
+def _combination(keyword, schemas, root, path):
+    checks = [_compile(schema, root, path) for schema in schemas]
+    name = path or 'record'
+
+    def check(value):
+        results = [each(value) for each in checks]
+        if keyword == 'allOf':
+            return [error for errors in results for error in errors]
+        if any(not errors for errors in results):
+            return []
+        return ['{} matches none of the {} schemas'.format(name, keyword)]
+    return check
+
+
+class Validator(object):
+
+    """Checks records against a compiled schema and backdrop's own rules"""
+
+    def __init__(self, schema=None):
+        self.schema = schema
+        self._check = compile_schema(schema) if schema else None
+
+    def errors(self, record):
+        if not isinstance(record, dict):
+            return ['record must be an object']
+        errors = _builtin_errors(record)
+        if self._check is not None:
+            errors.extend(self._check(record))
+        return errors
+
+    def split(self, records):
+        """Sort ``records`` into valid ones and ``(record, errors)``"""
+        valid, rejected = [], []
+        for record in records:
+            errors = self.errors(record)
+            if errors:
+                rejected.append((record, errors))
+            else:
+                valid.append(record)
+        return valid, rejected
+
+    def filter(self, records, reject):
+        """
+        Yield the valid ``records``, calling ``reject(record, errors)`` for
+        the others.
+        """
+        for record in records:
+            errors = self.errors(record)
+            if errors:
+                reject(record, errors)
+            else:
+                yield record
+
+    def check(self, records, reject=None):
+        """
+        The valid ``records``. Without ``reject`` every record is checked
+        first and ``ValidationError`` is raised if any is invalid, so that
+        nothing is sent.
+        """
+        if reject is not None:
+            return self.filter(records, reject)
+        valid, rejected = self.split(records)
+        if rejected:
+            raise ValidationError(rejected)
+        return valid
+
+
+class SchemaCache(object):
+
+    """
+    Validators for data sets, compiled from their configuration in the
+    admin app. Each data set's configuration is fetched once.
+    """
+
+    def __init__(self, admin):
+        self.admin = admin
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def validator(self, data_group, data_type):
+        return self._validator((data_group, data_type), lambda: (
+            self.admin.get_data_set(data_group, data_type)))
+
+    def validator_by_name(self, name):
+        return self._validator((name,), lambda: (
+            self.admin.get_data_set_by_name(name)))
+
+    def _validator(self, key, fetch):
+        with self._lock:
+            if key not in self._validators:
+                config = fetch()
+                if config is None and not self.admin.dry_run:
+                    raise ValueError('No data set {}'.format('/'.join(key)))
+                self._validators[key] = Validator(
+                    (config or {}).get('schema'))
+            return self._validators[key]
+
+    def invalidate(self):
+        with self._lock:
+            self._validators.clear()
@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+def imap_bounded(func, iterable, workers=1):
+    """
+    Like ``itertools.imap`` but runs ``func`` on up to ``workers`` threads.
+
+    Results are yielded in input order. At most ``2 * workers`` items are
+    pulled from ``iterable`` ahead of the consumer, so memory use stays
+    constant however long the input is.
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    pool = ThreadPool(workers)
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+class TaskPool(object):
+
+    """
+    A thread pool whose tasks are de-duplicated by key.
+
+    Submitting a key that has been submitted before returns the original
+    ``AsyncResult``, so shared lookups in a dependency graph run once.
+    """
+
+    def __init__(self, workers):
+        self._pool = ThreadPool(workers)
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, args=(), callback=None):
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = self._pool.apply_async(
+                    func, args, callback=callback)
+            return self._results[key]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+class ForkSafeLock(object):
+
+    """
+    A ``threading.Lock`` that a forked child replaces with a new one.
+
+    A lock held by another thread when the process forks stays held in
+    the child, where that thread no longer exists to release it. The first
+    use in a new process gets a fresh lock instead, just as
+    ``registry.Transport`` gets a fresh session, and calls ``after_fork``
+    so the owner can also forget state belonging to those threads.
+    """
+
+    def __init__(self, after_fork=None):
+        self._after_fork = after_fork
+        self._process = (os.getpid(), self._new())
+
+    def _new(self):
+        return threading.Lock()
+
+    def _current(self):
+        pid, lock = self._process
+        if pid != os.getpid():
+            pid, lock = self._process = (os.getpid(), self._new())
+            if self._after_fork is not None:
+                self._after_fork()
+        return lock
+
+    def acquire(self, blocking=True):
+        return self._current().acquire(blocking)
+
+    def release(self):
+        self._current().release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ForkSafeCondition(ForkSafeLock):
+
+    """A ``threading.Condition`` that a forked child replaces, likewise"""
+
+    def _new(self):
+        return threading.Condition()
+
+    def wait(self, timeout=None):
+        self._current().wait(timeout)
+
+    def notify_all(self):
+        self._current().notify_all()
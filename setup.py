@@ -63,8 +63,19 @@ if __name__ == '__main__':
         keywords='api data performance_platform',
 
         install_requires=_install_requirements(),
+        extras_require={
+            'numpy': ['numpy'],
+            'pandas': ['numpy', 'pandas'],
+        },
         tests_require=_get_requirements('requirements_for_tests.txt'),
         setup_requires=['nose>=1.0'],
 
         test_suite='nose.collector',
+
+        entry_points={
+            'console_scripts': [
+                'pp-bulk-import = performanceplatform.client.importer:main',
+                'pp-replay = performanceplatform.client.capture:main',
+            ],
+        },
     )
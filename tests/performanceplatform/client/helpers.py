@@ -0,0 +1,80 @@
+"""Fakes and builders shared by the client tests."""
+import copy
+import json
+import threading
+import time
+
+import requests
+
+from performanceplatform.client.admin import AdminAPI
+
+
+def make_response(status_code=200, content='{}'):
+    """A real ``requests.Response`` with ``content`` (text or bytes)"""
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.encoding = 'utf-8'
+    return response
+
+
+def json_response(data, status_code=200):
+    return make_response(status_code, json.dumps(data))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.001)
+
+
+class Clock(object):
+
+    """A clock that only moves when ``now`` is changed"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAdmin(AdminAPI):
+
+    """
+    An ``AdminAPI`` whose methods named in ``answers`` return a copy of
+    the answer, or call it with their arguments, instead of making a
+    request. Every such call is kept in ``calls`` and takes ``delay``
+    seconds, and ``max_in_flight`` is the most that were running at once.
+    """
+
+    def __init__(self, answers, dry_run=False, delay=0):
+        super(FakeAdmin, self).__init__('http://admin.api', 'token',
+                                        dry_run=dry_run)
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._delay = delay
+        self._calls_lock = threading.Lock()
+        for name, answer in answers.items():
+            setattr(self, name, self._fake(name, answer))
+
+    def _fake(self, name, answer):
+        def method(*args):
+            with self._calls_lock:
+                self.calls.append((name,) + args)
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                time.sleep(self._delay)
+                if callable(answer):
+                    return answer(*args)
+                return copy.deepcopy(answer)
+            finally:
+                with self._calls_lock:
+                    self.in_flight -= 1
+        return method
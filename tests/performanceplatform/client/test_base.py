@@ -4,17 +4,9 @@ from hamcrest import (
     assert_that, calling, raises, is_not
 )
 from nose.tools import eq_, assert_raises
-from requests import Response
 
 from performanceplatform.client.base import BaseClient, ChunkingError
-
-
-def make_response(status_code=200, content=''):
-    resp = Response()
-    resp.status_code = status_code
-    resp._content = content
-
-    return resp
+from .helpers import make_response
 
 
 class TestBaseClient(object):
@@ -194,3 +186,17 @@ class TestBaseClient(object):
         eq_(b'\x1f'[0], gzipped_bytes[0])
         eq_(b'\x8b'[0], gzipped_bytes[1])
         eq_(b'\x08'[0], gzipped_bytes[2])
+
+    @mock.patch('requests.request')
+    def test_chunks_can_be_posted_in_parallel(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(content='{}')
+        progress = mock.Mock()
+
+        client = BaseClient('http://admin.api', 'token')
+        client._post('/foo', iter(range(5)), chunk_size=2, workers=3,
+                     progress=progress)
+
+        eq_(mock_request.call_count, 3)
+        eq_(progress.call_args_list,
+            [mock.call(1, 2), mock.call(2, 2), mock.call(3, 1)])
@@ -0,0 +1,250 @@
+from datetime import datetime
+
+import mock
+import pytz
+from nose.tools import eq_
+
+from performanceplatform.client.cache import (
+    QueryCache, RefreshAhead, cache_key, is_historical
+)
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.records import RecordBatch
+from .helpers import json_response
+
+
+NOW = 1400000000  # 2014-05-13T16:53:20Z
+
+RESULT = {'data': [{'n': 1}]}
+
+HISTORICAL = {'period': 'week',
+              'start_at': '2014-01-06T00:00:00Z',
+              'end_at': '2014-02-03T00:00:00Z'}
+
+
+class TestCacheKey(object):
+    def test_equivalent_queries_share_a_key(self):
+        eq_(cache_key('url', {
+            'start_at': '2014-01-06T00:00:00Z',
+            'filter_by': ['b:2', 'a:1'],
+            'limit': 5,
+        }), cache_key('url', {
+            'limit': '5',
+            'filter_by': ['a:1', 'b:2'],
+            'start_at': datetime(2014, 1, 6),
+            'sort_by': None,
+        }))
+
+    def test_group_by_order_matters(self):
+        assert cache_key('url', {'group_by': ['a', 'b']}) != \
+            cache_key('url', {'group_by': ['b', 'a']})
+
+    def test_historical_windows(self):
+        now = datetime(2014, 5, 13, tzinfo=pytz.UTC)
+
+        assert is_historical(HISTORICAL, now)
+        assert not is_historical({'end_at': '2014-06-02T00:00:00Z'}, now)
+        assert not is_historical({'period': 'week'}, now)
+
+
+class TestQueryCache(object):
+    def setUp(self):
+        self.now = NOW
+        self.cache = QueryCache(live_ttl=60, max_entries=3,
+                                clock=lambda: self.now)
+
+    def test_live_entries_expire(self):
+        self.cache.set(('url', ()), 'text', ttl=60)
+        self.now += 59
+        eq_(self.cache.get(('url', ())), 'text')
+        self.now += 1
+        eq_(self.cache.get(('url', ())), None)
+
+    def test_ttl_depends_on_the_window(self):
+        eq_(self.cache.ttl_for(HISTORICAL), None)
+        eq_(self.cache.ttl_for({'period': 'week'}), 60)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for n in range(3):
+            self.cache.set(('url', n), n)
+        self.cache.get(('url', 0))
+        self.cache.set(('url', 3), 3)
+
+        assert ('url', 0) in self.cache
+        assert ('url', 1) not in self.cache
+
+    def test_text_fetched_before_an_invalidation_is_dropped(self):
+        key = cache_key('http://backdrop/foo', HISTORICAL)
+        generation = self.cache.generation(key)
+        self.cache.invalidate('http://backdrop/foo')
+
+        eq_(self.cache.set(key, 'old', generation=generation), False)
+        eq_(key in self.cache, False)
+        eq_(self.cache.set(key, 'new',
+                           generation=self.cache.generation(key)), True)
+
+    def test_invalidate_only_affects_one_data_set(self):
+        self.cache.set(('a', 1), 'x')
+        self.cache.set(('a', 2), 'x')
+        self.cache.set(('b', 1), 'x')
+
+        self.cache.invalidate('a')
+
+        eq_(len(self.cache), 1)
+        assert ('b', 1) in self.cache
+
+
+class TestDataSetCaching(object):
+    def setUp(self):
+        self.cache = QueryCache(clock=lambda: NOW)
+
+    @mock.patch('requests.request')
+    def test_historical_queries_are_fetched_once(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = lambda **kwargs: json_response(RESULT)
+        data_set = DataSet('http://backdrop/foo', None, cache=self.cache)
+
+        first = data_set.get(HISTORICAL)
+        first['data'].append('mutated')
+        second = data_set.get(dict(HISTORICAL))
+        batch = data_set.get(HISTORICAL, compact=True)
+
+        eq_(mock_request.call_count, 1)
+        eq_(second, {'data': [{'n': 1}]})
+        assert isinstance(batch, RecordBatch)
+
+    @mock.patch('requests.request')
+    def test_writes_invalidate_the_data_set(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = lambda **kwargs: json_response(RESULT)
+        data_set = DataSet('http://backdrop/foo', None, cache=self.cache)
+        other = DataSet('http://backdrop/bar', None, cache=self.cache)
+
+        data_set.get(HISTORICAL)
+        other.get(HISTORICAL)
+        data_set.post({'n': 2})
+        data_set.get(HISTORICAL)
+        other.get(HISTORICAL)
+
+        eq_(mock_request.call_count, 4)
+
+    @mock.patch('requests.request')
+    def test_reads_overtaken_by_a_write_are_not_cached(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('http://backdrop/foo', None, cache=self.cache)
+
+        def write_meanwhile(**kwargs):
+            # Another thread's write lands while this read is in flight
+            data_set._invalidate_cache()
+            return json_response(RESULT)
+        mock_request.side_effect = write_meanwhile
+
+        eq_(data_set.get(HISTORICAL), {'data': [{'n': 1}]})
+        eq_(len(self.cache), 0)
+
+    @mock.patch('requests.request')
+    def test_dry_run_results_are_not_cached(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('', None, dry_run=True, cache=self.cache)
+
+        eq_(data_set.get(HISTORICAL), None)
+        eq_(len(self.cache), 0)
+
+
+class TestRefreshAhead(object):
+    def setUp(self):
+        self.now = NOW
+        self.cache = QueryCache(live_ttl=60, clock=lambda: self.now)
+        self.fetches = []
+
+    def add(self, key, hits, ttl=60):
+        def refresh():
+            self.fetches.append(key)
+            return 'fresh {}'.format(key)
+        self.cache.set(key, 'stale', ttl=ttl, refresh=refresh)
+        for _ in range(hits):
+            self.cache.get(key)
+
+    def test_hot_entries_are_refreshed_before_expiry(self):
+        self.add(('url', 'hot'), hits=5)
+        self.add(('url', 'cold'), hits=1)
+        self.add(('url', 'historical'), hits=5, ttl=None)
+        prefetcher = RefreshAhead(self.cache, lead_time=10, min_hits=2)
+
+        eq_(prefetcher.run_once(), 0)
+        self.now += 55
+        eq_(prefetcher.run_once(), 1)
+
+        eq_(self.fetches, [('url', 'hot')])
+        self.now += 10
+        eq_(self.cache.get(('url', 'hot')), "fresh ('url', 'hot')")
+        eq_(self.cache.get(('url', 'cold')), None)
+
+    def test_most_popular_entries_go_first(self):
+        for n in range(5):
+            self.add(('url', n), hits=n + 2)
+        self.now += 55
+
+        RefreshAhead(self.cache, max_per_run=2).run_once()
+
+        eq_(self.fetches, [('url', 4), ('url', 3)])
+
+    def test_popularity_decays(self):
+        self.add(('url', 'hot'), hits=4)
+        prefetcher = RefreshAhead(self.cache, min_hits=2)
+
+        for _ in range(3):
+            self.now += 55
+            prefetcher.run_once()
+
+        eq_(len(self.fetches), 2)
+
+    def test_failed_refreshes_are_counted(self):
+        def broken():
+            raise IOError('backdrop is down')
+        self.cache.set(('url', 1), 'stale', ttl=60, refresh=broken)
+        self.cache.get(('url', 1))
+        self.cache.get(('url', 1))
+        self.now += 55
+        prefetcher = RefreshAhead(self.cache)
+
+        prefetcher.run_once()
+
+        eq_(prefetcher.errors, 1)
+        eq_(self.cache.get(('url', 1)), 'stale')
+
+    @mock.patch('requests.request')
+    def test_data_set_entries_can_be_refreshed(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = lambda **kwargs: json_response(RESULT)
+        data_set = DataSet('http://backdrop/foo', None, cache=self.cache)
+
+        for _ in range(3):
+            data_set.get({'period': 'week'})
+        self.now += 55
+        RefreshAhead(self.cache).run_once()
+        self.now += 10
+        data_set.get({'period': 'week'})
+
+        eq_(mock_request.call_count, 2)
+
+    @mock.patch('requests.request')
+    def test_refreshes_ignore_later_changes_to_the_query(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = lambda **kwargs: json_response(RESULT)
+        data_set = DataSet('http://backdrop/foo', None, cache=self.cache)
+        query = {'period': 'week', 'filter_by': ['a:1']}
+
+        for _ in range(3):
+            data_set.get(query)
+        query['period'] = 'day'
+        query['filter_by'].append('b:2')
+        self.now += 55
+        RefreshAhead(self.cache).run_once()
+
+        eq_(mock_request.call_args[1]['params'],
+            {'period': 'week', 'filter_by': ['a:1']})
+
+    def test_background_thread_starts_and_stops(self):
+        prefetcher = RefreshAhead(self.cache, interval=0.01)
+        prefetcher.start()
+        prefetcher.stop()
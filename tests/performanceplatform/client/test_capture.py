@@ -0,0 +1,189 @@
+import gzip
+import json
+import threading
+import time
+from io import BytesIO
+
+import mock
+import requests
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.capture import (
+    Capture, read_capture, replay, format_report, MAGIC
+)
+from performanceplatform.client.data_set import DataSet
+from .helpers import make_response
+
+
+def _capture(data_set):
+    out = BytesIO()
+    data_set.capture = Capture(out)
+    return out
+
+
+class TestCapture(object):
+    def test_dry_run_requests_are_captured(self):
+        data_set = DataSet('http://backdrop/data/group/type', 'token',
+                           dry_run=True)
+        out = _capture(data_set)
+
+        data_set.post([{'a': 1}])
+        data_set.get({'filter_by': 'a:1'})
+        out.seek(0)
+
+        post, get = list(read_capture(out))
+        eq_(post.method, 'POST')
+        eq_(post.path, '/data/group/type')
+        eq_(post.body, b'[{"a": 1}]')
+        eq_(post.headers, {'Accept': 'application/json',
+                           'Content-Type': 'application/json'})
+        eq_(post.status, None)
+        eq_(get.path, '/data/group/type?filter_by=a%3A1')
+        eq_(get.body, None)
+        assert 0 <= post.t <= get.t
+
+    def test_tokens_are_not_captured(self):
+        data_set = DataSet('http://backdrop/data/group/type', 'secret',
+                           dry_run=True)
+        out = _capture(data_set)
+
+        data_set.post({'a': 1})
+
+        assert b'secret' not in out.getvalue()
+
+    @mock.patch('requests.request')
+    def test_live_requests_are_captured_with_compressed_bodies(
+            self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(201)
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+        out = _capture(data_set)
+        records = [{'value': i} for i in range(500)]
+
+        data_set.post(records)
+        out.seek(0)
+
+        captured, = list(read_capture(out))
+        eq_(captured.status, 201)
+        assert captured.elapsed >= 0
+        eq_(captured.headers['Content-Encoding'], 'gzip')
+        unzipped = gzip.GzipFile(fileobj=BytesIO(captured.body)).read()
+        eq_(json.loads(unzipped.decode('utf-8')), records)
+
+    def test_concurrent_writes_are_not_interleaved(self):
+        data_set = DataSet('http://backdrop/data/group/type', 'token',
+                           dry_run=True)
+        out = _capture(data_set)
+
+        data_set.post([{'n': i} for i in range(100)], chunk_size=1,
+                      workers=8)
+        out.seek(0)
+
+        bodies = sorted(request.body for request in read_capture(out))
+        eq_(bodies, sorted('[{{"n": {}}}]'.format(i).encode()
+                           for i in range(100)))
+
+    def test_other_files_are_rejected(self):
+        assert_raises(ValueError, list, read_capture(BytesIO(b'nope\n')))
+
+    def test_truncated_files_are_rejected(self):
+        out = BytesIO(MAGIC + b'{"t": 0, "method": "POST", "path": "/", '
+                              b'"headers": {}, "size": 10, "status": null, '
+                              b'"elapsed": null}\nabc')
+        assert_raises(ValueError, list, read_capture(out))
+
+
+class TestReplay(object):
+    def _captured(self):
+        data_set = DataSet('http://backdrop/data/group/type', None,
+                           dry_run=True)
+        out = _capture(data_set)
+        for i in range(4):
+            data_set.post({'n': i})
+        out.seek(0)
+        return list(read_capture(out))
+
+    @mock.patch('requests.Session.request')
+    def test_requests_are_replayed_against_the_target(self, mock_request):
+        mock_request.return_value = make_response(200)
+
+        report = replay(self._captured(), 'http://localhost:3038/',
+                        speed=None, workers=2, token='local')
+
+        eq_(report['requests'], 4)
+        eq_(report['statuses'], {200: 4})
+        eq_(len(report['latencies']), 4)
+        kwargs = mock_request.call_args[1]
+        eq_(kwargs['url'], 'http://localhost:3038/data/group/type')
+        eq_(kwargs['headers']['Authorization'], 'Bearer local')
+        eq_(sorted(call[1]['data'] for call in mock_request.call_args_list),
+            [b'{"n": 0}', b'{"n": 1}', b'{"n": 2}', b'{"n": 3}'])
+
+    @mock.patch('requests.Session.request')
+    def test_original_timing_is_scaled(self, mock_request):
+        mock_request.return_value = make_response(200)
+        captured = [request._replace(t=i * 0.1)
+                    for i, request in enumerate(self._captured())]
+
+        started = time.time()
+        replay(captured, 'http://localhost', speed=2.0, workers=4)
+
+        assert 0.15 <= time.time() - started < 1.0
+
+    @mock.patch('requests.Session.request')
+    def test_requests_run_concurrently(self, mock_request):
+        active = []
+        peak = [0]
+        lock = threading.Lock()
+
+        def slow(**kwargs):
+            with lock:
+                active.append(1)
+                peak[0] = max(peak[0], len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            return make_response(200)
+        mock_request.side_effect = slow
+
+        replay(self._captured(), 'http://localhost', speed=None, workers=4)
+
+        assert peak[0] > 1
+
+    @mock.patch('requests.Session.request')
+    def test_the_backlog_is_bounded(self, mock_request):
+        captured = self._captured()
+        pulled = []
+        release = threading.Event()
+
+        def stream():
+            for i in range(100):
+                pulled.append(i)
+                yield captured[i % len(captured)]
+
+        def blocked(**kwargs):
+            release.wait()
+            return make_response(200)
+        mock_request.side_effect = blocked
+
+        reports = []
+        thread = threading.Thread(target=lambda: reports.append(
+            replay(stream(), 'http://localhost', speed=None, workers=1)))
+        thread.start()
+        time.sleep(0.1)
+        queued = len(pulled)
+        release.set()
+        thread.join()
+
+        assert queued <= 3
+        eq_(reports[0]['requests'], 100)
+
+    @mock.patch('requests.Session.request')
+    def test_errors_are_counted(self, mock_request):
+        mock_request.side_effect = requests.ConnectionError('refused')
+
+        report = replay(self._captured(), 'http://localhost', speed=None)
+
+        eq_(report['errors'], 4)
+        eq_(report['statuses'], {})
+        assert '4 requests' in format_report(report)
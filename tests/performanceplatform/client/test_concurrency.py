@@ -0,0 +1,261 @@
+import os
+import random
+import signal
+import threading
+
+import mock
+import requests
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.admin import AdminAPI
+from performanceplatform.client.cache import QueryCache
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.endpoints import EndpointPool
+from performanceplatform.client.hedging import Hedger
+from performanceplatform.client.limiter import AdaptiveLimiter
+from performanceplatform.client.registry import DataSetRegistry
+from performanceplatform.client.scheduler import WriteScheduler
+from .helpers import make_response
+
+
+THREADS = 16
+ROUNDS = 50
+LARGE = [{'value': 'x' * 100, 'n': n} for n in range(50)]
+
+
+def _hammer(*targets):
+    """Run each target on ``THREADS`` threads at once, re-raising errors"""
+    errors = []
+    start = threading.Event()
+
+    def wrap(target):
+        def run():
+            start.wait()
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+        return run
+
+    threads = [threading.Thread(target=wrap(target))
+               for target in targets for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class Recorder(object):
+
+    """Stands in for ``requests.request``, keeping the headers sent"""
+
+    def __init__(self, failure_rate=0):
+        self.failure_rate = failure_rate
+        self.headers = []
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        with self._lock:
+            self.headers.append(dict(kwargs['headers']))
+        if self.failure_rate and random.random() < self.failure_rate:
+            return make_response(503)
+        return make_response()
+
+
+class TestSharedClients(object):
+    @mock.patch('requests.request')
+    def test_requests_see_whole_configurations(self, mock_request):
+        mock_request.__name__ = 'request'
+        recorder = mock_request.side_effect = Recorder()
+        data_set = DataSet('http://backdrop/data/group/type', 'plain')
+        data_set.should_gzip = False
+
+        def switch():
+            for n in range(ROUNDS):
+                if n % 2:
+                    data_set.reconfigure(token='plain', should_gzip=False)
+                else:
+                    data_set.reconfigure(token='gzipped', should_gzip=True)
+
+        def post():
+            for _ in range(ROUNDS):
+                data_set.post(LARGE)
+                data_set.get()
+
+        _hammer(switch, post)
+
+        eq_(len(recorder.headers), THREADS * ROUNDS * 2)
+        for headers in recorder.headers:
+            if 'Content-Type' not in headers:
+                continue
+            eq_(headers['Authorization'] == 'Bearer gzipped',
+                headers.get('Content-Encoding') == 'gzip')
+
+    @mock.patch('requests.request')
+    def test_tokens_change_safely(self, mock_request):
+        mock_request.__name__ = 'request'
+        recorder = mock_request.side_effect = Recorder()
+        data_set = DataSet('http://backdrop/data/group/type', 'token-0')
+        tokens = set('Bearer token-{}'.format(n) for n in range(ROUNDS))
+
+        def rotate():
+            for n in range(ROUNDS):
+                data_set.set_token('token-{}'.format(n))
+
+        def post():
+            for _ in range(ROUNDS):
+                data_set.post({'a': 1})
+
+        _hammer(rotate, post)
+
+        eq_(len(recorder.headers), THREADS * ROUNDS)
+        for headers in recorder.headers:
+            assert headers['Authorization'] in tokens
+
+    def test_settings_are_checked(self):
+        data_set = DataSet('http://backdrop/data/group/type', None)
+        assert_raises(ValueError, data_set.reconfigure, token=1)
+        assert_raises(ValueError, data_set.reconfigure, colour='blue')
+        eq_(data_set.config.token, None)
+
+    def test_admin_client_keeps_its_own_settings(self):
+        admin = AdminAPI('http://admin', 'token')
+        eq_(admin.should_gzip, False)
+        eq_(admin.config.token, 'token')
+
+    @mock.patch('time.sleep')
+    @mock.patch('requests.request')
+    def test_writes_through_shared_scheduler_and_limiter(self, mock_request,
+                                                         mock_sleep):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = Recorder(failure_rate=0.2)
+        scheduler = WriteScheduler(max_concurrent=4)
+        limiter = AdaptiveLimiter(initial=2, maximum=8)
+        data_sets = [DataSet('http://backdrop/data/group/{}'.format(n), 't')
+                     for n in range(4)]
+        for data_set in data_sets:
+            data_set.scheduler = scheduler
+            data_set.limiter = limiter
+
+        def post():
+            for n in range(ROUNDS // 5):
+                try:
+                    data_sets[n % 4].post([{'n': n}] * 10, chunk_size=3)
+                except requests.HTTPError:
+                    pass
+
+        _hammer(post)
+
+        eq_(scheduler.active, 0)
+        eq_(scheduler.waiting, 0)
+        eq_(limiter.in_flight, 0)
+
+
+class TestSharedRegistry(object):
+    def test_each_data_set_gets_one_handle(self):
+        registry = DataSetRegistry('http://backdrop/data')
+        handles = []
+
+        def look_up():
+            handles.extend(registry.data_set('group', str(n))
+                           for n in range(ROUNDS))
+
+        _hammer(look_up)
+
+        eq_(len(registry), ROUNDS)
+        eq_(len(set(id(handle) for handle in handles)), ROUNDS)
+
+    @mock.patch('requests.Session.request')
+    def test_handles_share_settings(self, mock_request):
+        mock_request.return_value = make_response()
+        registry = DataSetRegistry('http://backdrop/data', token='shared')
+        handle = registry.data_set('group', 'type')
+        own = registry.data_set('group', 'own', token='own')
+
+        registry.transport.reconfigure(token='rotated', should_gzip=False)
+
+        eq_(handle.config.token, 'rotated')
+        eq_(own.config.token, 'own')
+        eq_(handle.should_gzip, False)
+        assert_raises(AttributeError, setattr, handle, 'should_gzip', True)
+
+    def test_forked_children_get_their_own_connections(self):
+        if not hasattr(os, 'fork'):
+            raise SkipTest('fork is not available')
+        registry = DataSetRegistry('http://backdrop/data')
+        parent_session = registry.transport.session
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                session = registry.transport.session
+                fresh = session is not parent_session and \
+                    registry.transport.session is session
+                registry.close()
+            finally:
+                os._exit(0 if fresh else 1)
+        _, status = os.waitpid(pid, 0)
+
+        eq_(os.WEXITSTATUS(status), 0)
+        assert registry.transport.session is parent_session
+
+    @mock.patch('requests.Session.request')
+    def test_forked_children_do_not_inherit_held_locks(self, mock_request):
+        if not hasattr(os, 'fork'):
+            raise SkipTest('fork is not available')
+        mock_request.return_value = make_response()
+        cache = QueryCache()
+        scheduler = WriteScheduler(1)
+        limiter = AdaptiveLimiter(initial=1)
+        registry = DataSetRegistry(
+            'http://backdrop/data', token='token', cache=cache,
+            scheduler=scheduler, limiter=limiter, hedger=Hedger(),
+            endpoints=EndpointPool(['http://backdrop']))
+        data_set = DataSet('http://backdrop/data/group/type', None)
+        transport = registry.transport
+        locks = [registry._lock, transport._config_lock,
+                 data_set._config_lock, cache._lock, scheduler._condition,
+                 limiter._condition, transport.hedger._lock,
+                 transport.endpoints._lock, transport.dry_run_report._lock]
+        # As if the parent were busy sending when it forked
+        scheduler._active = limiter.in_flight = 1
+        held, done = threading.Event(), threading.Event()
+
+        def hold():
+            for lock in locks:
+                lock.acquire()
+            held.set()
+            done.wait()
+            for lock in locks:
+                lock.release()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                # Dies rather than hangs if a lock is still held
+                signal.alarm(5)
+                handle = registry.data_set('group', 'type')
+                handle.get()
+                handle.post({'a': 1})
+                transport.reconfigure(should_gzip=False)
+                transport.dry_run_report.reset()
+                data_set.reconfigure(should_gzip=False)
+                status = 0
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        done.set()
+        thread.join()
+
+        assert os.WIFEXITED(status)
+        eq_(os.WEXITSTATUS(status), 0)
+        assert transport.should_gzip
+        eq_(limiter.in_flight, 1)
@@ -0,0 +1,76 @@
+import time
+
+import mock
+from nose.tools import eq_
+
+from performanceplatform.client.admin import AdminAPI
+from performanceplatform.client.dashboards import data_set_reference
+from .helpers import FakeAdmin
+
+
+MODULES = {
+    'm1': {'id': 'm1', 'data_set': {'name': 'visits'}},
+    'm2': {'id': 'm2', 'data_set': {'data_group': 'carers',
+                                    'data_type': 'claims'}},
+    'm3': {'id': 'm3', 'data_set': {'name': 'visits'}},
+    'm4': {'id': 'm4', 'modules': [{'data_set': 'visits'}]},
+}
+
+
+def _admin():
+    return FakeAdmin({
+        'get_dashboard': lambda dashboard_id: {'id': dashboard_id,
+                                               'title': 'Carers'},
+        'list_modules_on_dashboard': lambda dashboard_id: [
+            {'id': module_id} for module_id in sorted(MODULES)],
+        'get_module': lambda module_id: MODULES[module_id],
+        'get_data_set_by_name': lambda name: {'name': name},
+        'get_data_set': {'name': 'carers_claims'},
+    }, delay=0.05)
+
+
+class TestLoadDashboardGraph(object):
+    def test_data_set_references(self):
+        eq_(data_set_reference({'data_set': 'a'}), ('name', 'a'))
+        eq_(data_set_reference({'data_group': 'g', 'data_type': 't'}),
+            ('group_and_type', 'g', 't'))
+        eq_(data_set_reference({'data-set': {'data-group': 'g',
+                                             'data-type': 't'}}),
+            ('group_and_type', 'g', 't'))
+        eq_(data_set_reference({'title': 'No data'}), None)
+
+    def test_graph_is_linked_and_lookups_shared(self):
+        admin = _admin()
+
+        graph = admin.load_dashboard_graph('dash')
+
+        eq_(graph['dashboard'], {'id': 'dash', 'title': 'Carers'})
+        eq_([module['id'] for module in graph['modules']],
+            ['m1', 'm2', 'm3', 'm4'])
+        modules = graph['modules']
+        assert modules[0]['data_set_config'] is modules[2]['data_set_config']
+        assert modules[3]['modules'][0]['data_set_config'] is \
+            modules[0]['data_set_config']
+        eq_(modules[1]['data_set_config'], {'name': 'carers_claims'})
+        eq_(modules[3]['data_set_config'], None)
+        eq_(len(graph['data_sets']), 2)
+        eq_(len([call for call in admin.calls
+                 if call[0] == 'get_data_set_by_name']), 1)
+
+    def test_requests_run_concurrently(self):
+        admin = _admin()
+
+        started = time.time()
+        admin.load_dashboard_graph('dash')
+
+        assert admin.max_in_flight >= 4
+        # 8 sequential round trips would take at least 0.4 seconds
+        assert time.time() - started < 0.3
+
+    @mock.patch('requests.request')
+    def test_dry_run_returns_an_empty_graph(self, mock_request):
+        mock_request.__name__ = 'request'
+
+        graph = AdminAPI('', 'token', dry_run=True).load_dashboard_graph('d')
+
+        eq_(graph, {'dashboard': None, 'modules': [], 'data_sets': {}})
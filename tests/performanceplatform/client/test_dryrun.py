@@ -0,0 +1,98 @@
+import datetime
+
+import mock
+from nose.tools import eq_
+
+from performanceplatform.client.base import (
+    BaseClient, EncodedPayload, _encode_json, _gzip
+)
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.dryrun import (
+    DryRunReport, UploadModel, measure
+)
+
+
+RECORDS = [{'_id': str(i), 'count': i, 'name': 'record number {}'.format(i),
+            '_timestamp': datetime.datetime(2014, 1, 1)}
+           for i in range(300)]
+
+
+class TestMeasure(object):
+    def test_sizes_match_what_would_be_sent(self):
+        body = _encode_json(RECORDS).encode('utf-8')
+
+        stats = measure(RECORDS, _encode_json)
+
+        eq_(stats.records, 300)
+        eq_(stats.encoded_bytes, len(body))
+        eq_(stats.sent_bytes, len(_gzip(body)))
+        eq_(stats.largest_record,
+            max(len(_encode_json(record)) for record in RECORDS))
+
+    def test_small_or_uncompressed_bodies_are_sent_as_they_are(self):
+        small = measure({'a': 1}, _encode_json)
+        uncompressed = measure(RECORDS, _encode_json, should_gzip=False)
+
+        eq_((small.records, small.encoded_bytes, small.sent_bytes),
+            (1, 8, 8))
+        eq_(uncompressed.sent_bytes, uncompressed.encoded_bytes)
+
+    def test_upload_model(self):
+        model = UploadModel(bytes_per_second=1000, round_trip=0.5)
+
+        eq_(model.seconds(4, 2000), 4.0)
+        eq_(model.seconds(4, 2000, workers=4), 2.5)
+
+
+class TestDryRunReport(object):
+    @mock.patch('requests.request')
+    @mock.patch('performanceplatform.client.base.log')
+    def test_payloads_are_summarised_not_logged(self, mock_log,
+                                                mock_request):
+        data_set = DataSet('', None, dry_run=True)
+
+        data_set.post(RECORDS, chunk_size=100, workers=2)
+
+        eq_(mock_request.call_count, 0)
+        logged = [call[0][0] for call in mock_log.info.call_args_list]
+        assert not any('record number' in line for line in logged)
+        eq_(len([line for line in logged
+                 if line.startswith('dry run: 100 records')]), 3)
+        report = data_set.dry_run_report
+        eq_((report.requests, report.records), (3, 300))
+        assert 0 < report.sent_bytes < report.encoded_bytes
+        assert '3 requests, 300 records' in report.format()
+
+    @mock.patch('performanceplatform.client.base.log')
+    def test_payloads_are_logged_when_asked_for(self, mock_log):
+        data_set = DataSet('', None, dry_run=True)
+        data_set.log_payloads = True
+
+        data_set.post({'key': 'value'})
+
+        eq_(mock_log.info.call_args_list[-1][0][0], {'key': 'value'})
+
+    @mock.patch('performanceplatform.client.base.log')
+    def test_encoded_bodies_are_not_read(self, mock_log):
+        client = BaseClient('', None, dry_run=True)
+        body = mock.Mock(spec=['read', '__len__'])
+        body.__len__ = mock.Mock(return_value=1234)
+
+        client._post('', EncodedPayload(body, 'gzip'))
+        client._post('', 'x' * 4000)
+        client._get('')
+
+        eq_(body.read.call_count, 0)
+        report = client.dry_run_report
+        eq_(report.requests, 3)
+        eq_(report.records, 0)
+        eq_(report.encoded_bytes, 5234)
+        assert report.sent_bytes < 5234
+
+    def test_estimate_uses_the_model(self):
+        report = DryRunReport(UploadModel(bytes_per_second=100,
+                                          round_trip=1))
+        report.add(measure(RECORDS[:1], _encode_json))
+
+        eq_(report.estimated_seconds(),
+            1 + report.sent_bytes / 100.0)
@@ -0,0 +1,169 @@
+import mock
+import requests
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.endpoints import EndpointPool
+from performanceplatform.client.registry import DataSetRegistry
+from .helpers import Clock, make_response
+
+
+class Replicas(object):
+
+    """Fake hosts: each has a latency and may be down or failing"""
+
+    def __init__(self, clock, **latencies):
+        self.clock = clock
+        self.latencies = latencies
+        self.down = set()
+        self.failing = set()
+        self.sent = []
+
+    def __call__(self, url):
+        host = url.split('/')[2]
+        self.sent.append(url)
+        if host in self.down:
+            raise requests.ConnectionError('{} is down'.format(host))
+        self.clock.now += self.latencies[host]
+        if host in self.failing:
+            return make_response(503)
+        return make_response(content=host)
+
+
+class TestEndpointPool(object):
+    def setup(self):
+        self.clock = Clock()
+        self.pool = EndpointPool(
+            ['http://a', 'http://b', 'http://c'], primary='http://a',
+            clock=self.clock)
+        self.replicas = Replicas(self.clock, a=0.3, b=0.1, c=0.2)
+
+    def read(self, url='http://a/data/group/type'):
+        return self.pool.run(url, self.replicas).text
+
+    def test_every_endpoint_is_tried_then_the_fastest_used(self):
+        eq_(sorted(self.read() for _ in range(3)), ['a', 'b', 'c'])
+        eq_([self.read() for _ in range(3)], ['b', 'b', 'b'])
+
+    def test_url_is_moved_to_the_chosen_endpoint(self):
+        self.pool.run('http://a/data/group/type?x=1', self.replicas)
+        eq_(self.replicas.sent, ['http://a/data/group/type?x=1'])
+        self.pool.endpoints[0].latency = 1
+        self.pool.run('http://a/data/group/type', self.replicas)
+        eq_(self.replicas.sent[-1], 'http://b/data/group/type')
+
+    def test_busy_endpoints_are_passed_over(self):
+        for _ in range(3):
+            self.read()
+        self.pool.endpoints[1].outstanding = 2
+        eq_(self.read(), 'c')
+
+    def test_writes_go_to_the_primary(self):
+        for _ in range(3):
+            self.read()
+        eq_(self.pool.run('http://b/data/group/type', self.replicas,
+                          read=False).text, 'a')
+
+    def test_writes_do_not_fail_over(self):
+        self.replicas.down.add('a')
+        assert_raises(requests.ConnectionError, self.pool.run,
+                      'http://a/data/group/type', self.replicas, read=False)
+
+    def test_reads_fail_over_on_connection_errors(self):
+        self.replicas.down.add('a')
+        eq_(self.read(), 'b')
+        eq_(self.pool.metrics()['http://a']['healthy'], False)
+
+    def test_reads_fail_over_on_server_errors(self):
+        self.replicas.failing.update(['a', 'b'])
+        eq_(self.read(), 'c')
+
+    def test_last_error_is_raised_when_all_are_down(self):
+        self.replicas.down.update(['a', 'b', 'c'])
+        assert_raises(requests.ConnectionError, self.read)
+
+    def test_last_response_is_returned_when_all_fail(self):
+        self.replicas.failing.update(['a', 'b', 'c'])
+        eq_(self.pool.run('http://a/x', self.replicas).status_code, 503)
+
+    def test_failed_endpoints_come_back_after_cooldown(self):
+        for _ in range(3):
+            self.read()
+        self.replicas.down.add('b')
+        eq_(self.read(), 'c')
+        self.replicas.down.clear()
+        eq_(self.read(), 'c')
+
+        self.clock.now += 1
+        eq_(self.read(), 'b')
+
+    def test_cooldown_doubles_with_consecutive_failures(self):
+        self.replicas.down.add('a')
+        endpoint = self.pool.endpoints[0]
+        for expected in (1, 2, 4):
+            self.clock.now = endpoint.down_until
+            started = self.clock.now
+            assert_raises(requests.ConnectionError, self.pool.run,
+                          'http://a/x', self.replicas, read=False)
+            eq_(endpoint.down_until - started, expected)
+
+    def test_all_down_are_tried_soonest_back_first(self):
+        self.pool.endpoints[0].down_until = 30
+        self.pool.endpoints[1].down_until = 10
+        self.pool.endpoints[2].down_until = 20
+        eq_(self.read(), 'b')
+
+    def test_urls_outside_the_pool_are_refused(self):
+        assert_raises(ValueError, self.pool.run, 'http://d/data',
+                      self.replicas)
+        assert_raises(ValueError, self.pool.run, 'http://ab/data',
+                      self.replicas)
+
+    def test_metrics(self):
+        self.read()
+        eq_(self.pool.metrics()['http://a'], {
+            'healthy': True,
+            'outstanding': 0,
+            'latency': 0.3,
+            'requests': 1,
+            'failures': 0,
+        })
+
+    def test_arguments_are_checked(self):
+        assert_raises(ValueError, EndpointPool, [])
+        assert_raises(ValueError, EndpointPool, ['http://a'],
+                      primary='http://b')
+
+
+class TestClientEndpoints(object):
+    @mock.patch('requests.Session.request')
+    def test_reads_and_writes_use_the_pool(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+
+        pool = EndpointPool(['http://primary', 'http://replica'])
+        pool.endpoints[0].latency = 1
+        pool.endpoints[1].latency = 0.1
+        registry = DataSetRegistry('http://primary/data', endpoints=pool)
+        data_set = registry.data_set('group', 'type')
+
+        data_set.get()
+        data_set.post([{'a': 1}])
+
+        eq_([call[1]['url'] for call in mock_request.call_args_list],
+            ['http://replica/data/group/type',
+             'http://primary/data/group/type'])
+
+    @mock.patch('requests.request')
+    def test_reads_fail_over(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = [requests.ConnectionError(),
+                                    make_response(content='{"data": []}')]
+
+        data_set = DataSet('http://primary/data/group/type', None)
+        data_set.endpoints = EndpointPool(['http://primary',
+                                           'http://replica'])
+
+        eq_(data_set.get(), {'data': []})
+        eq_(mock_request.call_args[1]['url'],
+            'http://replica/data/group/type')
@@ -0,0 +1,119 @@
+import json
+
+import mock
+from nose import SkipTest
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.records import RecordBatch
+from .helpers import make_response
+
+try:
+    import numpy
+    from performanceplatform.client.frames import arrays_from_json
+except ImportError:
+    numpy = None
+
+
+RESPONSE = json.dumps({'data': [
+    {'_timestamp': '2014-01-06T00:00:00+00:00', 'count': 3, 'rate': 0.5,
+     'region': 'north'},
+    {'_timestamp': '2014-01-13T00:00:00+00:00', 'count': 5, 'rate': None,
+     'region': 'south'},
+]})
+
+
+class TestFrames(object):
+    def setUp(self):
+        if numpy is None:
+            raise SkipTest('numpy is not installed')
+
+    def test_columns_get_native_dtypes(self):
+        arrays = arrays_from_json(RESPONSE)
+
+        eq_(sorted(arrays), ['_timestamp', 'count', 'rate', 'region'])
+        eq_(arrays['count'].dtype, numpy.int64)
+        eq_(arrays['rate'].dtype, numpy.float64)
+        assert numpy.isnan(arrays['rate'][1])
+        eq_(list(arrays['region']), ['north', 'south'])
+
+    def test_integers_with_gaps_can_be_kept_exact(self):
+        text = json.dumps({'data': [{'n': 1}, {'m': 2}]})
+
+        eq_(arrays_from_json(text)['n'].dtype, numpy.float64)
+        eq_(repr(list(arrays_from_json(text, exact_ints=True)['n'])),
+            '[1, None]')
+
+    def test_integers_too_large_for_int64_are_kept(self):
+        arrays = arrays_from_json(
+            '{"data": [{"a": 99999999999999999999}, {"a": 1}]}')
+
+        eq_(arrays['a'].dtype, numpy.dtype(object))
+        eq_(list(arrays['a']), [99999999999999999999, 1])
+
+    def test_timestamps_are_parsed_in_bulk(self):
+        arrays = arrays_from_json(RESPONSE)
+
+        eq_(arrays['_timestamp'].dtype, numpy.dtype('datetime64[us]'))
+        eq_(str(arrays['_timestamp'][1]), '2014-01-13T00:00:00.000000')
+
+    def test_other_timestamp_formats_are_converted_to_utc(self):
+        arrays = arrays_from_json(json.dumps({'data': [
+            {'_start_at': '2014-01-06T01:00:00+01:00'},
+            {'_start_at': None},
+            {'_start_at': '2014-01-06T00:00:00.5Z'},
+        ]}))
+
+        eq_([str(value) for value in arrays['_start_at']],
+            ['2014-01-06T00:00:00.000000', 'NaT',
+             '2014-01-06T00:00:00.500000'])
+
+    def test_dates_can_be_left_as_strings_or_named(self):
+        arrays = arrays_from_json(json.dumps({'data': [
+            {'_timestamp': '2014-01-06T00:00:00Z',
+             'day': '2014-01-06T00:00:00Z'},
+        ]}), parse_dates=False)
+
+        eq_(arrays['_timestamp'][0], '2014-01-06T00:00:00Z')
+
+        arrays = arrays_from_json(json.dumps({'data': [
+            {'day': '2014-01-06T00:00:00Z'},
+        ]}), dates=['day'])
+
+        eq_(arrays['day'].dtype, numpy.dtype('datetime64[us]'))
+
+    def test_records_with_different_fields_and_nested_values(self):
+        arrays = arrays_from_json(json.dumps({'data': [
+            {'region': 'north', 'values': [{'count': 1}]},
+            {'region': 'south'},
+            {'region': 'east', 'values': []},
+        ]}))
+
+        eq_(list(arrays['region']), ['north', 'south', 'east'])
+        eq_(list(arrays['values']), [[{'count': 1}], None, []])
+
+    def test_record_batch_to_arrays(self):
+        arrays = RecordBatch.from_json(RESPONSE).to_arrays()
+
+        eq_(arrays['count'].dtype, numpy.int64)
+        eq_(arrays['_timestamp'].dtype, numpy.dtype('datetime64[us]'))
+
+    def test_bad_timestamps_are_reported(self):
+        assert_raises(ValueError, arrays_from_json,
+                      json.dumps({'data': [{'_timestamp': 'yesterday'}]}))
+
+    @mock.patch('requests.request')
+    def test_data_set_get_frame(self, mock_request):
+        try:
+            import pandas
+        except ImportError:
+            raise SkipTest('pandas is not installed')
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(content=RESPONSE)
+
+        frame = DataSet('', None).get_frame({'period': 'week'})
+
+        assert isinstance(frame, pandas.DataFrame)
+        eq_(sorted(frame.columns), ['_timestamp', 'count', 'rate', 'region'])
+        eq_(frame['count'].sum(), 8)
+        eq_(str(frame['_timestamp'].dtype), 'datetime64[ns]')
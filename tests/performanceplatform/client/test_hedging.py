@@ -0,0 +1,156 @@
+import threading
+
+import mock
+import requests
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.hedging import Hedger
+from .helpers import make_response
+
+
+def _warm(hedger, latency=0.01):
+    for _ in range(hedger.min_samples):
+        hedger._observe(latency)
+
+
+class Backend(object):
+
+    """Answers each request with the next of ``behaviours`` in turn"""
+
+    def __init__(self, *behaviours):
+        self.behaviours = list(behaviours)
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            behaviour = self.behaviours[self.calls]
+            self.calls += 1
+        return behaviour(self)
+
+
+def answer(text):
+    return lambda backend: make_response(content=text)
+
+
+def stall(text):
+    def behaviour(backend):
+        backend.release.wait(5)
+        return make_response(content=text)
+    return behaviour
+
+
+def fail(backend):
+    raise requests.ConnectionError('refused')
+
+
+def stall_then_fail(backend):
+    backend.release.wait(5)
+    raise requests.ConnectionError('refused')
+
+
+class TestHedger(object):
+    def test_nothing_is_hedged_until_latencies_are_known(self):
+        hedger = Hedger()
+        backend = Backend(answer('one'))
+        eq_(hedger.run(backend).text, 'one')
+        eq_(hedger.delay, None)
+        eq_(hedger.hedges, 0)
+
+    def test_delay_is_the_percentile_of_recent_latencies(self):
+        hedger = Hedger(percentile=0.9, min_samples=10)
+        for latency in range(1, 11):
+            hedger._observe(latency / 100.0)
+        eq_(hedger.delay, 0.1)
+
+    def test_delay_has_a_floor(self):
+        hedger = Hedger(min_delay=0.05)
+        _warm(hedger, latency=0.001)
+        eq_(hedger.delay, 0.05)
+
+    def test_fast_requests_are_not_hedged(self):
+        hedger = Hedger(budget=1)
+        _warm(hedger, latency=1)
+        backend = Backend(answer('first'))
+        eq_(hedger.run(backend).text, 'first')
+        eq_(backend.calls, 1)
+        eq_(hedger.hedges, 0)
+
+    def test_slow_requests_are_hedged_and_the_first_answer_wins(self):
+        hedger = Hedger(budget=1)
+        _warm(hedger)
+        backend = Backend(stall('first'), answer('hedge'))
+        eq_(hedger.run(backend).text, 'hedge')
+        backend.release.set()
+        eq_(hedger.hedges, 1)
+        eq_(hedger.hedge_wins, 1)
+
+    def test_hedges_are_limited_by_the_budget(self):
+        hedger = Hedger(budget=0.5)
+        _warm(hedger)
+        backend = Backend(stall('first'), answer('second'))
+        threading.Timer(0.1, backend.release.set).start()
+        eq_(hedger.run(backend).text, 'first')
+        eq_(backend.calls, 1)
+        eq_(hedger.denied, 1)
+
+    def test_a_failure_waits_for_the_other_copy(self):
+        hedger = Hedger(budget=1)
+        _warm(hedger)
+        backend = Backend(stall_then_fail, stall('hedge'))
+        threading.Timer(0.1, backend.release.set).start()
+        eq_(hedger.run(backend).text, 'hedge')
+        eq_(hedger.hedge_wins, 1)
+
+    def test_errors_are_raised_when_both_copies_fail(self):
+        hedger = Hedger(budget=1)
+        _warm(hedger)
+        backend = Backend(stall_then_fail, stall_then_fail)
+        threading.Timer(0.1, backend.release.set).start()
+        assert_raises(requests.ConnectionError, hedger.run, backend)
+
+    def test_errors_are_raised_without_hedging(self):
+        hedger = Hedger()
+        _warm(hedger, latency=1)
+        assert_raises(requests.ConnectionError, hedger.run, Backend(fail))
+
+    def test_metrics(self):
+        hedger = Hedger(budget=1)
+        _warm(hedger)
+        backend = Backend(stall('first'), answer('hedge'))
+        hedger.run(backend)
+        backend.release.set()
+        eq_(hedger.metrics(), {
+            'requests': 1,
+            'hedges': 1,
+            'hedge_wins': 1,
+            'denied': 0,
+            'delay': 0.01,
+        })
+
+    def test_percentile_is_checked(self):
+        assert_raises(ValueError, Hedger, percentile=95)
+
+
+class TestClientHedging(object):
+    @mock.patch('requests.request')
+    def test_reads_are_hedged(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(content='{"data": []}')
+
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+        data_set.hedger = Hedger()
+        eq_(data_set.get(), {'data': []})
+        eq_(data_set.hedger.requests, 1)
+
+    @mock.patch('requests.request')
+    def test_writes_are_not_hedged(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+        data_set.hedger = Hedger()
+        data_set.post([{'a': 1}])
+        eq_(data_set.hedger.requests, 0)
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import mock
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.importer import (
+    coerce_value, import_file, main, read_records
+)
+from .helpers import make_response
+
+
+class TestImporter(object):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_coerce_value(self):
+        eq_(coerce_value('12'), 12)
+        eq_(coerce_value('1.5'), 1.5)
+        eq_(coerce_value('False'), False)
+        eq_(coerce_value('0123'), '0123')
+        eq_(coerce_value('2012-12-12'), '2012-12-12')
+        eq_(coerce_value('2012-12-12T10:00:00'), datetime(2012, 12, 12, 10))
+        eq_(coerce_value('12', numbers=False), '12')
+
+    def test_invalid_datetimes_are_kept_as_strings(self):
+        eq_(coerce_value('2012-02-30 10:00:00'), '2012-02-30 10:00:00')
+        eq_(coerce_value('2012-12-12T25:00'), '2012-12-12T25:00')
+
+    def test_csv_records_are_coerced(self):
+        path = self.write(
+            'in.csv', '_timestamp,count,name\n2012-12-12 00:00:00,3,foo\n')
+
+        with open(path) as f:
+            records = list(read_records(f, 'csv'))
+
+        eq_(records, [{
+            '_timestamp': datetime(2012, 12, 12),
+            'count': 3,
+            'name': 'foo',
+        }])
+
+    def test_empty_csv_cells_are_left_out(self):
+        path = self.write('in.csv', 'a,b\n1,\n')
+
+        with open(path) as f:
+            eq_(list(read_records(f, 'csv')), [{'a': 1}])
+        with open(path) as f:
+            eq_(list(read_records(f, 'csv', keep_empty=True)),
+                [{'a': 1, 'b': ''}])
+
+    def test_jsonl_keeps_types_but_coerces_datetimes(self):
+        path = self.write(
+            'in.jsonl',
+            '{"a": "1", "_timestamp": "2012-12-12T00:00:00Z"}\n\n{"a": 2}\n')
+
+        with open(path) as f:
+            records = list(read_records(f, 'jsonl'))
+
+        eq_(records[0]['a'], '1')
+        eq_(records[0]['_timestamp'].isoformat(), '2012-12-12T00:00:00+00:00')
+        eq_(records[1], {'a': 2})
+
+    def test_bad_json_line_reports_line_number(self):
+        path = self.write('in.jsonl', '{"a": 1}\n{oops\n')
+
+        with open(path) as f:
+            records = read_records(f, 'jsonl')
+            assert_raises(ValueError, list, records)
+
+    @mock.patch('requests.request')
+    def test_import_file_posts_in_chunks(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        path = self.write(
+            'in.csv', 'n,_timestamp\n1,2012-12-12 00:00:00\n2,\n3,\n')
+
+        progress = import_file(
+            DataSet('http://backdrop/data/foo/bar', 'token'), path,
+            chunk_size=2, workers=2)
+
+        eq_(mock_request.call_count, 2)
+        eq_(progress.records, 3)
+        eq_(progress.chunks, 2)
+        bodies = sorted((json.loads(call[1]['data'])
+                         for call in mock_request.call_args_list), key=len,
+                        reverse=True)
+        eq_(bodies[0], [
+            {'n': 1, '_timestamp': '2012-12-12T00:00:00+00:00'},
+            {'n': 2},
+        ])
+
+    @mock.patch('requests.request')
+    def test_main(self, mock_request):
+        mock_request.__name__ = 'request'
+        path = self.write('in.jsonl', '{"a": 1}\n{"a": 2}\n')
+
+        eq_(main([path, '--url', 'http://backdrop/data/foo/bar',
+                  '--token', 'token', '--quiet']), 0)
+
+        mock_request.assert_called_once_with(
+            method='POST',
+            url='http://backdrop/data/foo/bar',
+            headers=mock.ANY,
+            data='[{"a": 1}, {"a": 2}]',
+            params=None,
+        )
@@ -0,0 +1,129 @@
+import gzip
+import json
+from io import BytesIO
+
+import mock
+import requests
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.base import EncodedPayload
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.isolation import bisect_failures
+from .helpers import make_response
+
+
+class FakeBackdrop(object):
+
+    """Rejects any request containing a record with a negative count"""
+
+    def __init__(self, status_code=400):
+        self.status_code = status_code
+        self.requests = 0
+        self.bytes = 0
+        self.stored = []
+
+    def __call__(self, **kwargs):
+        self.requests += 1
+        body = kwargs['data']
+        self.bytes += sum(len(name) + len(value) + 4
+                          for name, value in kwargs['headers'].items())
+        if hasattr(body, 'getvalue'):
+            body = body.getvalue()
+            self.bytes += len(body)
+            body = gzip.GzipFile(fileobj=BytesIO(body)).read()
+        else:
+            self.bytes += len(body)
+        records = json.loads(body)
+        bad = [record for record in records if record['count'] < 0]
+        if bad:
+            return make_response(self.status_code,
+                                 'count {} is negative'.format(bad[0]['count']))
+        self.stored.extend(records)
+        return make_response()
+
+
+class TestBisectFailures(object):
+    def test_bad_records_are_found_and_the_rest_sent(self):
+        sent = []
+
+        def send(records):
+            if 'bad' in records:
+                error = requests.HTTPError()
+                error.response = make_response(400, 'bad record')
+                raise error
+            sent.extend(records)
+
+        failures = bisect_failures(send, ['a', 'bad', 'b', 'c', 'd'])
+
+        eq_(failures, [('bad', 'bad record')])
+        eq_(sorted(sent), ['a', 'b', 'c', 'd'])
+
+    def test_other_errors_are_raised(self):
+        def send(records):
+            error = requests.HTTPError()
+            error.response = make_response(403)
+            raise error
+
+        assert_raises(requests.HTTPError, bisect_failures, send, [1, 2])
+
+    def test_nothing_to_send(self):
+        eq_(bisect_failures(None, []), [])
+
+
+class TestPostIsolatingFailures(object):
+    @mock.patch('requests.request')
+    def test_rejected_chunks_are_split(self, mock_request):
+        mock_request.__name__ = 'request'
+        backdrop = FakeBackdrop()
+        mock_request.side_effect = backdrop
+        records = [{'count': i} for i in range(1000)]
+        records[123]['count'] = -1
+        records[789]['count'] = -2
+
+        failures = DataSet('http://backdrop', None).post(
+            records, chunk_size=250, workers=2, isolate=True)
+
+        eq_(failures, [({'count': -1}, 'count -1 is negative'),
+                       ({'count': -2}, 'count -2 is negative')])
+        eq_(len(backdrop.stored), 998)
+        # Compare with sending the two bad chunks again one record at a time
+        naive = FakeBackdrop()
+        mock_request.side_effect = naive
+        data_set = DataSet('http://backdrop', None)
+        for start in range(0, 1000, 250):
+            data_set.post(records[start:start + 250], isolate=True)
+        for record in records[:250] + records[750:]:
+            data_set.post([record], isolate=True)
+        assert backdrop.requests * 10 < naive.requests
+        assert backdrop.bytes * 3 < naive.bytes
+
+    @mock.patch('requests.request')
+    def test_unprocessable_entities_are_isolated_without_chunking(
+            self, mock_request):
+        mock_request.__name__ = 'request'
+        backdrop = FakeBackdrop(status_code=422)
+        mock_request.side_effect = backdrop
+
+        failures = DataSet('http://backdrop', None).post(
+            [{'count': 1}, {'count': -1}], isolate=True)
+
+        eq_(failures, [({'count': -1}, 'count -1 is negative')])
+        eq_(backdrop.stored, [{'count': 1}])
+
+    @mock.patch('requests.request')
+    def test_raw_bodies_cannot_be_isolated(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('http://backdrop', None)
+
+        for body in (b'[{"count": -1}]', bytearray(b'[]'),
+                     EncodedPayload(BytesIO(b'[]'))):
+            assert_raises(ValueError, data_set.post, body, isolate=True)
+        eq_(mock_request.call_count, 0)
+
+    @mock.patch('requests.request')
+    def test_without_isolation_rejections_are_raised(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = FakeBackdrop()
+
+        assert_raises(requests.HTTPError, DataSet('http://b', None).post,
+                      [{'count': -1}], chunk_size=1)
@@ -0,0 +1,174 @@
+import threading
+import time
+
+import mock
+import requests
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.limiter import AdaptiveLimiter
+from .helpers import Clock, make_response, wait_for
+
+
+def _responder(clock, latency, status_code=200):
+    def respond():
+        clock.now += latency
+        return make_response(status_code)
+    return respond
+
+
+def _burst(limiter, status_code=200):
+    """Fill the limiter with requests, then let them all finish at once"""
+    limiter._clock = lambda: 0
+    release = threading.Event()
+
+    def send():
+        release.wait()
+        return make_response(status_code)
+
+    count = int(limiter.limit)
+    threads = [threading.Thread(target=limiter.run, args=(send,))
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: limiter.in_flight == count)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+
+class TestAdaptiveLimiter(object):
+    def test_limit_grows_while_requests_succeed(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=10)
+        for _ in range(10):
+            _burst(limiter)
+        assert limiter.limit >= 5, limiter.limit
+        eq_(limiter.decreases, 0)
+
+    def test_limit_does_not_grow_past_maximum(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=3)
+        for _ in range(6):
+            _burst(limiter)
+        eq_(limiter.limit, 3)
+
+    def test_limit_does_not_grow_while_unused(self):
+        limiter = AdaptiveLimiter(initial=8)
+        clock = Clock()
+        limiter._clock = clock
+        for _ in range(20):
+            limiter.run(_responder(clock, 0.1))
+        eq_(limiter.limit, 8)
+
+    def test_server_errors_cut_the_limit(self):
+        limiter = AdaptiveLimiter(initial=8)
+        eq_(limiter.run(lambda: make_response(503)).status_code, 503)
+        eq_(limiter.limit, 4)
+        limiter.run(lambda: make_response(429))
+        eq_(limiter.limit, 2)
+        eq_(limiter.failures, 2)
+
+    def test_client_errors_do_not_cut_the_limit(self):
+        limiter = AdaptiveLimiter(initial=8)
+        limiter.run(lambda: make_response(400))
+        eq_(limiter.limit, 8)
+
+    def test_timeouts_cut_the_limit(self):
+        def time_out():
+            raise requests.Timeout()
+
+        limiter = AdaptiveLimiter(initial=8)
+        assert_raises(requests.Timeout, limiter.run, time_out)
+        eq_(limiter.limit, 4)
+        eq_(limiter.in_flight, 0)
+
+    def test_a_burst_of_failures_cuts_once(self):
+        limiter = AdaptiveLimiter(initial=8)
+        _burst(limiter, status_code=503)
+        eq_(limiter.limit, 4)
+        eq_(limiter.decreases, 1)
+        eq_(limiter.failures, 8)
+
+    def test_limit_does_not_fall_below_minimum(self):
+        limiter = AdaptiveLimiter(initial=4, minimum=2)
+        for _ in range(5):
+            limiter.run(lambda: make_response(503))
+        eq_(limiter.limit, 2)
+
+    def test_latency_inflation_cuts_the_limit(self):
+        clock = Clock()
+        limiter = AdaptiveLimiter(initial=8, clock=clock)
+        for _ in range(10):
+            limiter.run(_responder(clock, 0.1))
+        eq_(limiter.decreases, 0)
+        for _ in range(10):
+            limiter.run(_responder(clock, 0.5))
+        assert limiter.decreases >= 1
+        assert limiter.limit <= 4
+
+    def test_in_flight_requests_are_capped(self):
+        limiter = AdaptiveLimiter(initial=3, maximum=3)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def send():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return make_response(200)
+
+        threads = [threading.Thread(target=limiter.run, args=(send,))
+                   for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(running[1], 3)
+
+    def test_metrics(self):
+        clock = Clock()
+        limiter = AdaptiveLimiter(initial=4, clock=clock)
+        limiter.run(_responder(clock, 0.25))
+        limiter.run(_responder(clock, 0, 502))
+        eq_(limiter.metrics(), {
+            'limit': 2,
+            'in_flight': 0,
+            'requests': 2,
+            'failures': 1,
+            'decreases': 1,
+            'latency': 0.25,
+            'baseline_latency': 0.25,
+        })
+
+    def test_arguments_are_checked(self):
+        assert_raises(ValueError, AdaptiveLimiter, initial=0)
+        assert_raises(ValueError, AdaptiveLimiter, initial=8, maximum=4)
+        assert_raises(ValueError, AdaptiveLimiter, decrease=1)
+
+
+class TestDataSetLimiting(object):
+    @mock.patch('time.sleep')
+    @mock.patch('requests.request')
+    def test_each_write_attempt_is_limited(self, mock_request, mock_sleep):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = [make_response(503), make_response(200)]
+
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+        data_set.limiter = AdaptiveLimiter(initial=8)
+        data_set.post([{'a': 1}])
+
+        eq_(data_set.limiter.requests, 2)
+        eq_(data_set.limiter.limit, 4)
+
+    @mock.patch('requests.request')
+    def test_reads_are_not_limited(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(200)
+
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+        data_set.limiter = AdaptiveLimiter()
+        data_set.get()
+
+        eq_(data_set.limiter.requests, 0)
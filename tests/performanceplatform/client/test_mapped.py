@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import mock
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.frames import arrays_from_json
+from performanceplatform.client.mapped import (
+    DictionaryColumn, MappedColumns, SnapshotError, write_columns
+)
+from performanceplatform.client.replica import (
+    Replica, Snapshot, execute, parse_query
+)
+from .helpers import Clock, json_response
+
+
+RECORDS = [
+    {'_timestamp': '2014-01-01T00:00:00+00:00', 'channel': u'caf\xe9',
+     'count': 1, 'rate': 0.5, 'tags': ['a']},
+    {'_timestamp': '2014-01-02T00:00:00+00:00', 'channel': 'web',
+     'count': 2, 'ok': True, 'tags': ['a']},
+    {'_timestamp': '2014-01-03T00:00:00+00:00', 'channel': '1',
+     'count': 3, 'ok': False, 'tags': 1},
+]
+
+
+def _arrays(records=RECORDS):
+    return arrays_from_json(json.dumps({'data': records}))
+
+
+NOW = 1389225600.0  # 2014-01-09
+
+
+class TestMappedColumns(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.ppcols')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_columns_round_trip(self):
+        columns = _arrays()
+        write_columns(self.path, columns, {'source': 'test'})
+        mapped = MappedColumns(self.path)
+
+        eq_(mapped.names, list(columns))
+        eq_(len(mapped), 3)
+        eq_(mapped.metadata, {'source': 'test'})
+        for name, values in columns.items():
+            eq_(mapped[name].dtype, values.dtype)
+            eq_(repr(mapped[name].tolist()), repr(values.tolist()))
+
+    def test_plain_columns_are_mapped_read_only(self):
+        write_columns(self.path, _arrays())
+        count = MappedColumns(self.path)['count']
+        assert not count.flags.owndata
+        assert not count.flags.writeable
+
+    def test_strings_are_stored_once(self):
+        columns = OrderedDict([('channel', _arrays(RECORDS * 100)['channel'])])
+        write_columns(self.path, columns)
+        mapped = MappedColumns(self.path)
+
+        eq_(mapped.dictionary('channel'), [u'caf\xe9', 'web', '1'])
+        eq_(mapped.codes('channel').tolist()[:4], [0, 1, 2, 0])
+        assert os.path.getsize(self.path) < 2048
+
+    def test_dictionary_columns_can_stay_encoded(self):
+        write_columns(self.path, _arrays())
+        channel = MappedColumns(self.path).columns(decode=False)['channel']
+
+        assert isinstance(channel, DictionaryColumn)
+        assert not channel.codes.flags.owndata
+        eq_(len(channel), 3)
+        eq_(channel[[2, 0]].tolist(), ['1', u'caf\xe9'])
+
+    def test_missing_values_survive(self):
+        write_columns(self.path, _arrays())
+        eq_(MappedColumns(self.path)['ok'].tolist(), [None, True, False])
+
+    def test_empty_snapshot(self):
+        write_columns(self.path, OrderedDict())
+        eq_(MappedColumns(self.path).columns(), OrderedDict())
+
+    def test_replacing_leaves_existing_maps_intact(self):
+        write_columns(self.path, _arrays())
+        old = MappedColumns(self.path)
+        write_columns(self.path, _arrays(RECORDS[:1]))
+
+        assert old.replaced()
+        eq_(old['count'].tolist(), [1, 2, 3])
+        eq_(MappedColumns(self.path)['count'].tolist(), [1])
+        eq_(os.listdir(self.directory), ['data.ppcols'])
+
+    def test_other_files_are_refused(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'{"data": []}')
+        assert_raises(SnapshotError, MappedColumns, self.path)
+
+    def test_columns_must_be_the_same_length(self):
+        columns = _arrays()
+        columns['count'] = columns['count'][:1]
+        assert_raises(ValueError, write_columns, self.path, columns)
+
+
+class TestSharedReplicas(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.ppcols')
+        self.clock = Clock(NOW)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _replica(self):
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+        data_set.replica = Replica(data_set, max_age=60, path=self.path,
+                                   clock=self.clock)
+        return data_set
+
+    @mock.patch('requests.request')
+    def test_one_process_fetches_and_the_rest_map(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+        first, second = self._replica(), self._replica()
+
+        eq_(first.get({'filter_by': 'channel:web'})['data'], [RECORDS[1]])
+        eq_(second.get({'filter_by': 'channel:web'})['data'], [RECORDS[1]])
+
+        eq_(mock_request.call_count, 1)
+        assert not second.replica.snapshot.columns['count'].flags.owndata
+
+    @mock.patch('requests.request')
+    def test_string_columns_stay_mapped(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+        first, second = self._replica(), self._replica()
+        queries = [{}, {'filter_by': 'channel:web'},
+                   {'filter_by_prefix': 'channel:c'},
+                   {'group_by': 'channel', 'collect': 'count:sum'},
+                   {'group_by': 'ok', 'period': 'day'}]
+
+        in_memory = Snapshot(_arrays())
+
+        eq_([first.get(query) for query in queries],
+            [execute(in_memory, parse_query(query)) for query in queries])
+        eq_(second.get({'limit': 1}), {'data': RECORDS[:1]})
+        channel = first.replica.snapshot.columns['channel']
+        assert isinstance(channel, DictionaryColumn)
+        assert not channel.codes.flags.owndata
+
+    @mock.patch('requests.request')
+    def test_stale_files_are_refreshed(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+        first, second = self._replica(), self._replica()
+        first.get()
+
+        self.clock.now += 60
+        mock_request.return_value = json_response({'data': RECORDS[1:]})
+        second.get()
+        first.get()
+
+        eq_(mock_request.call_count, 2)
+        eq_(mock_request.call_args[1]['params']['start_at'],
+            '2014-01-02T00:00:00Z')
+        eq_(first.replica.snapshot.length, 3)
+
+    @mock.patch('requests.request')
+    def test_a_writer_does_not_read_an_older_file(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+        first, second = self._replica(), self._replica()
+        first.get()
+        second.get()
+
+        self.clock.now += 1
+        second.post({'count': 4})
+        second.get()
+
+        eq_(mock_request.call_count, 3)
@@ -0,0 +1,200 @@
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+import mock
+from nose.tools import eq_
+
+from performanceplatform.client.base import EncodedPayload, BufferReader
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.payloads import (
+    JsonArrayReader, line_ranges, post_json_lines
+)
+from .helpers import make_response
+
+
+def _sent_bodies(mock_request):
+    bodies = []
+    for call in mock_request.call_args_list:
+        data = call[1]['data']
+        bodies.append(data.read() if hasattr(data, 'read') else data)
+    return bodies
+
+
+class TestJsonArrayReader(object):
+    def test_lines_are_read_as_an_array(self):
+        buf = b'xx{"a": 1}\n{"a": 2}\r\n{"a": 3}yy'
+        reader = JsonArrayReader(buf, 2, len(buf) - 2)
+
+        eq_(len(reader), len(buf) - 2)
+        eq_(json.loads(reader.read().decode('utf-8')),
+            [{'a': 1}, {'a': 2}, {'a': 3}])
+        eq_(reader.records, 3)
+
+    def test_reading_in_blocks(self):
+        buf = b'{"a": 1}\n{"a": 2}'
+        reader = JsonArrayReader(buf, 0, len(buf))
+
+        blocks = []
+        while True:
+            block = reader.read(3)
+            if not block:
+                break
+            blocks.append(block)
+
+        eq_(b''.join(blocks), b'[{"a": 1},{"a": 2}]')
+        reader.seek(0)
+        eq_(reader.read(1), b'[')
+
+
+class TestLineRanges(object):
+    def test_chunks_end_at_line_boundaries(self):
+        buf = b'\n'.join([b'{"n": 1}', b'{"n": 22}', b'{"n": 333}']) + b'\n'
+
+        ranges = list(line_ranges(buf, 20))
+
+        eq_([buf[start:end] for start, end in ranges],
+            [b'{"n": 1}\n{"n": 22}', b'{"n": 333}'])
+
+    def test_long_lines_get_a_chunk_of_their_own(self):
+        buf = b'{"long": "xxxxxxxxxxxxxxxx"}\n{"n": 1}\n'
+
+        ranges = list(line_ranges(buf, 5))
+
+        eq_([buf[start:end] for start, end in ranges],
+            [b'{"long": "xxxxxxxxxxxxxxxx"}', b'{"n": 1}'])
+
+    def test_surrounding_whitespace_is_skipped(self):
+        eq_(list(line_ranges(b'\n\n  {}\n\n', 100)), [(4, 6)])
+        eq_(list(line_ranges(b'\n \n', 100)), [])
+
+
+class TestPostJsonLines(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, content):
+        path = os.path.join(self.directory, 'records.jsonl')
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    @mock.patch('requests.request')
+    def test_file_is_posted_in_chunks(self, mock_request):
+        mock_request.__name__ = 'request'
+        sent = []
+
+        def respond(**kwargs):
+            sent.extend(json.loads(kwargs['data'].read().decode('utf-8')))
+            return make_response()
+        mock_request.side_effect = respond
+        records = [{'n': i, 'name': 'record {}'.format(i)}
+                   for i in range(200)]
+        path = self._write(b'\n'.join(json.dumps(record).encode('utf-8')
+                                      for record in records) + b'\n')
+        progress = mock.Mock()
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+
+        chunks = data_set.post_json_lines(path, chunk_bytes=1000,
+                                          workers=4, progress=progress)
+
+        assert chunks > 1
+        eq_(mock_request.call_count, chunks)
+        eq_(sorted(sent, key=lambda record: record['n']), records)
+        eq_(sum(call[0][1] for call in progress.call_args_list), 200)
+
+    @mock.patch('requests.request')
+    def test_blank_lines_are_dropped(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        path = self._write(b'{"a": 1}\n\n  \n{"a": 2}\n{"a": 3}\n')
+        progress = mock.Mock()
+
+        post_json_lines(DataSet('http://backdrop', None), path,
+                        progress=progress)
+
+        eq_(json.loads(_sent_bodies(mock_request)[0].decode('utf-8')),
+            [{'a': 1}, {'a': 2}, {'a': 3}])
+        progress.assert_called_once_with(1, 3)
+
+    @mock.patch('requests.request')
+    def test_empty_files_send_nothing(self, mock_request):
+        eq_(post_json_lines(DataSet('http://backdrop', None),
+                            self._write(b'')), 0)
+        eq_(mock_request.call_count, 0)
+
+
+class TestRawBodies(object):
+    @mock.patch('requests.request')
+    def test_bytes_and_buffers_are_sent_without_reencoding(
+            self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        data_set = DataSet('http://backdrop', None)
+
+        data_set.post(b'[{"a": 1}]')
+        data_set.post(bytearray(b'[{"a": 2}]'))
+        data_set.post(memoryview(b'[{"a": 3}]'))
+
+        eq_(_sent_bodies(mock_request),
+            [b'[{"a": 1}]', b'[{"a": 2}]', b'[{"a": 3}]'])
+
+    @mock.patch('requests.request')
+    def test_files_are_streamed_as_they_are(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        f = tempfile.TemporaryFile()
+        f.write(b'x' * 5000)
+        f.seek(0)
+
+        DataSet('http://backdrop', None).post(EncodedPayload(f, 'gzip'))
+
+        kwargs = mock_request.call_args[1]
+        assert kwargs['data'] is f
+        eq_(kwargs['headers']['Content-Encoding'], 'gzip')
+
+    @mock.patch('requests.request')
+    def test_mmaps_are_streamed(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        f = tempfile.TemporaryFile()
+        f.write(b'[{"a": 1}]')
+        f.flush()
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        DataSet('http://backdrop', None).post(buf)
+
+        assert mock_request.call_args[1]['data'] is buf
+
+    @mock.patch('requests.request')
+    def test_streamed_bodies_are_rewound_for_retries(self, mock_request):
+        mock_request.__name__ = 'request'
+        failure = make_response()
+        failure.status_code = 503
+        bodies = []
+
+        def respond(**kwargs):
+            bodies.append(kwargs['data'].read())
+            return failure if len(bodies) == 1 else make_response()
+        mock_request.side_effect = respond
+
+        with mock.patch('time.sleep'):
+            DataSet('http://backdrop', None).post(BytesIO(b'[{"a": 1}]'))
+
+        eq_(bodies, [b'[{"a": 1}]', b'[{"a": 1}]'])
+
+    def test_buffer_reader(self):
+        reader = BufferReader(bytearray(b'abcdef'))
+
+        eq_(len(reader), 6)
+        eq_(reader.read(4), b'abcd')
+        eq_(reader.read(), b'ef')
+        eq_(reader.read(), b'')
+        reader.seek(1)
+        eq_(reader.read(2), b'bc')
@@ -0,0 +1,143 @@
+import mock
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.admin import AdminAPI
+from performanceplatform.client.plan import changed_fields
+from .helpers import FakeAdmin, json_response
+
+
+def _admin():
+    return FakeAdmin({
+        'list_data_sets': [{'name': 'claims', 'data_group': 'carers',
+                            'bearer_token': 'x', 'max_age_expected': 60}],
+        'list_module_types': [{'name': 'kpi', 'schema': {}}],
+        'list_dashboards': {'dashboards': [
+            {'id': 'd1', 'slug': 'carers', 'title': 'Carers'},
+            {'id': 'd2', 'slug': 'old', 'title': 'Old'},
+        ]},
+        'get_dashboard': {'id': 'd1', 'slug': 'carers', 'title': 'Carers',
+                          'modules': [{'slug': 'kpi', 'info': ['a']}]},
+        'create_data_set': None,
+        'create_dashboard': None,
+        'update_dashboard': None,
+        'delete_dashboard': None,
+    })
+
+
+def _writes(admin):
+    """The writes ``admin`` was asked to make, by name or id"""
+    keys = {'create_data_set': lambda data: data['name'],
+            'create_dashboard': lambda data: data['slug'],
+            'update_dashboard': lambda dashboard_id, data: dashboard_id,
+            'delete_dashboard': lambda dashboard_id: dashboard_id}
+    return [(call[0], keys[call[0]](*call[1:]))
+            for call in admin.calls if call[0] in keys]
+
+
+DESIRED = {
+    'data_sets': [
+        {'name': 'claims', 'data_group': 'carers'},
+        {'name': 'visits', 'data_group': 'carers'},
+    ],
+    'module_types': [{'name': 'kpi', 'schema': {'type': 'object'}}],
+    'dashboards': [
+        {'slug': 'carers', 'title': 'Carers',
+         'modules': [{'slug': 'kpi', 'info': ['b']}]},
+        {'slug': 'new', 'title': 'New'},
+    ],
+}
+
+
+class TestPlan(object):
+    def test_only_desired_fields_are_compared(self):
+        eq_(changed_fields({'a': 1, 'b': {'c': 2}},
+                           {'a': 1, 'b': {'c': 2, 'd': 3}, 'id': 'x'}), [])
+        eq_(changed_fields({'a': [{'c': 1}]}, {'a': [{'c': 1}, {}]}), ['a'])
+
+    def test_plan_contains_only_necessary_writes(self):
+        plan = _admin().plan(DESIRED)
+
+        eq_(sorted((action.operation, action.kind, action.key)
+                   for action in plan), [
+            ('create', 'dashboards', 'new'),
+            ('create', 'data_sets', 'visits'),
+            ('unsupported', 'module_types', 'kpi'),
+            ('update', 'dashboards', 'carers'),
+        ])
+        eq_(len(plan.writes), 3)
+
+    def test_unchanged_state_needs_no_writes(self):
+        plan = _admin().plan({'data_sets': [{'name': 'claims'}]})
+
+        eq_(len(plan), 0)
+        eq_(plan.format(), 'No changes.')
+
+    def test_prune_deletes_unwanted_dashboards(self):
+        plan = _admin().plan(DESIRED, prune=True)
+
+        assert '- delete dashboard old' in plan.format()
+
+    def test_format(self):
+        output = _admin().plan(DESIRED).format()
+
+        assert '~ update dashboard carers (modules)' in output
+        assert '! unsupported module_type kpi (schema)' in output
+        assert output.endswith(
+            '2 to create, 1 to update, 0 to delete, 1 unsupported.')
+
+    def test_unknown_kinds_are_rejected(self):
+        assert_raises(ValueError, _admin().plan, {'users': []})
+
+    def test_apply_writes_data_sets_before_dashboards(self):
+        admin = _admin()
+
+        results = admin.apply_plan(admin.plan(DESIRED, prune=True))
+
+        eq_(len(results), 4)
+        writes = _writes(admin)
+        eq_(writes[0], ('create_data_set', 'visits'))
+        eq_(sorted(writes[1:3]),
+            [('create_dashboard', 'new'), ('update_dashboard', 'd1')])
+        eq_(writes[3], ('delete_dashboard', 'd2'))
+
+    def test_updates_send_the_whole_dashboard(self):
+        admin = _admin()
+        update, = [action for action in admin.plan(DESIRED)
+                   if action.operation == 'update']
+
+        eq_(update.data, {'id': 'd1', 'slug': 'carers', 'title': 'Carers',
+                          'modules': [{'slug': 'kpi', 'info': ['b']}]})
+
+    def test_dashboards_without_ids_are_not_deleted(self):
+        admin = _admin()
+        admin.list_dashboards = lambda: [{'slug': 'orphan'}]
+
+        eq_(len(admin.plan({'dashboards': []}, prune=True)), 0)
+
+    @mock.patch('requests.request')
+    def test_dry_run_plans_from_the_real_state(self, mock_request):
+        mock_request.__name__ = 'request'
+        listings = {
+            '/data-sets': [{'name': 'claims', 'data_group': 'carers'}],
+            '/module-type': [{'name': 'kpi', 'schema': {}}],
+            '/dashboards': {'dashboards': [
+                {'id': 'd1', 'slug': 'carers', 'title': 'Carers'}]},
+            '/dashboard/d1': {'id': 'd1', 'slug': 'carers',
+                              'title': 'Carers', 'modules': []},
+        }
+
+        def respond(method, url, **kwargs):
+            eq_(method, 'GET')
+            return json_response(listings[url[len('http://admin.api'):]])
+        mock_request.side_effect = respond
+        admin = AdminAPI('http://admin.api', 'token', dry_run=True)
+
+        plan = admin.plan(DESIRED)
+        results = admin.apply_plan(plan)
+
+        eq_(sorted((action.operation, action.key) for action in plan), [
+            ('create', 'new'), ('create', 'visits'),
+            ('unsupported', 'kpi'), ('update', 'carers')])
+        eq_(len(results), 3)
+        eq_(mock_request.call_count, 4)
+        eq_(admin.dry_run, True)
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.admin import AdminAPI
+from performanceplatform.client.provisioning import dependency_graph
+
+
+DEFINITIONS = [
+    {'kind': 'module', 'dashboard': 'carers',
+     'data': {'slug': 'claims', 'data_set': 'carers_claims'}},
+    {'kind': 'dashboard', 'data': {'slug': 'carers'}},
+    {'kind': 'data_set', 'data': {'name': 'carers_claims',
+                                  'data_group': 'carers',
+                                  'data_type': 'claims'}},
+    {'kind': 'transform', 'data': {'input': {'data-group': 'carers',
+                                             'data-type': 'claims'}}},
+    {'kind': 'data_group', 'data': {'name': 'carers'}},
+    {'kind': 'data_set', 'data': {'name': 'existing_group_set',
+                                  'data_group': 'elsewhere',
+                                  'data_type': 'x'}},
+]
+
+
+class RecordingAdmin(AdminAPI):
+    def __init__(self, fail=()):
+        super(RecordingAdmin, self).__init__('http://admin.api', 'token')
+        self.fail = fail
+        self.order = []
+        self.lock = threading.Lock()
+
+    def _record(self, name, data):
+        time.sleep(0.05)
+        with self.lock:
+            self.order.append((name, data.get('name') or data.get('slug')))
+        if name in self.fail:
+            raise ValueError('{} rejected'.format(name))
+        return {'id': 'id-of-{}'.format(data.get('name') or
+                                        data.get('slug'))}
+
+    def create_data_group(self, data):
+        return self._record('data_group', data)
+
+    def create_data_set(self, data):
+        return self._record('data_set', data)
+
+    def create_transform(self, data):
+        return self._record('transform', data)
+
+    def create_dashboard(self, data):
+        return self._record('dashboard', data)
+
+    def add_module_to_dashboard(self, dashboard_id, data):
+        eq_(dashboard_id, 'id-of-carers')
+        return self._record('module', data)
+
+
+class TestProvisioning(object):
+    def test_dependencies(self):
+        eq_(dependency_graph(DEFINITIONS),
+            [[1, 2], [], [4], [2], [], []])
+
+    def test_unknown_kinds_are_rejected(self):
+        assert_raises(ValueError, dependency_graph, [{'kind': 'user'}])
+
+    def test_everything_is_created_in_dependency_order(self):
+        admin = RecordingAdmin()
+
+        reports = admin.provision(DEFINITIONS, workers=4)
+
+        eq_([report['status'] for report in reports], ['created'] * 6)
+        eq_(reports[1]['result'], {'id': 'id-of-carers'})
+        order = admin.order
+        assert order.index(('data_group', 'carers')) < \
+            order.index(('data_set', 'carers_claims'))
+        assert order.index(('data_set', 'carers_claims')) < \
+            order.index(('transform', None))
+        assert order.index(('dashboard', 'carers')) < \
+            order.index(('module', 'claims'))
+
+    def test_dependents_of_failures_are_skipped(self):
+        admin = RecordingAdmin(fail=('data_group',))
+
+        reports = admin.provision(DEFINITIONS)
+
+        eq_([report['status'] for report in reports],
+            ['skipped', 'created', 'skipped', 'skipped', 'failed',
+             'created'])
+        assert isinstance(reports[4]['error'], ValueError)
+        eq_(reports[3]['error'], 'dependency #4 failed')
+
+    def test_independent_objects_are_created_concurrently(self):
+        admin = RecordingAdmin()
+        definitions = [{'kind': 'data_group', 'data': {'name': str(n)}}
+                       for n in range(20)]
+
+        started = time.time()
+        admin.provision(definitions, workers=10)
+
+        # Creating them one after another would take a second
+        assert time.time() - started < 0.5
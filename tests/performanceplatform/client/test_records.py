@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import json
+
+import mock
+import pytz
+from nose import SkipTest
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.records import Record, RecordBatch
+from .helpers import make_response
+
+
+RESPONSE = json.dumps({
+    'data': [
+        {'_timestamp': '2014-01-06T00:00:00+00:00', 'count': 3,
+         'region': 'north'},
+        {'_timestamp': '2014-01-13T00:00:00+00:00', 'count': 5,
+         'region': 'north'},
+        {'_timestamp': '2014-01-20T00:00:00+00:00', 'region': 'south',
+         'values': [{'count': 1}]},
+    ],
+    'warning': 'beta',
+})
+
+
+class TestRecordBatch(object):
+    def test_records_behave_like_read_only_dicts(self):
+        batch = RecordBatch.from_json(RESPONSE)
+
+        eq_(len(batch), 3)
+        eq_(batch[0]['count'], 3)
+        eq_(batch[2].get('count'), None)
+        assert 'region' in batch[0]
+        assert_raises(KeyError, lambda: batch[0]['missing'])
+        eq_(batch[1], {'_timestamp': '2014-01-13T00:00:00+00:00',
+                       'count': 5, 'region': 'north'})
+        eq_(batch.meta, {'warning': 'beta'})
+
+    def test_shapes_and_strings_are_shared(self):
+        batch = RecordBatch.from_json(RESPONSE)
+
+        assert batch[0]._shape is batch[1]._shape
+        assert batch[0]['region'] is batch[1]['region']
+        assert not hasattr(batch[0], '__dict__')
+
+    def test_to_dicts_converts_nested_records(self):
+        dicts = RecordBatch.from_json(RESPONSE).to_dicts()
+
+        eq_(dicts, json.loads(RESPONSE)['data'])
+        assert not isinstance(dicts[2]['values'][0], Record)
+
+    def test_keys_and_columns(self):
+        batch = RecordBatch.from_json(RESPONSE)
+
+        eq_(sorted(batch.keys()), ['_timestamp', 'count', 'region', 'values'])
+        eq_(batch.column('count'), [3, 5, None])
+        eq_(batch.column('count', default=0), [3, 5, 0])
+        eq_(batch.column('_timestamp', parse_dates=True)[0],
+            datetime(2014, 1, 6, tzinfo=pytz.UTC))
+
+    def test_to_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest('numpy is not installed')
+
+        array = RecordBatch.from_json(RESPONSE).to_numpy(
+            'count', dtype=float)
+
+        eq_(array.dtype, numpy.float64)
+        eq_(array[1], 5.0)
+        assert numpy.isnan(array[2])
+
+    def test_top_level_lists_are_supported(self):
+        batch = RecordBatch.from_json('[{"a": 1}, {"a": "é"}]')
+
+        eq_(batch.to_dicts(), [{'a': 1}, {'a': u'é'}])
+        eq_(batch.meta, {})
+
+    @mock.patch('requests.request')
+    def test_data_set_get_can_return_a_batch(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(content=RESPONSE)
+
+        result = DataSet('', None).get({'period': 'week'}, compact=True)
+
+        assert isinstance(result, RecordBatch)
+        eq_(result.column('region'), ['north', 'north', 'south'])
@@ -0,0 +1,90 @@
+import sys
+
+import mock
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.registry import DataSetRegistry
+from .helpers import make_response
+
+
+class TestDataSetRegistry(object):
+    def test_handles_are_cached_by_group_and_type(self):
+        registry = DataSetRegistry('http://backdrop/data/')
+
+        claims = registry.data_set('group', 'claims')
+
+        assert registry.data_set('group', 'claims') is claims
+        assert registry.data_set('group', 'visits') is not claims
+        eq_(claims.base_url, 'http://backdrop/data/group/claims')
+        eq_(registry.data_set_by_name('name').base_url,
+            'http://backdrop/data/name')
+        eq_(len(registry), 3)
+        assert ('group', 'claims') in registry
+
+    def test_handles_are_small_data_sets(self):
+        registry = DataSetRegistry('http://backdrop/data', dry_run=True)
+
+        handle = registry.data_set('group', 'type')
+        handle.post({'a': 1})
+
+        assert isinstance(handle, DataSet)
+        assert handle.dry_run
+        assert sys.getsizeof(handle) < 100
+
+    def test_settings_are_shared(self):
+        registry = DataSetRegistry('http://backdrop/data', token='host')
+
+        first = registry.data_set('group', 'a')
+        second = registry.data_set('group', 'b', token='own')
+
+        eq_(first.token, 'host')
+        eq_(second.token, 'own')
+        registry.transport.dry_run = True
+        assert first.dry_run and second.dry_run
+
+    def test_handles_with_other_tokens_are_separate(self):
+        registry = DataSetRegistry('http://backdrop/data', token='host')
+
+        shared = registry.data_set('group', 'a')
+        own = registry.data_set('group', 'a', token='own')
+
+        assert own is not shared
+        assert registry.data_set('group', 'a', token='own') is own
+        eq_(shared.token, 'host')
+        eq_(own.token, 'own')
+        eq_(len(registry), 2)
+
+    def test_tokens_are_validated(self):
+        registry = DataSetRegistry('http://backdrop/data')
+
+        assert_raises(Exception, registry.data_set, 'g', 't', token=1)
+        assert_raises(ValueError, DataSetRegistry, 'http://b', token=1)
+
+    @mock.patch('requests.Session.request')
+    def test_requests_go_through_the_shared_session(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        registry = DataSetRegistry('http://backdrop/data', token='host')
+
+        registry.data_set('group', 'a').get()
+        registry.data_set('group', 'b', token='own').post({'a': 1})
+
+        eq_(mock_request.call_count, 2)
+        get, post = mock_request.call_args_list
+        eq_(get[1]['url'], 'http://backdrop/data/group/a')
+        eq_(get[1]['headers']['Authorization'], 'Bearer host')
+        eq_(post[1]['headers']['Authorization'], 'Bearer own')
+
+    @mock.patch('requests.Session.request')
+    def test_writes_invalidate_the_shared_cache(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = lambda **kwargs: make_response()
+        cache = mock.Mock()
+        cache.get.return_value = None
+        registry = DataSetRegistry('http://backdrop/data', cache=cache)
+
+        registry.data_set('group', 'a').post({'a': 1})
+
+        cache.invalidate.assert_called_once_with(
+            'http://backdrop/data/group/a')
@@ -0,0 +1,62 @@
+import gzip
+import json
+from io import BytesIO
+
+import mock
+from nose.tools import eq_, assert_raises
+from requests import HTTPError
+
+from performanceplatform.client.data_set import DataSet
+from .helpers import make_response
+
+
+class TestReplace(object):
+    @mock.patch('requests.request')
+    def test_empties_then_posts_staged_chunks(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        data_set = DataSet('http://backdrop/data/foo/bar', 'token')
+
+        report = data_set.replace(iter([{'a': 1}, {'a': 2}, {'a': 3}]),
+                                  chunk_size=2, workers=2)
+
+        eq_(mock_request.call_count, 3)
+        calls = mock_request.call_args_list
+        eq_(calls[0][1]['method'], 'PUT')
+        eq_(calls[0][1]['data'], '[]')
+        eq_(sorted(json.loads(call[1]['data']) for call in calls[1:]),
+            [[{'a': 1}, {'a': 2}], [{'a': 3}]])
+        eq_(report['records'], 3)
+        eq_(report['chunks'], 2)
+        eq_(set(report['timings']),
+            set(['stage', 'empty', 'upload', 'gap']))
+
+    @mock.patch('requests.request')
+    def test_large_chunks_are_sent_compressed(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('', 'token')
+        records = [{'value': 'x' * 100, 'n': n} for n in range(50)]
+
+        data_set.replace(records, chunk_size=50)
+
+        post = mock_request.call_args_list[1][1]
+        eq_(post['headers']['Content-Encoding'], 'gzip')
+        body = gzip.GzipFile(fileobj=BytesIO(post['data'])).read()
+        eq_(json.loads(body.decode('utf-8')), records)
+
+    @mock.patch('requests.request')
+    def test_nothing_is_emptied_if_staging_fails(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('', 'token')
+
+        assert_raises(TypeError, data_set.replace, [{'a': object()}])
+        eq_(mock_request.call_count, 0)
+
+    @mock.patch('requests.request')
+    def test_nothing_is_uploaded_if_emptying_fails(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(403, '')
+        data_set = DataSet('', 'token')
+
+        assert_raises(HTTPError, data_set.replace, [{'a': 1}])
+        eq_(mock_request.call_count, 1)
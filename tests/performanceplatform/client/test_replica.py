@@ -0,0 +1,257 @@
+import json
+
+import mock
+import requests
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.frames import arrays_from_json
+from performanceplatform.client.replica import (
+    Replica, Snapshot, Unsupported, execute, parse_query
+)
+from .helpers import Clock, json_response
+
+
+RECORDS = [
+    {'_timestamp': '2014-01-01T00:00:00+00:00', 'channel': 'web',
+     'count': 1, 'tag': 'a'},
+    {'_timestamp': '2014-01-02T00:00:00+00:00', 'channel': 'phone',
+     'count': 2, 'tag': 'b'},
+    {'_timestamp': '2014-01-06T00:00:00+00:00', 'channel': 'web',
+     'count': 3, 'tag': 'a'},
+    {'_timestamp': '2014-01-07T00:00:00+00:00', 'channel': 'web',
+     'count': 4},
+    {'_timestamp': '2014-01-08T00:00:00+00:00', 'channel': 'paper',
+     'count': 5, 'tag': 'c'},
+]
+
+
+def _snapshot(records=RECORDS):
+    # Shuffled, to check the snapshot sorts by timestamp
+    return Snapshot(arrays_from_json(json.dumps(
+        {'data': list(reversed(records))})))
+
+
+def query(**parameters):
+    return execute(_snapshot(), parse_query(parameters))['data']
+
+
+NOW = 1389225600.0  # 2014-01-09
+
+
+class TestQueries(object):
+    def test_raw_records_in_timestamp_order(self):
+        eq_(query(), RECORDS)
+
+    def test_time_window(self):
+        eq_(query(start_at='2014-01-02T00:00:00Z',
+                  end_at='2014-01-07T00:00:00Z'), RECORDS[1:3])
+
+    def test_filters(self):
+        eq_(query(filter_by='channel:web'),
+            [RECORDS[0], RECORDS[2], RECORDS[3]])
+        eq_(query(filter_by=['channel:web', 'tag:a'], limit=1),
+            [RECORDS[0]])
+        eq_(query(filter_by='count:3'), [RECORDS[2]])
+        eq_(query(filter_by='channel:post'), [])
+
+    def test_prefix_filters(self):
+        eq_(query(filter_by_prefix='channel:p'), [RECORDS[1], RECORDS[4]])
+
+    def test_sort_and_limit(self):
+        eq_([record['count'] for record in
+             query(sort_by='count:descending', limit=2)], [5, 4])
+
+    def test_group_by_and_collect(self):
+        eq_(query(group_by='channel',
+                  collect=['count:sum', 'count:mean', 'tag', 'tag:set']), [
+            {'channel': 'paper', '_count': 1, 'count:sum': 5,
+             'count:mean': 5.0, 'tag': ['c'], 'tag:set': ['c']},
+            {'channel': 'phone', '_count': 1, 'count:sum': 2,
+             'count:mean': 2.0, 'tag': ['b'], 'tag:set': ['b']},
+            {'channel': 'web', '_count': 3, 'count:sum': 8,
+             'count:mean': 8 / 3.0, 'tag': ['a', 'a'], 'tag:set': ['a']},
+        ])
+
+    def test_records_without_the_group_field_are_left_out(self):
+        eq_([(row['tag'], row['_count']) for row in query(group_by='tag')],
+            [('a', 2), ('b', 1), ('c', 1)])
+
+    def test_periods_are_filled_between_the_bounds(self):
+        eq_(query(period='week', collect='count:sum',
+                  start_at='2013-12-30T00:00:00Z',
+                  end_at='2014-01-20T00:00:00Z'), [
+            {'_start_at': '2013-12-30T00:00:00+00:00',
+             '_end_at': '2014-01-06T00:00:00+00:00',
+             '_count': 2, 'count:sum': 3},
+            {'_start_at': '2014-01-06T00:00:00+00:00',
+             '_end_at': '2014-01-13T00:00:00+00:00',
+             '_count': 3, 'count:sum': 12},
+            {'_start_at': '2014-01-13T00:00:00+00:00',
+             '_end_at': '2014-01-20T00:00:00+00:00',
+             '_count': 0, 'count:sum': None},
+        ])
+
+    def test_duration(self):
+        eq_(query(period='day', duration=2, end_at='2014-01-08T00:00:00Z'),
+            [{'_start_at': '2014-01-06T00:00:00+00:00',
+              '_end_at': '2014-01-07T00:00:00+00:00', '_count': 1},
+             {'_start_at': '2014-01-07T00:00:00+00:00',
+              '_end_at': '2014-01-08T00:00:00+00:00', '_count': 1}])
+
+    def test_calendar_periods(self):
+        eq_([row['_start_at'] for row in query(period='quarter')],
+            ['2014-01-01T00:00:00+00:00'])
+        eq_([row['_end_at'] for row in query(period='month')],
+            ['2014-02-01T00:00:00+00:00'])
+
+    def test_group_by_with_period(self):
+        rows = query(group_by='channel', period='week')
+        eq_([(row['channel'], row['_count'], row['_group_count'])
+             for row in rows], [('paper', 1, 2), ('phone', 1, 2),
+                                ('web', 3, 2)])
+        eq_([value['_count'] for value in rows[2]['values']], [1, 2])
+
+    def test_unsupported_queries(self):
+        assert_raises(Unsupported, parse_query, {'flatten': 'true'})
+        assert_raises(Unsupported, parse_query, {'period': 'fortnight'})
+        assert_raises(Unsupported, parse_query, {'collect': 'count:median'})
+        assert_raises(Unsupported, parse_query, {'duration': 3})
+
+    def test_integers_with_gaps_stay_integers(self):
+        snapshot = Snapshot(arrays_from_json(json.dumps({'data': [
+            {'_timestamp': '2014-01-01T00:00:00+00:00', 'n': 1},
+            {'_timestamp': '2014-01-02T00:00:00+00:00'},
+        ]}), exact_ints=True))
+        rows = execute(snapshot, parse_query({}))['data']
+        eq_(repr(rows[0]['n']), '1')
+        grouped = execute(snapshot, parse_query(
+            {'period': 'year', 'collect': ['n:sum', 'n']}))['data']
+        eq_(repr((grouped[0]['n:sum'], grouped[0]['n'])), '(1, [1])')
+
+    def test_timestamps_keep_microseconds(self):
+        snapshot = _snapshot([{'_timestamp': '2014-01-01T00:00:00.250000Z'},
+                              {'_timestamp': '2014-01-02T00:00:00Z'}])
+        eq_([row['_timestamp'] for row in
+             execute(snapshot, parse_query({}))['data']],
+            ['2014-01-01T00:00:00.250000+00:00',
+             '2014-01-02T00:00:00+00:00'])
+
+    def test_indexes_are_built_once(self):
+        snapshot = _snapshot()
+        index = snapshot.index('channel')
+        eq_(sorted(index), ['paper', 'phone', 'web'])
+        eq_(index['web'].tolist(), [0, 2, 3])
+        assert snapshot.index('channel') is index
+
+    def test_newer_records_are_replaced(self):
+        snapshot = _snapshot().replace_from(
+            parse_query({'start_at': '2014-01-07T00:00:00Z'})['start'],
+            arrays_from_json(json.dumps({'data': [
+                {'_timestamp': '2014-01-07T00:00:00+00:00',
+                 'channel': 'web', 'count': 40, 'extra': 'x'}]})))
+        records = execute(snapshot, parse_query({}))['data']
+        eq_([record['count'] for record in records], [1, 2, 3, 40])
+        eq_(records[-1]['extra'], 'x')
+        eq_(str(snapshot.high_water), '2014-01-07 00:00:00+00:00')
+
+
+class TestReplica(object):
+    def setup(self):
+        self.clock = Clock(NOW)
+        self.data_set = DataSet('http://backdrop/data/group/type', 'token')
+        self.replica = Replica(self.data_set, max_age=60, clock=self.clock)
+        self.data_set.replica = self.replica
+
+    @mock.patch('requests.request')
+    def test_queries_are_answered_locally(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+
+        eq_(self.data_set.get({'filter_by': 'channel:phone'}),
+            {'data': [RECORDS[1]]})
+        eq_(self.data_set.get({'group_by': 'channel'})['data'][0]['_count'],
+            1)
+        eq_(mock_request.call_count, 1)
+        eq_(self.replica.hits, 2)
+
+    @mock.patch('requests.request')
+    def test_unsupported_queries_go_to_the_server(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': []})
+
+        self.data_set.get({'flatten': 'true'})
+
+        eq_(mock_request.call_args[1]['params'], {'flatten': 'true'})
+        eq_(self.replica.fallbacks, 1)
+        eq_(self.replica.snapshot, None)
+
+    @mock.patch('requests.request')
+    def test_refreshes_fetch_only_recent_records(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+        self.data_set.get()
+
+        mock_request.return_value = json_response({'data': [
+            {'_timestamp': '2014-01-08T00:00:00+00:00', 'channel': 'post',
+             'count': 6}]})
+        self.clock.now += 60
+        records = self.data_set.get()['data']
+
+        eq_(mock_request.call_args[1]['params'], {
+            'start_at': '2014-01-07T00:00:00Z',
+            'end_at': '2014-01-10T00:01:00Z'})
+        eq_([record['channel'] for record in records][-2:],
+            ['web', 'post'])
+        eq_(len(records), 4)
+
+    @mock.patch('requests.request')
+    def test_writes_mark_the_replica_stale(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+        self.data_set.get()
+        self.data_set.post({'_timestamp': '2014-01-08T12:00:00+00:00'})
+        self.data_set.get()
+
+        eq_(mock_request.call_count, 3)
+        eq_(self.replica.refreshes, 2)
+
+    @mock.patch('requests.request')
+    def test_full_refresh(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = json_response({'data': RECORDS})
+        self.replica.refresh()
+        mock_request.return_value = json_response({'data': RECORDS[:1]})
+        self.replica.refresh(full=True)
+
+        eq_(mock_request.call_args[1]['params'], None)
+        eq_(self.replica.snapshot.length, 1)
+
+    @mock.patch('requests.request')
+    def test_failed_refreshes_fall_back(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = [requests.ConnectionError(),
+                                    json_response({'data': RECORDS[:1]})]
+        self.data_set.retry_on_error = False
+
+        eq_(self.data_set.get(), {'data': RECORDS[:1]})
+        eq_(self.replica.snapshot, None)
+
+        mock_request.side_effect = [json_response({'data': RECORDS})]
+        self.clock.now += 30
+        self.data_set.get()
+        self.clock.now += 60
+        mock_request.side_effect = requests.ConnectionError()
+        eq_(len(self.data_set.get()['data']), 5)
+        eq_(self.replica.hits, 2)
+
+    @mock.patch('requests.request')
+    def test_dry_run_clients_are_not_replicated(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('http://backdrop/data/group/type', 'token',
+                           dry_run=True)
+        data_set.replica = Replica(data_set)
+
+        eq_(data_set.get(), None)
+        eq_(data_set.replica.snapshot, None)
+        eq_(mock_request.call_count, 0)
@@ -0,0 +1,148 @@
+import threading
+import time
+
+import mock
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.registry import DataSetRegistry
+from performanceplatform.client.scheduler import (
+    BACKFILL, NORMAL, REALTIME, WriteScheduler
+)
+from .helpers import make_response, wait_for
+
+
+class Uplink(object):
+
+    """Holds a one-slot scheduler busy while chunks are queued behind it"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.order = []
+        self.threads = []
+        self._release = threading.Event()
+        self._hold = threading.Thread(target=scheduler.run, args=(
+            'holder', self._release.wait))
+        self._hold.start()
+        wait_for(lambda: scheduler.active == 1)
+
+    def queue(self, flow, cost=1, weight=1, priority=NORMAL):
+        waiting = self.scheduler.waiting
+        thread = threading.Thread(target=self.scheduler.run, args=(
+            flow, self._recorder(flow), cost, weight, priority))
+        thread.start()
+        self.threads.append(thread)
+        wait_for(lambda: self.scheduler.waiting == waiting + 1)
+
+    def _recorder(self, flow):
+        return lambda: self.order.append(flow)
+
+    def drain(self):
+        self._release.set()
+        for thread in [self._hold] + self.threads:
+            thread.join()
+        return self.order
+
+
+class TestWriteScheduler(object):
+    def test_returns_the_result(self):
+        eq_(WriteScheduler().run('a', lambda: 42), 42)
+
+    def test_raises_errors(self):
+        def fail():
+            raise ValueError('no')
+
+        scheduler = WriteScheduler()
+        assert_raises(ValueError, scheduler.run, 'a', fail)
+        eq_(scheduler.active, 0)
+
+    def test_concurrency_is_capped(self):
+        scheduler = WriteScheduler(max_concurrent=3)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def send():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        threads = [threading.Thread(target=scheduler.run, args=('a', send))
+                   for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(running[1], 3)
+
+    def test_data_sets_take_turns(self):
+        uplink = Uplink(WriteScheduler(max_concurrent=1))
+        for _ in range(4):
+            uplink.queue('backfill')
+        for _ in range(2):
+            uplink.queue('small')
+        eq_(uplink.drain(), ['backfill', 'small', 'backfill', 'small',
+                             'backfill', 'backfill'])
+
+    def test_large_chunks_wait_their_turn(self):
+        uplink = Uplink(WriteScheduler(max_concurrent=1))
+        uplink.queue('backfill', cost=1000)
+        uplink.queue('backfill', cost=1000)
+        for _ in range(3):
+            uplink.queue('small', cost=10)
+        eq_(uplink.drain(), ['small', 'small', 'small', 'backfill',
+                             'backfill'])
+
+    def test_weights_share_the_uplink(self):
+        uplink = Uplink(WriteScheduler(max_concurrent=1))
+        for _ in range(4):
+            uplink.queue('light', weight=1)
+        for _ in range(4):
+            uplink.queue('heavy', weight=3)
+        # Ties go to whichever was queued first
+        eq_(uplink.drain(), ['heavy', 'heavy', 'light', 'heavy', 'heavy',
+                             'light', 'light', 'light'])
+
+    def test_higher_priorities_go_first(self):
+        uplink = Uplink(WriteScheduler(max_concurrent=1))
+        uplink.queue('backfill', priority=BACKFILL)
+        uplink.queue('normal', priority=NORMAL)
+        uplink.queue('realtime', priority=REALTIME)
+        eq_(uplink.drain(), ['realtime', 'normal', 'backfill'])
+
+    def test_arguments_are_checked(self):
+        assert_raises(ValueError, WriteScheduler, 0)
+        assert_raises(ValueError, WriteScheduler().run, 'a', lambda: None,
+                      weight=0)
+
+
+class TestDataSetScheduling(object):
+    @mock.patch('requests.request')
+    def test_chunks_are_scheduled(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+
+        scheduler = WriteScheduler()
+        data_set = DataSet('http://backdrop/data/group/type', 'token')
+        data_set.scheduler = scheduler
+        data_set.priority = REALTIME
+        data_set.weight = 2
+
+        with mock.patch.object(scheduler, 'run',
+                               wraps=scheduler.run) as run:
+            data_set.post([{'n': n} for n in range(5)], chunk_size=2)
+
+        eq_([(call[0][0], call[1]) for call in run.call_args_list],
+            [('http://backdrop/data/group/type',
+              {'cost': cost, 'weight': 2, 'priority': REALTIME})
+             for cost in (2, 2, 1)])
+        eq_(mock_request.call_count, 3)
+
+    def test_registry_handles_share_a_scheduler(self):
+        scheduler = WriteScheduler()
+        registry = DataSetRegistry('http://backdrop/data',
+                                   scheduler=scheduler)
+        assert registry.data_set('a', 'b').scheduler is scheduler
+        assert registry.data_set('c', 'd').scheduler is scheduler
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+import mock
+import pytz
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.sharding import (
+    add_periods, merge_results, shard_windows
+)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=pytz.UTC)
+
+
+class TestShardWindows(object):
+    def test_calendar_periods(self):
+        eq_(add_periods(utc(2014, 11, 1), 'month', 3), utc(2015, 2, 1))
+        eq_(add_periods(utc(2014, 1, 1), 'quarter', 1), utc(2014, 4, 1))
+        eq_(add_periods(utc(2014, 1, 6), 'week', 2), utc(2014, 1, 20))
+
+    def test_period_windows_are_aligned(self):
+        windows = shard_windows(utc(2014, 1, 1), utc(2014, 7, 1),
+                                period='month', periods_per_shard=4)
+
+        eq_(windows, [(utc(2014, 1, 1), utc(2014, 5, 1)),
+                      (utc(2014, 5, 1), utc(2014, 7, 1))])
+
+    def test_period_windows_split_into_shards(self):
+        windows = shard_windows(utc(2014, 1, 6), utc(2014, 2, 3),
+                                period='week', shards=2)
+
+        eq_(windows, [(utc(2014, 1, 6), utc(2014, 1, 20)),
+                      (utc(2014, 1, 20), utc(2014, 2, 3))])
+
+    def test_equal_windows(self):
+        windows = shard_windows(utc(2014, 1, 1), utc(2014, 1, 2), shards=4)
+
+        eq_(len(windows), 4)
+        eq_(windows[1], (utc(2014, 1, 1, 6), utc(2014, 1, 1, 12)))
+
+    def test_sized_windows(self):
+        windows = shard_windows(utc(2014, 1, 1), utc(2014, 1, 2),
+                                shard_size=timedelta(hours=10))
+
+        eq_(windows[-1], (utc(2014, 1, 1, 20), utc(2014, 1, 2)))
+
+
+class TestMergeResults(object):
+    def test_raw_results_are_concatenated_sorted_and_limited(self):
+        merged = merge_results(
+            [{'data': [{'n': 3}, {'n': 1}]}, {'data': [{'n': 2}]}],
+            {'sort_by': 'n:descending', 'limit': 2})
+
+        eq_(merged, {'data': [{'n': 3}, {'n': 2}]})
+
+    def test_grouped_results_are_reaggregated(self):
+        merged = merge_results([
+            {'data': [
+                {'region': 'north', '_count': 1, 'n:sum': 4, 'n:mean': 4.0,
+                 'tag:set': ['a'], 'tag': ['a']},
+            ]},
+            {'data': [
+                {'region': 'south', '_count': 1, 'n:sum': 1, 'n:mean': 1.0,
+                 'tag:set': ['b'], 'tag': ['b']},
+                {'region': 'north', '_count': 3, 'n:sum': 6, 'n:mean': 2.0,
+                 'tag:set': ['a', 'b'], 'tag': ['a', 'b', 'a']},
+            ]},
+        ], {'group_by': 'region'})
+
+        eq_(merged['data'][0], {
+            'region': 'north', '_count': 4, 'n:sum': 10, 'n:mean': 2.5,
+            'tag:set': ['a', 'b'], 'tag': ['a', 'a', 'b', 'a'],
+        })
+        eq_(merged['data'][1]['region'], 'south')
+
+    def test_grouped_period_values_are_concatenated(self):
+        def week(day, count):
+            return {'_start_at': '2014-01-%02dT00:00:00+00:00' % day,
+                    '_count': count}
+
+        merged = merge_results([
+            {'data': [{'region': 'north', '_count': 1, '_group_count': 1,
+                       'values': [week(6, 1)]}]},
+            {'data': [{'region': 'north', '_count': 2, '_group_count': 1,
+                       'values': [week(13, 2)]}]},
+        ], {'group_by': ['region'], 'period': 'week'})
+
+        eq_(merged['data'], [{
+            'region': 'north', '_count': 3, '_group_count': 2,
+            'values': [week(6, 1), week(13, 2)],
+        }])
+
+
+class TestGetSharded(object):
+    def test_requires_a_time_window(self):
+        assert_raises(ValueError, DataSet('', None).get_sharded, {})
+        assert_raises(ValueError, DataSet('', None).get_sharded, {
+            'start_at': '2014-01-01T00:00:00Z',
+            'end_at': '2014-02-01T00:00:00Z',
+            'group_by': 'region', 'limit': 5})
+
+    def test_fetches_each_window_and_merges(self):
+        data_set = DataSet('', None)
+        responses = {
+            '2014-01-01T00:00:00Z': {'data': [{'n': 1}]},
+            '2014-01-16T12:00:00Z': {'data': [{'n': 2}]},
+        }
+
+        with mock.patch.object(DataSet, 'get') as mock_get:
+            mock_get.side_effect = lambda query: responses[query['start_at']]
+            result = data_set.get_sharded({
+                'start_at': '2014-01-01T00:00:00+00:00',
+                'end_at': '2014-02-01T00:00:00+00:00',
+                'filter_by': 'region:north'}, workers=2)
+
+        eq_(result, {'data': [{'n': 1}, {'n': 2}]})
+        mock_get.assert_any_call({
+            'start_at': '2014-01-16T12:00:00Z',
+            'end_at': '2014-02-01T00:00:00Z',
+            'filter_by': 'region:north'})
+
+    def test_target_records_uses_a_daily_probe(self):
+        data_set = DataSet('', None)
+        daily = {'data': [
+            {'_end_at': '2014-01-0%dT00:00:00+00:00' % day, '_count': 50}
+            for day in range(2, 6)]}
+
+        with mock.patch.object(DataSet, 'get') as mock_get:
+            mock_get.side_effect = lambda query: \
+                daily if query.get('period') == 'day' else {'data': []}
+            data_set.get_sharded({
+                'start_at': '2014-01-01T00:00:00Z',
+                'end_at': '2014-01-05T00:00:00Z'}, target_records=100)
+
+        eq_(mock_get.call_count, 3)
+        mock_get.assert_any_call({
+            'start_at': '2014-01-03T00:00:00Z',
+            'end_at': '2014-01-05T00:00:00Z'})
@@ -0,0 +1,357 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+import mock
+import requests
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.cache import QueryCache
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.spool import (
+    Drainer, Spool, SpoolFull, SpoolNotEmpty, is_outage
+)
+from .helpers import make_response
+
+
+def _records(body, content_encoding):
+    if hasattr(body, 'read'):
+        body = body.read()
+    if content_encoding == 'gzip':
+        body = gzip.GzipFile(fileobj=BytesIO(body)).read()
+    return json.loads(body)
+
+
+def _segments(directory):
+    return sorted(name for name in os.listdir(directory)
+                  if name.endswith('.seg'))
+
+
+class SpoolTest(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+
+class TestSpool(SpoolTest):
+    def test_entries_are_read_in_order_until_acked(self):
+        with Spool(self.directory) as spool:
+            eq_(spool.empty, True)
+            spool.append(b'one')
+            spool.append(b'two', 'gzip')
+
+            entries = spool.read()
+            eq_([(entry.body, entry.content_encoding) for entry in entries],
+                [(b'one', None), (b'two', 'gzip')])
+            eq_([entry.body for entry in spool.read()], [b'one', b'two'])
+
+            spool.ack(entries[0].position)
+            eq_([entry.body for entry in spool.read()], [b'two'])
+            spool.ack(entries[1].position)
+            eq_(spool.read(), [])
+            eq_(spool.empty, True)
+
+    def test_read_is_limited(self):
+        with Spool(self.directory) as spool:
+            for number in range(5):
+                spool.append(str(number).encode('ascii'))
+            eq_([entry.body for entry in spool.read(2)], [b'0', b'1'])
+
+    def test_segments_roll_over_and_are_deleted_once_drained(self):
+        with Spool(self.directory, segment_bytes=10) as spool:
+            for number in range(4):
+                spool.append(b'x' * 10)
+            eq_(len(_segments(self.directory)), 4)
+
+            entries = spool.read()
+            spool.ack(entries[2].position)
+            eq_(len(_segments(self.directory)), 2)
+            eq_(spool.empty, False)
+            spool.ack(entries[3].position)
+            eq_(spool.empty, True)
+
+    def test_empty_after_draining_into_a_new_segment(self):
+        with Spool(self.directory, segment_bytes=1) as spool:
+            spool.append(b'one')
+            spool.ack(spool.read()[0].position)
+            spool.append(b'two')
+            eq_(spool.empty, False)
+            eq_([entry.body for entry in spool.read()], [b'two'])
+
+    def test_append_raises_when_full(self):
+        with Spool(self.directory, max_bytes=30) as spool:
+            spool.append(b'x' * 10)
+            assert_raises(SpoolFull, spool.append, b'x' * 10)
+            eq_(len(spool.read()), 1)
+
+    def test_cursor_survives_reopening(self):
+        with Spool(self.directory) as spool:
+            spool.append(b'one')
+            spool.append(b'two')
+            spool.ack(spool.read()[0].position)
+
+        with Spool(self.directory) as spool:
+            eq_([entry.body for entry in spool.read()], [b'two'])
+            spool.append(b'three')
+            eq_([entry.body for entry in spool.read()], [b'two', b'three'])
+
+    def test_torn_entry_is_cut_off_when_reopened(self):
+        with Spool(self.directory) as spool:
+            spool.append(b'one')
+            spool.append(b'two')
+        path = os.path.join(self.directory, _segments(self.directory)[-1])
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+
+        with Spool(self.directory) as spool:
+            spool.append(b'three')
+            eq_([entry.body for entry in spool.read()], [b'one', b'three'])
+
+    def test_fsync_policy_is_checked(self):
+        assert_raises(ValueError, Spool, self.directory, fsync='sometimes')
+
+    @mock.patch('os.fsync')
+    def test_fsync_always_syncs_every_append(self, fsync):
+        with Spool(self.directory, fsync='always') as spool:
+            spool.append(b'one')
+            spool.append(b'two')
+            eq_(fsync.call_count, 2)
+
+    @mock.patch('os.fsync')
+    def test_fsync_never_does_not_sync(self, fsync):
+        with Spool(self.directory, fsync='never') as spool:
+            spool.append(b'one')
+            spool.ack(spool.read()[0].position)
+        eq_(fsync.call_count, 0)
+
+    @mock.patch('os.fsync')
+    def test_fsync_interval_syncs_the_cursor_at_most_once_an_interval(
+            self, fsync):
+        with Spool(self.directory, fsync_interval=60) as spool:
+            for body in (b'one', b'two', b'three'):
+                spool.append(body)
+            fsync.reset_mock()
+            for entry in spool.read():
+                spool.ack(entry.position)
+            eq_(fsync.call_count, 1)
+        # The segment, and the cursor written since the last sync
+        eq_(fsync.call_count, 3)
+
+
+class TestIsOutage(object):
+    def test_outages(self):
+        eq_(is_outage(requests.ConnectionError()), True)
+        eq_(is_outage(requests.Timeout()), True)
+        eq_(is_outage(requests.HTTPError(response=make_response(503))), True)
+
+    def test_rejections(self):
+        eq_(is_outage(requests.HTTPError(response=make_response(400))), False)
+        eq_(is_outage(ValueError()), False)
+
+
+class TestDataSetSpooling(SpoolTest):
+    def setup(self):
+        super(TestDataSetSpooling, self).setup()
+        self.spool = Spool(self.directory)
+        self.data_set = DataSet('http://backdrop/data/group/type', 'token',
+                                retry_on_error=False)
+        self.data_set.spool = self.spool
+
+    def teardown(self):
+        self.spool.close()
+        super(TestDataSetSpooling, self).teardown()
+
+    def spooled(self):
+        return [_records(entry.body, entry.content_encoding)
+                for entry in self.spool.read()]
+
+    @mock.patch('requests.request')
+    def test_writes_go_straight_through_when_the_api_is_up(self,
+                                                           mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(200)
+        self.data_set.post([{'a': 1}])
+        eq_(mock_request.call_count, 1)
+        eq_(self.spool.empty, True)
+
+    @mock.patch('requests.request')
+    def test_connection_errors_are_spooled(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = requests.ConnectionError()
+        self.data_set.post([{'a': 1}])
+        eq_(self.spooled(), [[{'a': 1}]])
+
+    @mock.patch('requests.request')
+    def test_server_errors_are_spooled(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(503)
+        self.data_set.post([{'a': 1}, {'a': 2}], chunk_size=1)
+        eq_(self.spooled(), [[{'a': 1}], [{'a': 2}]])
+
+    @mock.patch('requests.request')
+    def test_rejections_are_still_raised(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(400)
+        assert_raises(requests.HTTPError, self.data_set.post, [{'a': 1}])
+        eq_(self.spool.empty, True)
+
+    @mock.patch('requests.request')
+    def test_writes_queue_behind_spooled_ones(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = [requests.ConnectionError(),
+                                    make_response(200)]
+        self.data_set.post([{'a': 1}])
+        self.data_set.post([{'a': 2}])
+        eq_(mock_request.call_count, 1)
+        eq_(self.spooled(), [[{'a': 1}], [{'a': 2}]])
+
+    @mock.patch('requests.request')
+    def test_deferred_writes_are_not_sent(self, mock_request):
+        mock_request.__name__ = 'request'
+        self.data_set.defer_writes = True
+        self.data_set.post([{'a': 1}])
+        eq_(mock_request.call_count, 0)
+        eq_(self.spooled(), [[{'a': 1}]])
+
+    @mock.patch('requests.request')
+    def test_streamed_writes_are_spooled_in_full(self, mock_request):
+        mock_request.__name__ = 'request'
+
+        def read_then_fail(**kwargs):
+            kwargs['data'].read()
+            return make_response(503)
+        mock_request.side_effect = read_then_fail
+        path = os.path.join(self.directory, 'records.jsonl')
+        with open(path, 'wb') as f:
+            f.write(b'{"a": 1}\n{"a": 2}\n')
+
+        self.data_set.post_json_lines(path)
+
+        eq_(self.spooled(), [[{'a': 1}, {'a': 2}]])
+
+    @mock.patch('requests.request')
+    def test_no_replacing_while_writes_are_spooled(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(200)
+        self.data_set.defer_writes = True
+        self.data_set.post([{'a': 1}])
+
+        assert_raises(SpoolNotEmpty, self.data_set.replace, [{'a': 2}])
+        assert_raises(SpoolNotEmpty, self.data_set.empty_data_set)
+        eq_(mock_request.call_count, 0)
+
+        Drainer(self.data_set, self.spool).run_once()
+        self.data_set.replace([{'a': 2}])
+        eq_(mock_request.call_count, 3)
+
+    @mock.patch('requests.request')
+    def test_large_writes_are_spooled_compressed(self, mock_request):
+        mock_request.__name__ = 'request'
+        self.data_set.defer_writes = True
+        records = [{'value': 'x' * 100, 'n': n} for n in range(50)]
+        self.data_set.post(records)
+        entry, = self.spool.read()
+        eq_(entry.content_encoding, 'gzip')
+        eq_(_records(entry.body, entry.content_encoding), records)
+
+
+class TestDrainer(SpoolTest):
+    def setup(self):
+        super(TestDrainer, self).setup()
+        self.spool = Spool(self.directory)
+        self.data_set = DataSet('http://backdrop/data/group/type', 'token',
+                                retry_on_error=False)
+        for number in range(3):
+            self.spool.append(json.dumps([{'n': number}]).encode('utf-8'))
+
+    def teardown(self):
+        self.spool.close()
+        super(TestDrainer, self).teardown()
+
+    @mock.patch('requests.request')
+    def test_writes_are_sent_in_order(self, mock_request):
+        mock_request.__name__ = 'request'
+        sent = []
+
+        def backdrop(**kwargs):
+            sent.append(_records(kwargs['data'],
+                                 kwargs['headers'].get('Content-Encoding')))
+            return make_response(200)
+        mock_request.side_effect = backdrop
+
+        drainer = Drainer(self.data_set, self.spool, batch=2)
+        eq_(drainer.run_once(), 3)
+        eq_(sent, [[{'n': 0}], [{'n': 1}], [{'n': 2}]])
+        eq_(self.spool.empty, True)
+
+    @mock.patch('requests.request')
+    def test_writes_are_acknowledged_a_batch_at_a_time(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(200)
+
+        with mock.patch.object(self.spool, 'ack',
+                               wraps=self.spool.ack) as ack:
+            Drainer(self.data_set, self.spool, batch=2).run_once()
+
+        eq_(ack.call_count, 2)
+        eq_(self.spool.empty, True)
+
+    @mock.patch('requests.request')
+    def test_draining_stops_while_the_api_is_down(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = [make_response(200),
+                                    requests.ConnectionError()]
+
+        drainer = Drainer(self.data_set, self.spool)
+        eq_(drainer.run_once(), 1)
+        eq_(drainer.failures, 1)
+        eq_([json.loads(entry.body) for entry in self.spool.read()],
+            [[{'n': 1}], [{'n': 2}]])
+
+    @mock.patch('requests.request')
+    def test_rejected_writes_are_dropped(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = [make_response(200), make_response(400, 'bad'),
+                                    make_response(200)]
+        rejected = []
+
+        drainer = Drainer(self.data_set, self.spool,
+                          on_reject=lambda entry, error: rejected.append(
+                              json.loads(entry.body)))
+        eq_(drainer.run_once(), 2)
+        eq_(drainer.rejected, 1)
+        eq_(rejected, [[{'n': 1}]])
+        eq_(self.spool.empty, True)
+
+    @mock.patch('requests.request')
+    def test_drained_writes_invalidate_cached_reads(self, mock_request):
+        mock_request.__name__ = 'request'
+        self.data_set.cache = QueryCache()
+        query = {'start_at': '2014-01-01T00:00:00Z',
+                 'end_at': '2014-01-02T00:00:00Z'}
+        mock_request.return_value = make_response(200, '{"data": []}')
+        eq_(self.data_set.get(query), {'data': []})
+
+        mock_request.return_value = make_response(200)
+        Drainer(self.data_set, self.spool).run_once()
+        mock_request.return_value = make_response(200, '{"data": [{"n": 0}]}')
+
+        eq_(self.data_set.get(query), {'data': [{'n': 0}]})
+
+    @mock.patch('performanceplatform.client.spool.time')
+    @mock.patch('requests.request')
+    def test_sending_is_paced(self, mock_request, mock_time):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response(200)
+        mock_time.time.return_value = 100.0
+
+        drainer = Drainer(self.data_set, self.spool, bytes_per_second=5)
+        drainer.run_once()
+        # Each entry is 10 bytes, so 2 then 4 seconds after starting
+        eq_([call[0][0] for call in mock_time.sleep.call_args_list],
+            [2.0, 4.0])
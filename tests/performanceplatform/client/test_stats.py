@@ -0,0 +1,10 @@
+from nose.tools import eq_
+
+from performanceplatform.client.stats import percentile
+
+
+class TestPercentile(object):
+    def test_percentile(self):
+        eq_(percentile([], 0.5), None)
+        eq_(percentile([3, 1, 2, 4], 0.5), 3)
+        eq_(percentile([3, 1, 2, 4], 0.99), 4)
@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+from nose.tools import eq_, assert_raises
+from requests import HTTPError
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.sync import (
+    HashIndex, key_digest, make_key_fn, record_digest
+)
+from .helpers import make_response
+
+
+def posted_records(mock_request):
+    records = []
+    for call in mock_request.call_args_list:
+        records.extend(json.loads(call[1]['data']))
+    return records
+
+
+class TestHashIndex(object):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_entries_survive_reopening(self):
+        with HashIndex(self.path) as index:
+            for n in range(100):
+                index.set(key_digest(n), record_digest({'n': n}))
+
+        index = HashIndex(self.path)
+        eq_(len(index), 100)
+        eq_(index.get(key_digest(42)), record_digest({'n': 42}))
+        eq_(index.get(key_digest(100)), None)
+        eq_(os.path.getsize(self.path), 8 + 100 * 20)
+
+    def test_updates_are_merged_with_stored_entries(self):
+        with HashIndex(self.path) as index:
+            index.set(key_digest('a'), record_digest(1))
+            index.set(key_digest('b'), record_digest(1))
+
+        with HashIndex(self.path) as index:
+            index.set(key_digest('b'), record_digest(2))
+            index.set(key_digest('c'), record_digest(2))
+            eq_(len(index), 3)
+
+        index = HashIndex(self.path)
+        eq_(len(index), 3)
+        eq_(index.get(key_digest('a')), record_digest(1))
+        eq_(index.get(key_digest('b')), record_digest(2))
+
+    def test_pending_updates_spill_to_disk(self):
+        with HashIndex(self.path, max_pending=10) as index:
+            for n in range(25):
+                index.set(key_digest(n), record_digest({'n': n}))
+            index.set(key_digest(3), record_digest({'n': -3}))
+
+            eq_(len(index._pending), 6)
+            eq_(len(index._runs), 2)
+            eq_(index.get(key_digest(3)), record_digest({'n': -3}))
+            eq_(index.get(key_digest(24)), record_digest({'n': 24}))
+            eq_(len(index), 25)
+
+        index = HashIndex(self.path)
+        eq_(len(index), 25)
+        eq_(index.get(key_digest(3)), record_digest({'n': -3}))
+        eq_(index.get(key_digest(12)), record_digest({'n': 12}))
+        eq_(os.listdir(self.tmp), ['index'])
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not an index at all')
+
+        assert_raises(ValueError, HashIndex, self.path)
+
+    def test_record_digest_ignores_key_order(self):
+        eq_(record_digest({'a': 1, 'b': 2}), record_digest({'b': 2, 'a': 1}))
+
+    def test_compound_keys(self):
+        identity = make_key_fn(['a', 'b'])
+
+        eq_(identity({'a': 1, 'b': 2, 'c': 3}), [1, 2])
+        eq_(identity({'c': 3}), None)
+
+
+class TestSync(object):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.index = HashIndex(os.path.join(self.tmp, 'index'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp)
+
+    @mock.patch('requests.request')
+    def test_only_changed_records_are_sent(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('', None)
+
+        data_set.sync([{'_id': 'a', 'n': 1}, {'_id': 'b', 'n': 1}],
+                      self.index)
+        mock_request.reset_mock()
+        counts = data_set.sync(
+            [{'_id': 'a', 'n': 1}, {'_id': 'b', 'n': 2}, {'_id': 'c'}],
+            self.index, chunk_size=1)
+
+        eq_(counts, {'sent': 2, 'unchanged': 1})
+        eq_(posted_records(mock_request),
+            [{'_id': 'b', 'n': 2}, {'_id': 'c'}])
+
+    @mock.patch('requests.request')
+    def test_records_without_a_key_are_always_sent(self, mock_request):
+        mock_request.__name__ = 'request'
+        data_set = DataSet('', None)
+
+        for _ in range(2):
+            data_set.sync([{'n': 1}], self.index, key='name')
+
+        eq_(mock_request.call_count, 2)
+
+    @mock.patch('requests.request')
+    def test_failed_chunks_are_not_recorded(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.side_effect = [make_response(), make_response(400, '')]
+        data_set = DataSet('', None)
+
+        assert_raises(HTTPError, data_set.sync,
+                      [{'_id': 'a'}, {'_id': 'b'}], self.index, chunk_size=1)
+
+        eq_(self.index.get(key_digest('a')), record_digest({'_id': 'a'}))
+        eq_(self.index.get(key_digest('b')), None)
@@ -0,0 +1,165 @@
+import datetime
+
+import mock
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.data_set import DataSet
+from performanceplatform.client.validation import (
+    SchemaCache, ValidationError, Validator, compile_schema
+)
+from .helpers import FakeAdmin, make_response
+
+
+SCHEMA = {
+    'definitions': {
+        'count': {'type': 'integer', 'minimum': 0},
+    },
+    'type': 'object',
+    'properties': {
+        'count': {'$ref': '#/definitions/count'},
+        'channel': {'enum': ['web', 'phone']},
+        'name': {'type': ['string', 'null'], 'maxLength': 5},
+        'started': {'type': 'string', 'format': 'date-time'},
+    },
+    'required': ['count'],
+}
+
+
+class TestCompileSchema(object):
+    def test_valid_values(self):
+        check = compile_schema(SCHEMA)
+
+        eq_(check({'count': 3}), [])
+        eq_(check({'count': 0, 'channel': 'web', 'name': None,
+                   'started': '2014-01-01T00:00:00Z', 'other': 1}), [])
+        eq_(check({'count': 1,
+                   'started': datetime.datetime(2014, 1, 1)}), [])
+
+    def test_invalid_values(self):
+        check = compile_schema(SCHEMA)
+
+        eq_(check({}), ['count is required'])
+        eq_(sorted(check({'count': -1, 'channel': 'post',
+                          'name': 'too long', 'started': 'yesterday'})),
+            ["channel must be one of ['web', 'phone']",
+             'count must be at least 0',
+             'name must be at most 5 characters',
+             'started must be an ISO 8601 date-time'])
+        eq_(check({'count': True}), ['count must be integer'])
+
+    def test_closed_objects_and_arrays(self):
+        check = compile_schema({
+            'properties': {'tags': {'type': 'array',
+                                    'items': {'type': 'string'}}},
+            'additionalProperties': False})
+
+        eq_(check({'tags': ['a', 'b']}), [])
+        eq_(sorted(check({'tags': ['a', 1], 'extra': 1})),
+            ['extra is not allowed', 'tags[] must be string'])
+
+    def test_combinations(self):
+        check = compile_schema({'anyOf': [{'type': 'string'},
+                                          {'type': 'integer'}]})
+
+        eq_(check(1), [])
+        eq_(check(1.5), ['record matches none of the anyOf schemas'])
+
+    def test_draft_3_required_properties(self):
+        check = compile_schema({'properties': {'a': {'required': True}}})
+
+        eq_(check({}), ['a is required'])
+
+    def test_unknown_keywords_are_ignored(self):
+        eq_(compile_schema({'dependencies': {'a': ['b']}})({'a': 1}), [])
+
+
+class TestValidator(object):
+    def test_backdrop_rules_apply_without_a_schema(self):
+        validator = Validator()
+
+        eq_(validator.errors({'_id': 'abc', '_timestamp':
+                              '2014-01-01T00:00:00+00:00'}), [])
+        eq_(validator.errors({'_id': 'a b', '_timestamp': 'monday'}),
+            ['_timestamp is not a valid ISO 8601 timestamp',
+             '_id is not a valid id'])
+        eq_(validator.errors('nope'), ['record must be an object'])
+
+    def test_split(self):
+        valid, rejected = Validator(SCHEMA).split(
+            [{'count': 1}, {'count': 'x'}, {'count': 2}])
+
+        eq_(valid, [{'count': 1}, {'count': 2}])
+        eq_(rejected, [({'count': 'x'}, ['count must be integer'])])
+
+    def test_check_raises_without_a_reject_channel(self):
+        try:
+            Validator(SCHEMA).check([{'count': 1}, {}])
+        except ValidationError as e:
+            eq_(e.rejected, [({}, ['count is required'])])
+        else:
+            raise AssertionError('ValidationError not raised')
+
+
+class TestPostWithValidation(object):
+    @mock.patch('requests.request')
+    def test_invalid_records_are_rejected_and_valid_ones_sent(
+            self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        rejected = []
+
+        DataSet('http://backdrop', None).post(
+            [{'count': 1}, {'count': -1}, {'count': 2}],
+            validator=Validator(SCHEMA),
+            reject=lambda record, errors: rejected.append(record))
+
+        eq_(mock_request.call_count, 1)
+        eq_(mock_request.call_args[1]['data'], '[{"count": 1}, {"count": 2}]')
+        eq_(rejected, [{'count': -1}])
+
+    @mock.patch('requests.request')
+    def test_nothing_is_sent_if_any_record_is_invalid(self, mock_request):
+        data_set = DataSet('http://backdrop', None)
+
+        assert_raises(ValidationError, data_set.post,
+                      [{'count': 1}, {}], validator=Validator(SCHEMA))
+        eq_(data_set.post({}, validator=Validator(SCHEMA),
+                          reject=lambda record, errors: None), None)
+        eq_(mock_request.call_count, 0)
+
+    @mock.patch('requests.request')
+    def test_chunks_only_contain_valid_records(self, mock_request):
+        mock_request.__name__ = 'request'
+        mock_request.return_value = make_response()
+        records = [{'count': i - 5} for i in range(20)]
+
+        DataSet('http://backdrop', None).post(
+            records, chunk_size=5, validator=Validator(SCHEMA),
+            reject=lambda record, errors: None)
+
+        eq_(mock_request.call_count, 3)
+
+
+def _admin():
+    return FakeAdmin({
+        'get_data_set': lambda data_group, data_type: None
+        if data_type == 'missing' else {'name': data_type, 'schema': SCHEMA},
+        'get_data_set_by_name': {'name': 'claims', 'schema': SCHEMA},
+    })
+
+
+class TestSchemaCache(object):
+    def test_schemas_are_fetched_once(self):
+        admin = _admin()
+        schemas = SchemaCache(admin)
+
+        validator = schemas.validator('group', 'claims')
+
+        assert schemas.validator('group', 'claims') is validator
+        eq_(validator.schema, SCHEMA)
+        schemas.validator_by_name('claims')
+        eq_(len(admin.calls), 2)
+
+    def test_unknown_data_sets(self):
+        assert_raises(ValueError, SchemaCache(_admin()).validator,
+                      'group', 'missing')
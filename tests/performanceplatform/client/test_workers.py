@@ -0,0 +1,49 @@
+import threading
+import time
+
+from nose.tools import eq_, assert_raises
+
+from performanceplatform.client.workers import imap_bounded
+
+
+class TestImapBounded(object):
+    def test_results_are_in_input_order(self):
+        def slow_for_small(n):
+            time.sleep(0.01 * (5 - n))
+            return n * 2
+
+        eq_(list(imap_bounded(slow_for_small, range(5), workers=3)),
+            [0, 2, 4, 6, 8])
+
+    def test_runs_inline_with_one_worker(self):
+        threads = set()
+
+        def record_thread(n):
+            threads.add(threading.current_thread())
+            return n
+
+        list(imap_bounded(record_thread, range(3), workers=1))
+
+        eq_(threads, set([threading.current_thread()]))
+
+    def test_does_not_read_input_far_ahead(self):
+        pulled = []
+
+        def source():
+            for n in range(100):
+                pulled.append(n)
+                yield n
+
+        results = imap_bounded(lambda n: n, source(), workers=2)
+        next(results)
+
+        assert len(pulled) <= 4
+
+    def test_errors_are_raised_to_the_consumer(self):
+        def explode(n):
+            if n == 3:
+                raise ValueError('boom')
+            return n
+
+        assert_raises(
+            ValueError, list, imap_bounded(explode, range(10), workers=2))